@@ -0,0 +1,41 @@
+"""
+异步数据库访问
+sqlite3 的调用都会阻塞（读盘、等写锁、提交时 fsync），async 接口不在事件循环里直接调用：
+读在读线程池中执行，线程数不超过连接池大小，借连接不用排队；
+写在唯一的写线程中依次执行（见 writer.py），进程内的写入不在 SQLite 写锁上互相等待，慢提交也只排在写线程上
+
+    contracts = await adb.read(repo.list_contracts, limit)
+    await adb.write(repo.delete_invoice, invoice_id)
+
+同步代码（如识别结果入库）直接向 adb.writer 提交任务，与接口的写入排在同一队列
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from db import DB_POOL_SIZE
+from writer import Writer
+
+DB_READ_THREADS = int(os.getenv("DB_READ_THREADS", str(DB_POOL_SIZE)))
+
+
+class AsyncDB:
+    def __init__(self, readers: int = DB_READ_THREADS):
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-read")
+        self.writer = Writer()
+
+    async def read(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在读线程中执行 func(*args, **kwargs)"""
+        return await asyncio.wrap_future(self._readers.submit(partial(func, *args, **kwargs)))
+
+    async def write(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在写线程中执行 func(*args, **kwargs)，与其他写入依次进行"""
+        return await asyncio.wrap_future(self.writer.submit(partial(func, *args, **kwargs)))
+
+    def close(self):
+        """等待已提交的读写完成后退出线程"""
+        self._readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
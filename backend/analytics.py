@@ -0,0 +1,97 @@
+"""
+分析查询
+在列式快照（见 snapshot.py）上计算财务报表，不读 SQLite，不与上传入库争用数据库；
+分区文件以内存映射方式打开（零拷贝，只有用到的列才会读入内存），按月份范围只打开需要的分区。
+结果反映最近一次快照（返回的 snapshot_at），而不是实时数据
+"""
+
+from typing import List, Optional
+
+from money import to_yuan
+from snapshot import SNAPSHOT_DIR, SnapshotUnavailable, partition_path, read_manifest, require_pyarrow, schemas
+
+
+def _months(manifest: dict, start: Optional[str], end: Optional[str]) -> List[str]:
+    return [month for month in manifest["months"]
+            if (start is None or month >= start) and (end is None or month <= end)]
+
+
+def load(kind: str, months: List[str], directory: str = SNAPSHOT_DIR):
+    """内存映射读取这些月份的分区并拼成一张表"""
+    pa = require_pyarrow()
+    tables = [pa.ipc.open_file(pa.memory_map(partition_path(directory, kind, month), "r")).read_all()
+              for month in months]
+    return pa.concat_tables(tables) if tables else schemas()[kind].empty_table()
+
+
+def _manifest(directory: str) -> dict:
+    manifest = read_manifest(directory)
+    if not manifest["updated_at"]:
+        raise SnapshotUnavailable("还没有快照，请先运行 POST /snapshots/refresh 或 python snapshot.py")
+    return manifest
+
+
+def monthly_totals(start: Optional[str] = None, end: Optional[str] = None, directory: str = SNAPSHOT_DIR) -> dict:
+    """按订单月份汇总：合同数、完成数、合同额、已开票、未开票、发票数、核对有问题的发票金额"""
+    pc = require_pyarrow().compute
+
+    manifest = _manifest(directory)
+    months = _months(manifest, start, end)
+    contracts = load("contracts", months, directory).group_by("month").aggregate([
+        ("id", "count"), ("is_complete", "sum"), ("total_amount_fen", "sum"),
+        ("invoiced_amount_fen", "sum"), ("invoice_count", "sum"),
+    ])
+    invoices = load("invoices", months, directory)
+    mismatched = invoices.filter(pc.equal(invoices["status"], "mismatch")).group_by("month").aggregate([
+        ("amount_fen", "sum"), ("id", "count"),
+    ])
+    mismatch = dict(zip(mismatched["month"].to_pylist(),
+                        zip(mismatched["amount_fen_sum"].to_pylist(), mismatched["id_count"].to_pylist())))
+
+    rows = []
+    for month, count, complete, total, invoiced, invoice_count in zip(
+            *(contracts[name].to_pylist() for name in ("month", "id_count", "is_complete_sum", "total_amount_fen_sum",
+                                                       "invoiced_amount_fen_sum", "invoice_count_sum"))):
+        mismatch_fen, mismatch_count = mismatch.get(month, (0, 0))
+        rows.append({
+            "month": month,
+            "contracts": count,
+            "complete": complete,
+            "total_amount": to_yuan(total),
+            "invoiced_amount": to_yuan(invoiced),
+            "outstanding_amount": to_yuan(total - invoiced),
+            "invoices": invoice_count,
+            "mismatch_invoices": mismatch_count,
+            "mismatch_amount": to_yuan(mismatch_fen or 0),
+        })
+    rows.sort(key=lambda row: row["month"])
+    return {"snapshot_at": manifest["updated_at"], "months": rows}
+
+
+def outstanding_balances(limit: int = 50, start: Optional[str] = None, end: Optional[str] = None,
+                         directory: str = SNAPSHOT_DIR) -> dict:
+    """未开票余额（合同额 - 已开票）最大的合同，及余额合计；超额开票（余额为负）的合同单独计数"""
+    pc = require_pyarrow().compute
+
+    manifest = _manifest(directory)
+    contracts = load("contracts", _months(manifest, start, end), directory)
+    balance = pc.subtract(contracts["total_amount_fen"], contracts["invoiced_amount_fen"])
+    contracts = contracts.append_column("balance_fen", balance)
+    open_contracts = contracts.filter(pc.greater(balance, 0))
+    top = open_contracts.take(pc.select_k_unstable(open_contracts, k=min(limit, open_contracts.num_rows),
+                                                   sort_keys=[("balance_fen", "descending")]))
+    return {
+        "snapshot_at": manifest["updated_at"],
+        "outstanding_amount": to_yuan(pc.sum(open_contracts["balance_fen"]).as_py() or 0),
+        "open_contracts": open_contracts.num_rows,
+        "over_invoiced_contracts": pc.sum(pc.less(balance, 0)).as_py() or 0,
+        "contracts": [{
+            "id": row["id"],
+            "po_number": row["po_number"],
+            "order_date": row["order_date"],
+            "total_amount": to_yuan(row["total_amount_fen"]),
+            "invoiced_amount": to_yuan(row["invoiced_amount_fen"]),
+            "outstanding_amount": to_yuan(row["balance_fen"]),
+        } for row in top.select(["id", "po_number", "order_date", "total_amount_fen", "invoiced_amount_fen",
+                                 "balance_fen"]).to_pylist()],
+    }
@@ -0,0 +1,365 @@
+"""
+批量导入导出
+合同、发票与 CSV / XLSX 互转，供 POST /import、GET /export 和命令行使用（ERP 历史数据迁移）
+
+导入：逐行解析、按 IMPORT_BATCH 行一批 executemany，全部在一个写事务内完成；
+任一行有误则整体回滚并返回出错的行号。已存在的采购单号跳过（可重复导入合同），
+发票导入后按涉及的合同重新核对（见 reconcile.py）
+导出：游标按 EXPORT_BATCH 行分批读取并逐批输出，不把整表读进内存
+
+XLSX 需要 openpyxl（按需导入）；CSV 为 UTF-8（导出带 BOM，Excel 可直接打开）
+
+命令行：
+    python bulk.py import contracts 合同.csv
+    python bulk.py import invoices 发票.xlsx
+    python bulk.py export invoices 发票.csv
+"""
+
+import csv
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import BinaryIO, Dict, Iterable, Iterator, List
+
+from db import dialect
+from money import to_fen, to_yuan
+from migrations import SEARCH_INDEXES
+from po_match import normalize_po
+from reconcile import describe_flags, reconcile
+
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "5000"))
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "5000"))
+MAX_IMPORT_ERRORS = 20  # 最多报告的出错行数
+
+FORMATS = {"csv": "text/csv; charset=utf-8",
+           "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+
+# 导入列：字段 -> 是否必填；表头也可以用中文名
+IMPORT_COLUMNS = {
+    "contracts": {"po_number": True, "order_date": True, "quantity": True, "total_amount": True, "file_name": False},
+    "invoices": {"contract_number": True, "spec_model": False, "quantity": True, "amount": True, "file_name": False},
+}
+HEADER_ALIASES = {
+    "采购单号": "po_number", "订单日期": "order_date", "数量": "quantity", "合同总额": "total_amount",
+    "合同号": "contract_number", "规格型号": "spec_model", "金额": "amount", "文件名": "file_name",
+}
+
+# 导出列与查询（金额导出为元）
+EXPORT_SQL = {
+    "contracts": ('''SELECT id, po_number, order_date, quantity, total_amount_fen, invoiced_amount_fen,
+                            invoiced_quantity, invoice_count, is_complete, file_name, created_at
+                     FROM contracts ORDER BY id''',
+                  ["id", "po_number", "order_date", "quantity", "total_amount", "invoiced_amount",
+                   "invoiced_quantity", "invoice_count", "status", "file_name", "created_at"]),
+    "invoices": ('''SELECT id, contract_id, contract_number, spec_model, quantity, amount_fen, status,
+                           check_flags, file_name, created_at
+                    FROM invoices ORDER BY id''',
+                 ["id", "contract_id", "contract_number", "spec_model", "quantity", "amount", "status",
+                  "issues", "file_name", "created_at"]),
+}
+
+
+class BulkImportError(Exception):
+    """导入数据有误（整批已回滚）；errors 为 [{"row": 行号, "error": 原因}]"""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(f"{len(errors)} 行数据有误，已全部回滚")
+        self.errors = errors
+
+
+def detect_format(filename: str) -> str:
+    """按扩展名判断格式；XLSX 在此检查 openpyxl，避免导出开始后才失败"""
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext not in FORMATS:
+        raise ValueError(f"不支持的文件格式: {ext or '未知'}（支持 csv / xlsx）")
+    if ext == "xlsx":
+        _openpyxl()
+    return ext
+
+
+def _openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("XLSX 需要安装 openpyxl（pip install openpyxl），或改用 CSV")
+    return openpyxl
+
+
+# ---------- 读取 ----------
+
+def read_records(stream: BinaryIO, fmt: str) -> Iterator[dict]:
+    """逐行读取表格，返回 {字段: 值}（表头按 HEADER_ALIASES 归一，空单元格为 None）"""
+    if fmt == "csv":
+        rows = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    else:
+        workbook = _openpyxl().load_workbook(stream, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    keys = [HEADER_ALIASES.get(str(h).strip(), str(h).strip()) if h is not None else None for h in header]
+    for row in rows:
+        values = [None if v is None or (isinstance(v, str) and not v.strip()) else v for v in row]
+        if any(v is not None for v in values):
+            yield dict(zip(keys, values))
+
+
+def _text(value) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _decimal(value) -> Decimal:
+    try:
+        return Decimal(_text(value).replace(",", ""))
+    except InvalidOperation:
+        raise ValueError(f"不是数字: {value}")
+
+
+def _int(value) -> int:
+    number = _decimal(value)
+    if number != number.to_integral_value():
+        raise ValueError(f"不是整数: {value}")
+    return int(number)
+
+
+def _fen(value) -> int:
+    return to_fen(_decimal(value))
+
+
+def _required(record: dict, kind: str):
+    missing = [key for key, required in IMPORT_COLUMNS[kind].items() if required and record.get(key) is None]
+    if missing:
+        raise ValueError(f"缺少 {', '.join(missing)}")
+
+
+# ---------- 导入 ----------
+
+def import_records(conn: sqlite3.Connection, kind: str, records: Iterable[dict]) -> dict:
+    """导入合同或发票（kind 为 'contracts' / 'invoices'），返回统计；数据有误时抛出 BulkImportError"""
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if kind == "contracts":
+            summary = _import_contracts(conn, records)
+        else:
+            summary = _import_invoices(conn, records)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    touched = summary.pop("contract_ids", None)
+    if touched:
+        # 发票核对依赖入库顺序内的累计值，按涉及的合同整体重新核对
+        summary["reconcile"] = reconcile(conn, contract_ids=touched if len(touched) <= 10000 else None)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+# 逐行触发器是大批量导入的主要开销（全文索引逐行写入约占一半以上）：
+# 导入事务内暂时删除这些 INSERT 触发器，插入完成后集中维护，再按原定义重建；事务回滚时删除也一并回滚
+DEFERRED_TRIGGERS = {
+    "contracts": ["trg_contracts_fts_insert"],
+    "invoices": ["trg_invoices_totals_insert", "trg_invoices_fts_insert"],
+}
+
+
+@contextmanager
+def _deferred_triggers(conn: sqlite3.Connection, table: str):
+    if dialect(conn) != "sqlite":
+        # PostgreSQL 没有全文表要逐行写入（检索走 GIN 索引），删改触发器还要锁表，触发器照常执行
+        yield
+        return
+    names = DEFERRED_TRIGGERS[table]
+    saved = conn.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({','.join('?' * len(names))})",
+                         names).fetchall()
+    for name, _ in saved:
+        conn.execute(f"DROP TRIGGER {name}")
+    last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+    yield
+    dropped = {name for name, _ in saved}
+    if f"trg_{table}_fts_insert" in dropped:
+        columns = ", ".join(SEARCH_INDEXES[table])
+        conn.execute(f"INSERT INTO {table}_fts(rowid, {columns}) SELECT id, {columns} FROM {table} WHERE id > ?", (last_id,))
+    if "trg_invoices_totals_insert" in dropped:
+        # 与触发器相同的增量汇总，按合同聚合后一次更新
+        conn.execute('''UPDATE contracts SET
+                            invoiced_amount_fen = invoiced_amount_fen + added.amount_fen,
+                            invoiced_quantity = invoiced_quantity + added.quantity,
+                            invoice_count = invoice_count + added.count
+                        FROM (SELECT contract_id, COALESCE(SUM(amount_fen), 0) AS amount_fen,
+                                     COALESCE(SUM(quantity), 0) AS quantity, COUNT(*) AS count
+                              FROM invoices WHERE id > ? GROUP BY contract_id) AS added
+                        WHERE contracts.id = added.contract_id''', (last_id,))
+    for _, sql in saved:
+        conn.execute(sql)
+
+
+def _load_batches(conn: sqlite3.Connection, sql: str, records: Iterable[dict], parse) -> dict:
+    """解析每行并分批 executemany；有错误时只继续解析（用于报告），不再写入"""
+    rows, errors = [], []
+    total = inserted = 0
+    for line, record in enumerate(records, start=2):  # 第1行为表头
+        total += 1
+        try:
+            row = parse(record)
+        except (ValueError, ArithmeticError) as e:
+            errors.append({"row": line, "error": str(e)})
+            if len(errors) >= MAX_IMPORT_ERRORS:
+                break
+            continue
+        if errors:
+            continue
+        rows.append(row)
+        if len(rows) >= IMPORT_BATCH:
+            inserted += conn.executemany(sql, rows).rowcount
+            rows.clear()
+    if errors:
+        raise BulkImportError(errors)
+    if rows:
+        inserted += conn.executemany(sql, rows).rowcount
+    return {"rows": total, "inserted": inserted, "skipped": total - inserted}
+
+
+def _import_contracts(conn: sqlite3.Connection, records: Iterable[dict]) -> dict:
+    def parse(record: dict) -> tuple:
+        _required(record, "contracts")
+        po_number = _text(record["po_number"])
+        return (po_number, normalize_po(po_number), _text(record["order_date"]), _int(record["quantity"]),
+                _fen(record["total_amount"]), _text(record["file_name"]) if record.get("file_name") else None)
+
+    # 已存在的采购单号跳过
+    with _deferred_triggers(conn, "contracts"):
+        return _load_batches(conn, '''INSERT INTO contracts (po_number, po_key, order_date, quantity, total_amount_fen, file_name)
+                                      VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(po_number) DO NOTHING''', records, parse)
+
+
+def _import_invoices(conn: sqlite3.Connection, records: Iterable[dict]) -> dict:
+    contracts: Dict[str, int] = dict(conn.execute("SELECT po_number, id FROM contracts"))
+    touched = set()
+
+    def parse(record: dict) -> tuple:
+        _required(record, "invoices")
+        number = _text(record["contract_number"])
+        contract_id = contracts.get(number)
+        if contract_id is None:
+            raise ValueError(f"未找到对应合同: {number}")
+        touched.add(contract_id)
+        spec_model = _text(record["spec_model"]) if record.get("spec_model") is not None else None
+        return (contract_id, number, spec_model, _int(record["quantity"]), _fen(record["amount"]),
+                _text(record["file_name"]) if record.get("file_name") else None)
+
+    # 状态先记为 pending，提交后由 reconcile 核对
+    with _deferred_triggers(conn, "invoices"):
+        summary = _load_batches(conn, '''INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen, file_name)
+                                         VALUES (?, ?, ?, ?, ?, ?)''', records, parse)
+    summary["contract_ids"] = touched
+    return summary
+
+
+# ---------- 导出 ----------
+
+def export_rows(conn: sqlite3.Connection, kind: str) -> Iterator[list]:
+    """按 id 顺序逐批读取，返回导出列的值（第一行为表头）"""
+    sql, header = EXPORT_SQL[kind]
+    yield header
+    # PostgreSQL 用服务端游标，否则 execute 会一次取回全部结果
+    cursor = conn.cursor("export") if dialect(conn) == "postgresql" else conn.cursor()
+    try:
+        cursor.execute(sql)
+        while True:
+            batch = cursor.fetchmany(EXPORT_BATCH)
+            if not batch:
+                return
+            for row in batch:
+                if kind == "contracts":
+                    (contract_id, po_number, order_date, qty, total_fen, invoiced_fen, invoiced_qty, count,
+                     is_complete, file_name, created_at) = row
+                    yield [contract_id, po_number, order_date, qty, to_yuan(total_fen), to_yuan(invoiced_fen),
+                           invoiced_qty, count, "complete" if is_complete else "incomplete", file_name, created_at]
+                else:
+                    (invoice_id, contract_id, number, spec, qty, fen, status, flags, file_name, created_at) = row
+                    yield [invoice_id, contract_id, number, spec, qty, to_yuan(fen) if fen is not None else None,
+                           status, "|".join(describe_flags(flags or 0)), file_name, created_at]
+    finally:
+        cursor.close()
+
+
+def stream_csv(rows: Iterable[list]) -> Iterator[bytes]:
+    """CSV 分块输出（每 EXPORT_BATCH 行一块），开头带 UTF-8 BOM"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_xlsx(rows: Iterable[list], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    XLSX 输出：write_only 模式逐行写入临时文件（内存占用与行数无关），完成后分块读出
+    （XLSX 是 ZIP 格式，写完之前无法输出）
+    """
+    workbook = _openpyxl().Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as tmp:
+        workbook.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_export(conn: sqlite3.Connection, kind: str, fmt: str) -> Iterator[bytes]:
+    rows = export_rows(conn, kind)
+    return stream_csv(rows) if fmt == "csv" else stream_xlsx(rows)
+
+
+if __name__ == "__main__":
+    from db import DB_NAME, connection
+    from migrations import migrate
+
+    if len(sys.argv) != 4 or sys.argv[1] not in ("import", "export") or sys.argv[2] not in EXPORT_SQL:
+        sys.exit("用法: python bulk.py import|export contracts|invoices 文件.csv|文件.xlsx")
+    action, kind, path = sys.argv[1:]
+    try:
+        fmt = detect_format(path)
+    except ValueError as e:
+        sys.exit(str(e))
+    with connection() as conn:
+        migrate(conn)
+        if action == "import":
+            try:
+                with open(path, "rb") as f:
+                    summary = import_records(conn, kind, read_records(f, fmt))
+            except (BulkImportError, ValueError) as e:
+                for error in getattr(e, "errors", []):
+                    print(f"第 {error['row']} 行: {error['error']}", file=sys.stderr)
+                sys.exit(str(e))
+            print(f"{DB_NAME}: {summary}")
+        else:
+            with open(path, "wb") as f:
+                for chunk in stream_export(conn, kind, fmt):
+                    f.write(chunk)
+            print(f"{DB_NAME}: 已导出 {kind} 到 {path}")
@@ -0,0 +1,201 @@
+"""
+读缓存
+进程内 LRU 缓存合同列表和合同发票的查询结果；写入提交后按合同精确失效：
+某个合同的发票变化只清掉该合同的发票缓存和合同列表（汇总），其他合同的发票缓存不受影响
+
+多 worker 运行时（见 shared.py）失效记录写入共享日志，每次读缓存前先应用其他 worker 的失效
+
+外部写入（命令行工具、Streamlit 直连、其他实例）不经过精确失效：每次读缓存前核对数据库的数据版本
+（见 db.commit_versioned），有不是本进程（多 worker 时本机各 worker）提交的版本时清空整个缓存。
+ETag 直接取数据库的数据版本，所有进程、实例一致
+"""
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from db import read_data_version
+from shared import SharedLog, open_log
+
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "256"))  # 最多缓存的查询结果数，0 表示不缓存
+
+# 缓存键的第一个元素是命名空间
+SUMMARY = "contracts"  # 合同列表：(SUMMARY, 查询参数...)
+INVOICES = "invoices"  # 合同发票：(INVOICES, contract_id)
+
+# 共享日志中的记录 (失效, 数据版本)：失效为合同 id（该合同的发票及所有合同列表）或以下两个特殊值，
+# 数据版本为本机 worker 提交的版本（其失效由提交方写入日志，提交失败时写入负数撤回），两者只有一个不为 0
+_RECORD = struct.Struct("<qq")
+_ALL = -1  # 清空
+_SUMMARIES = -2  # 只清合同列表
+CACHE_LOG_SLOTS = 4096  # 共享日志保留的记录数，落后更多的 worker 清空整个缓存
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存，记录命中/未命中/淘汰次数"""
+
+    def __init__(self, maxsize: int = READ_CACHE_SIZE, log: Optional[SharedLog] = None, pool=None):
+        self.maxsize = maxsize
+        self._log = log
+        self._seen = log.seq if log is not None else 0  # 已应用到的共享日志序号
+        # 核对外部写入：pool 上提交的版本为本进程写入，其余为外部写入（不传 pool 时不核对）
+        self._pool = pool
+        self._db_version = None  # 已核对到的 (库标识, 数据版本)
+        self._own = set()  # 已提交或正在提交、尚未核对到的本进程（本机各 worker）数据版本
+        if pool is not None:
+            pool.watch_versions(self)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # 每次失效加一；查询期间发生过失效的结果不写入缓存，避免缓存住写入前读到的旧数据
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def data_version(self) -> Optional[str]:
+        """数据库的数据版本（用于 ETag），任何进程、实例写入后都会变化；同时核对外部写入"""
+        current = self._check()
+        return None if current is None else f"{current[0]}-{current[1]}"
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        self._check()
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        self._check()
+        with self._lock:
+            if self.maxsize > 0 and generation == self._generation:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, match: Callable[[Hashable], bool]):
+        """删除 match(key) 为真的条目"""
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
+
+    def invalidate_contracts(self, *contract_ids: int):
+        """合同或其发票有写入：清掉这些合同的发票缓存和所有合同列表"""
+        if self._log is not None:
+            self._publish(*(contract_ids or [_SUMMARIES]))
+            return
+        ids = set(contract_ids)
+        self.invalidate(lambda key: key[0] == SUMMARY or (key[0] == INVOICES and key[1] in ids))
+
+    def clear(self):
+        if self._log is not None:
+            self._publish(_ALL)
+            return
+        self.invalidate(lambda key: True)
+
+    def _publish(self, *records: int):
+        """写入共享日志，再和其他 worker 一样从日志应用"""
+        self._log.append(*(_RECORD.pack(record, 0) for record in records))
+        self._sync()
+
+    def own_version(self, version: int):
+        """本进程的写事务即将提交该版本（由连接池调用，见 db.ConnectionPool.watch_versions）"""
+        if self._log is not None:
+            self._log.append(_RECORD.pack(0, version))
+        with self._lock:
+            if len(self._own) >= CACHE_LOG_SLOTS:
+                # 长时间没有读缓存：不再逐个记录，下次核对时清空
+                self._own.clear()
+                self._db_version = None
+            self._own.add(version)
+
+    def drop_version(self, version: int):
+        """提交失败：该版本号会被之后的事务（可能是外部写入）重用，撤回，下次核对时清空整个缓存"""
+        if self._log is not None:
+            self._log.append(_RECORD.pack(0, -version))
+        with self._lock:
+            self._own.discard(version)
+            self._db_version = None
+
+    def _check(self):
+        """应用共享日志，再核对数据库的数据版本：其间有外部写入时清空整个缓存；返回当前 (库标识, 数据版本)"""
+        if self._pool is None:
+            self._sync()
+            return None
+        # 先读数据库再读日志：其他 worker 在提交前写入日志，读到的版本若是本机提交的，日志中一定已有
+        with self._pool.connection() as conn:
+            current = read_data_version(conn)
+        self._sync()
+        with self._lock:
+            seen = self._db_version
+            if current is None or current == seen:
+                return current
+            if seen is not None and current[0] == seen[0]:
+                if current[1] < seen[1]:
+                    return current  # 其他线程已核对到更新的版本
+                own = sum(1 for version in self._own if seen[1] < version <= current[1])
+                external = current[1] - seen[1] > own
+            else:
+                external = True
+            self._db_version = current
+            self._own = {version for version in self._own if version > current[1]}
+        if external:
+            self.invalidate(lambda key: True)
+        return current
+
+    def _sync(self):
+        """应用其他 worker 写入的失效记录和提交的数据版本"""
+        if self._log is None:
+            return
+        seq, records = self._log.read(self._seen)
+        if seq == self._seen:
+            return
+        if records is None:
+            match = lambda key: True  # 落后太多，记录已被覆盖
+            with self._lock:
+                self._db_version = None  # 其中的版本号也一并丢失
+        else:
+            unpacked = [_RECORD.unpack(record) for record in records]
+            ids = {record for record, _ in unpacked if record}
+            with self._lock:
+                for _, version in unpacked:
+                    if version > 0:
+                        self._own.add(version)
+                    elif version < 0:
+                        self._own.discard(-version)
+                        self._db_version = None
+            if _ALL in ids:
+                match = lambda key: True
+            elif ids:
+                match = lambda key: key[0] == SUMMARY or (key[0] == INVOICES and key[1] in ids)
+            else:
+                match = None
+        if match is not None:
+            self.invalidate(match)
+        with self._lock:
+            self._seen = max(self._seen, seq)
+
+    def stats(self) -> dict:
+        self._check()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def open_cache(pool, maxsize: int = READ_CACHE_SIZE) -> LRUCache:
+    """读缓存，核对 pool 所连数据库的数据版本；多 worker 运行时经共享日志同步失效"""
+    return LRUCache(maxsize, open_log("cache.log", CACHE_LOG_SLOTS, _RECORD.size), pool)
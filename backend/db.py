@@ -0,0 +1,218 @@
+"""
+数据库连接池
+SQLite 连接复用 + WAL 日志模式；各参数可通过环境变量调整
+设置 DATABASE_URL（postgresql://…）时改用 PostgreSQL（见 pg.py），多个后端实例可共用一个数据库
+
+经连接池提交的写事务都会把数据版本（data_version 表，迁移 12）加一：后端、命令行工具、Streamlit 直连
+以及其他实例的写入都可由版本变化发现（读缓存与 ETag 据此失效，见 cache.py）
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
+from urllib.parse import urlsplit
+
+DB_PATH = os.getenv("DB_PATH", "invoice_checker.db")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# 命令行输出中的数据库名（不含连接串中的密码）
+DB_NAME = f"PostgreSQL {urlsplit(DATABASE_URL).path.lstrip('/')}" if DATABASE_URL else DB_PATH
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待空闲连接的秒数
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # 等待写锁的毫秒数
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # WAL 下 NORMAL 只在checkpoint时fsync
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))  # 每个连接的页缓存，默认64MB
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射读，默认256MB
+
+
+class PoolTimeout(Exception):
+    """在 DB_POOL_TIMEOUT 内没有等到空闲连接"""
+
+
+def configure(conn: sqlite3.Connection):
+    """连接级 PRAGMA（journal_mode=WAL 写入库文件，其余每个连接都要设置）"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size={-DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+# 数据版本加一并返回新版本；PostgreSQL 上只读事务不加（未分配事务号）
+BUMP_VERSION_SQL = {
+    "sqlite": "UPDATE data_version SET version = version + 1 RETURNING version",
+    "postgresql": "UPDATE data_version SET version = version + 1 "
+                  "WHERE pg_current_xact_id_if_assigned() IS NOT NULL RETURNING version",
+}
+HAS_VERSION_TABLE_SQL = {
+    "sqlite": "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'data_version'",
+    "postgresql": "SELECT to_regclass('data_version') IS NOT NULL",
+}
+
+
+def has_version_table(conn) -> bool:
+    """库中是否已有 data_version 表；有了之后记在连接池的连接上（conn.versioned），不再查询"""
+    if getattr(conn, "versioned", False):
+        return True
+    exists = bool(conn.execute(HAS_VERSION_TABLE_SQL[dialect(conn)]).fetchone()[0])
+    if exists and hasattr(conn, "versioned"):
+        conn.versioned = True
+    return exists
+
+
+def read_data_version(conn) -> Optional[Tuple[str, int]]:
+    """(库标识, 数据版本)；库标识建表时随机生成，库重建或恢复后不会与旧版本混淆。迁移前为 None"""
+    if not has_version_table(conn):
+        return None
+    epoch, version = conn.execute("SELECT epoch, version FROM data_version").fetchone()
+    return epoch, version
+
+
+def commit_versioned(conn, commit: Callable[[], None], changed: bool):
+    """
+    提交事务；changed 为真（事务内有写入）时先把数据版本加一，
+    并在提交前告知连接池的版本观察者（见 ConnectionPool.watch_versions），提交失败时撤回
+    """
+    version = None
+    if changed and has_version_table(conn):
+        row = conn.execute(BUMP_VERSION_SQL[dialect(conn)]).fetchone()
+        version = row[0] if row else None
+    if version is not None:
+        for watcher in conn.watchers:
+            watcher.own_version(version)
+    try:
+        commit()
+    except BaseException:
+        if version is not None:
+            for watcher in conn.watchers:
+                watcher.drop_version(version)
+        raise
+
+
+class VersionedConnection(sqlite3.Connection):
+    """提交写事务时数据版本加一的 SQLite 连接（见 commit_versioned）"""
+
+    watchers = ()
+    versioned = False  # 库中已有 data_version 表
+    _changes = 0  # 上次提交/回滚时的 total_changes，不同说明当前事务有写入
+
+    def commit(self):
+        commit_versioned(self, super().commit, self.in_transaction and self.total_changes != self._changes)
+        self._changes = self.total_changes
+
+    def rollback(self):
+        super().rollback()
+        self._changes = self.total_changes
+
+
+class ConnectionPool:
+    """
+    线程安全的连接池
+
+    连接按需创建，最多 size 个；同一时刻一个连接只借给一个线程，
+    因此可以安全地用 check_same_thread=False 在线程池工作线程间传递。
+    """
+
+    dialect = "sqlite"
+    errors = (sqlite3.Error,)  # 归还时回滚出现这些异常说明连接已损坏
+
+    def __init__(self, path: str = DB_PATH, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # 后进先出：优先复用缓存最热的连接
+        self._created = 0
+        self._lock = threading.Lock()
+        self.watchers = []
+
+    def watch_versions(self, watcher):
+        """
+        观察本连接池提交的数据版本：写事务提交前调用 watcher.own_version(version)，提交失败时调用
+        watcher.drop_version(version)。不是经观察者所在连接池提交的版本即外部写入
+        """
+        self.watchers.append(watcher)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                               factory=VersionedConnection)
+        conn.watchers = self.watchers
+        configure(conn)
+        conn._changes = conn.total_changes
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"等待数据库连接超时 ({self.timeout}s)")
+
+    def release(self, conn: sqlite3.Connection):
+        # 归还前回滚未提交的事务，避免把锁带给下一个使用者
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except self.errors:
+            # 连接已损坏：丢弃，下次按需重建
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+def open_pool() -> ConnectionPool:
+    if DATABASE_URL:
+        from pg import PgPool
+        return PgPool(DATABASE_URL)
+    return ConnectionPool()
+
+
+def dialect(conn) -> str:
+    """连接对应的数据库："sqlite" 或 "postgresql"（SQL 写法不同时据此选择）"""
+    return getattr(conn, "dialect", "sqlite")
+
+
+pool = open_pool()
+
+
+def connection():
+    """从全局连接池借一个连接：with connection() as conn: ..."""
+    return pool.connection()
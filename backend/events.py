@@ -0,0 +1,170 @@
+"""
+事件推送
+写入提交后发布合同变化（已开票汇总、完成状态翻转），GET /events 以 SSE 推送给所有订阅的客户端
+
+事件在入库线程中发布，通过 call_soon_threadsafe 投递到各订阅者所在的事件循环；
+最近的事件保留在环形缓冲区中，客户端断线重连时按 Last-Event-ID 补发，缺口过大时发送 reset 要求全量刷新
+
+多 worker 运行时（见 shared.py）事件写入共享日志，每个 worker 的跟随线程读取日志推送给自己的订阅者，
+事件 ID 为日志序号，所有 worker 相同
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from shared import SharedLog, open_log
+
+EVENT_HISTORY = int(os.getenv("EVENT_HISTORY", "1000"))  # 供断线重连补发的事件数
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))  # 单个客户端积压上限，超出后断开
+EVENT_KEEPALIVE = float(os.getenv("EVENT_KEEPALIVE", "15"))  # 无事件时发送心跳的间隔秒数
+EVENT_POLL_MS = float(os.getenv("EVENT_POLL_MS", "50"))  # 多 worker 时检查共享日志的间隔毫秒数
+EVENT_SLOT_SIZE = 4096  # 共享日志中单个事件的最大字节数，超出的事件改为 reset
+
+_CLOSED = object()
+
+
+def format_sse(event: str, data, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventBroker:
+    """发布/订阅；publish 可在任意线程调用。传入共享日志时经日志发布，所有 worker 推送"""
+
+    def __init__(self, history: int = EVENT_HISTORY, queue_size: int = EVENT_QUEUE_SIZE,
+                 log: Optional[SharedLog] = None):
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history)
+        self._subscribers = {}  # asyncio.Queue -> 所属事件循环
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._log = log
+        self._stopped = threading.Event()
+        self._follower = None
+        if log is not None:
+            self._seq = log.seq
+            self._follower = threading.Thread(target=self._follow, name="event-follower", daemon=True)
+            self._follower.start()
+
+    def publish(self, event: str, data):
+        if self._log is not None:
+            record = json.dumps([event, data], ensure_ascii=False).encode()
+            if len(record) > self._log.slot_size:
+                record = json.dumps(["reset", {}]).encode()
+            self._log.append(record)
+            return
+        with self._lock:
+            self._seq += 1
+            message = (self._seq, event, data)
+            self._history.append(message)
+            subscribers = list(self._subscribers.items())
+        self._send(subscribers, message)
+
+    def _follow(self):
+        """多 worker：把共享日志中的新事件推送给本进程的订阅者"""
+        seen = self._seq
+        while not self._stopped.wait(EVENT_POLL_MS / 1000):
+            seq, records = self._log.read(seen)
+            if seq == seen:
+                continue
+            if records is None:
+                # 落后超过日志长度（不应发生）：要求客户端全量刷新
+                messages = [(seq, "reset", {})]
+            else:
+                messages = [(seen + i, *json.loads(record)) for i, record in enumerate(records, 1)]
+            seen = seq
+            with self._lock:
+                self._seq = seq
+                self._history.extend(messages)
+                subscribers = list(self._subscribers.items())
+            for message in messages:
+                self._send(subscribers, message)
+
+    def _send(self, subscribers: list, message):
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, message)
+            except RuntimeError:
+                # 事件循环已关闭
+                self._unsubscribe(queue)
+
+    def _deliver(self, queue: asyncio.Queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 客户端消费太慢：断开，让它重连后按 Last-Event-ID 补发或全量刷新
+            self._unsubscribe(queue)
+            queue.get_nowait()
+            queue.put_nowait(_CLOSED)
+
+    def _unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def stream(self, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """SSE 文本流；先补发 last_event_id 之后的事件，再推送新事件"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            # 注册与取历史在同一把锁内，补发和实时推送之间不漏也不重
+            self._subscribers[queue] = asyncio.get_running_loop()
+            backlog = list(self._history) if last_event_id is not None else []
+            seq = self._seq
+        try:
+            if last_event_id is not None:
+                oldest = backlog[0][0] if backlog else seq + 1
+                if last_event_id > seq or last_event_id + 1 < oldest:
+                    # 服务重启过或缺口超出缓冲区
+                    yield format_sse("reset", {}, seq)
+                else:
+                    for event_id, event, data in backlog:
+                        if event_id > last_event_id:
+                            yield format_sse(event, data, event_id)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is _CLOSED:
+                    return
+                event_id, event, data = message
+                yield format_sse(event, data, event_id)
+        finally:
+            self._unsubscribe(queue)
+
+    def close(self):
+        """结束所有推送流（服务关闭时调用）"""
+        self._stopped.set()
+        if self._follower is not None:
+            self._follower.join()
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+            self._subscribers.clear()
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._close_queue, queue)
+            except RuntimeError:
+                pass
+
+    @staticmethod
+    def _close_queue(queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(_CLOSED)
+
+
+def open_broker() -> EventBroker:
+    """事件推送；多 worker 运行时经共享日志（保留 EVENT_HISTORY 个事件）在 worker 之间转发"""
+    return EventBroker(log=open_log("events.log", EVENT_HISTORY, EVENT_SLOT_SIZE))
@@ -0,0 +1,226 @@
+"""
+OCR任务队列
+识别在进程池中运行，结果入库在单独的线程中完成；请求处理只负责提交任务并返回任务ID
+多 worker 运行时任务状态另写入共享目录（见 shared.py），其他 worker 也能查询
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from ocr import OCR_EXTRACTOR, run_extraction
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "1000"))  # 内存中保留的已结束任务数
+
+# 任务状态与对应进度
+QUEUED, RUNNING, SAVING, SUCCEEDED, FAILED = "queued", "running", "saving", "succeeded", "failed"
+PROGRESS = {QUEUED: 0, RUNNING: 10, SAVING: 90, SUCCEEDED: 100, FAILED: 100}
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str  # 'contract', 'invoice' or 'invoice_batch'
+    file_path: Optional[str]
+    file_hash: Optional[str]
+    file_name: Optional[str] = None  # 上传时的原始文件名
+    status: str = QUEUED
+    progress: int = 0
+    total: int = 1  # 批量任务的文件数
+    done: int = 0  # 已识别完成的文件数
+    files: Optional[List[dict]] = None  # 批量任务的文件清单
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    updated_at: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.pop("file_path")
+        data.pop("files")
+        return data
+
+
+class JobQueue:
+    """
+    OCR任务队列
+
+    on_result(job, ocr_result) 在入库线程中调用，返回值作为任务结果；返回 Future 时（如组提交入库）以其结果为准；
+    抛出的异常（HTTPException 取 detail）记为任务失败原因。
+    saver 为入库用的单线程执行器（可与其他写入共用，由调用方关闭），不传则自建一个。
+    state_dir 不为空时每次状态变化写入 state_dir/任务ID.json，get 查不到本进程的任务时从中读取。
+    批量任务的 ocr_result 为 job.files，每项补充 'ocr'（识别结果）或 'error'。
+    """
+
+    def __init__(self, on_result: Callable[[Job, dict], dict],
+                 workers: int = OCR_WORKERS, extractor: str = OCR_EXTRACTOR,
+                 saver: Optional[Executor] = None, state_dir: Optional[str] = None):
+        self.on_result = on_result
+        self.workers = workers
+        self.extractor = extractor
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        # 单线程入库：识别结果按完成顺序依次写库
+        self._owns_saver = saver is None
+        self._saver = saver or ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-save")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn：避免在已有线程的进程中 fork
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _update(self, job: Job, status: str, **changes):
+        with self._lock:
+            job.status = status
+            job.progress = PROGRESS[status]
+            job.updated_at = datetime.now().isoformat(timespec="seconds")
+            for key, value in changes.items():
+                setattr(job, key, value)
+            self._save(job)
+
+    def _save(self, job: Job):
+        """写入共享目录（持有 self._lock 时调用，同一任务的写入不交错）"""
+        if not self.state_dir:
+            return
+        path = os.path.join(self.state_dir, f"{job.id}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False, default=str)
+        os.replace(f"{path}.tmp", path)
+
+    def submit(self, kind: str, file_path: str, file_hash: str, file_name: Optional[str] = None) -> Job:
+        job = Job(id=uuid.uuid4().hex, kind=kind, file_path=file_path, file_hash=file_hash, file_name=file_name)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        self._update(job, RUNNING)
+        future = self._get_pool().submit(run_extraction, self.extractor, kind, file_path)
+        future.add_done_callback(lambda f: self._saver.submit(self._finish, job, f))
+        return job
+
+    def _finish(self, job: Job, future):
+        try:
+            ocr_result = future.result()
+            self._update(job, SAVING)
+            result = self.on_result(job, ocr_result)
+        except Exception as e:
+            self._update(job, FAILED, error=str(getattr(e, "detail", e)))
+        else:
+            self._succeed(job, result)
+
+    def _succeed(self, job: Job, result):
+        if not isinstance(result, Future):
+            self._update(job, SUCCEEDED, result=result)
+            return
+
+        def on_done(future):
+            try:
+                self._update(job, SUCCEEDED, result=future.result())
+            except Exception as e:
+                self._update(job, FAILED, error=str(getattr(e, "detail", e)))
+        result.add_done_callback(on_done)
+
+    def submit_batch(self, kind: str, files: List[dict]) -> Job:
+        """
+        批量识别：files 中带 file_path 且未设置 status 的项提交识别，
+        全部完成后一次性交给 on_result 入库
+        """
+        job = Job(id=uuid.uuid4().hex, kind=f"{kind}_batch", file_path=None, file_hash=None, files=files)
+        pending = [entry for entry in files if entry.get("file_path") and not entry.get("status")]
+        job.total = len(pending)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        self._update(job, RUNNING)
+        if not pending:
+            self._saver.submit(self._finish_batch, job, [])
+            return job
+        
+        futures = []
+        remaining = [len(pending)]
+        
+        def on_done(_):
+            with self._lock:
+                job.done += 1
+                job.progress = PROGRESS[RUNNING] + (PROGRESS[SAVING] - PROGRESS[RUNNING]) * job.done // job.total
+                remaining[0] -= 1
+                last = remaining[0] == 0
+                self._save(job)
+            if last:
+                self._saver.submit(self._finish_batch, job, list(zip(pending, futures)))
+        
+        pool = self._get_pool()
+        for entry in pending:
+            futures.append(pool.submit(run_extraction, self.extractor, kind, entry["file_path"]))
+        for future in futures:
+            future.add_done_callback(on_done)
+        return job
+
+    def _finish_batch(self, job: Job, outcomes):
+        for entry, future in outcomes:
+            try:
+                entry["ocr"] = future.result()
+            except Exception as e:
+                entry["error"] = str(e)
+        try:
+            self._update(job, SAVING)
+            result = self.on_result(job, job.files)
+        except Exception as e:
+            self._update(job, FAILED, error=str(getattr(e, "detail", e)))
+        else:
+            self._succeed(job, result)
+
+    def _evict(self):
+        """只保留最近 JOB_HISTORY 个已结束任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self._jobs[job_id]
+            if self.state_dir:
+                try:
+                    os.remove(os.path.join(self.state_dir, f"{job_id}.json"))
+                except FileNotFoundError:
+                    pass
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state_dir and job_id.isalnum():
+            # 其他 worker 提交的任务
+            try:
+                with open(os.path.join(self.state_dir, f"{job_id}.json"), encoding="utf-8") as f:
+                    job = Job(file_path=None, **json.load(f))
+            except FileNotFoundError:
+                pass
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """阻塞等待任务结束（测试与命令行使用）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.status in (SUCCEEDED, FAILED):
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                return job
+            time.sleep(0.01)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self._owns_saver:
+            self._saver.shutdown(wait=True)
@@ -1,13 +1,42 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
 from datetime import datetime
+import re
 import sqlite3
-import json
 import os
+import zipfile
 
-app = FastAPI(title="发票检查器 API", version="0.1.0")
+from db import connection, pool
+from migrations import SEARCH_INDEXES, migrate, search_document
+from storage import MAX_BATCH_FILES, MAX_ZIP_SIZE, UploadTooLarge, extract_zip, is_zip, save_upload
+from jobs import JobQueue
+from money import to_fen, to_yuan
+from cache import open_cache
+from events import open_broker
+from shared import STATE_DIR, claim, state_path
+from reconcile import UNKNOWN_CONTRACT, check_invoice, describe_flags, load_lines, reconcile
+from po_match import POIndex, decide
+from snapshot import SnapshotExporter, SnapshotUnavailable, require_pyarrow
+from analytics import monthly_totals, outstanding_balances
+from aiodb import AsyncDB
+from bulk import FORMATS, BulkImportError, detect_format, import_records, read_records, stream_export
+from repository import (INSERT_INVOICE, Conflict, InvalidCursor, Repository, fetch_contracts, find_contract,
+                        find_invoice_hashes, insert_contract, insert_contract_lines, invoice_row, invoice_status,
+                        resolve_contract_numbers)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动后台快照导出；退出时关闭识别任务、写线程、推送与连接池（start_snapshots / shutdown_jobs 见下文）"""
+    start_snapshots()
+    yield
+    shutdown_jobs()
+
+app = FastAPI(title="发票检查器 API", version="0.1.0", lifespan=lifespan)
 
 # CORS配置
 app.add_middleware(
@@ -16,51 +45,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# 数据库初始化
-DB_PATH = "invoice_checker.db"
-
+# 数据库初始化（连接池与 PRAGMA 配置见 db.py，表结构与索引见 migrations.py）
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 合同表
-    c.execute('''CREATE TABLE IF NOT EXISTS contracts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        po_number TEXT UNIQUE NOT NULL,
-        order_date TEXT NOT NULL,
-        quantity INTEGER NOT NULL,
-        total_amount REAL NOT NULL,
-        file_path TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # 发票表
-    c.execute('''CREATE TABLE IF NOT EXISTS invoices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        contract_id INTEGER,
-        contract_number TEXT,
-        spec_model TEXT,
-        quantity INTEGER,
-        amount REAL,
-        file_path TEXT,
-        status TEXT DEFAULT 'pending',
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (contract_id) REFERENCES contracts (id)
-    )''')
-    
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        migrate(conn)
+
+# serve.py 多 worker 运行时已在启动 worker 前迁移（之后才设置共享状态目录），各 worker 不再执行
+if not STATE_DIR:
+    init_db()
+
+# 合同号模糊匹配索引（见 po_match.py）：启动时从合同表加载，新合同入库后追加
+po_index = POIndex()
+with connection() as conn:
+    po_index.load(conn)
+
+# 读缓存：写入提交后按合同失效（见 cache.py），多 worker 时失效在 worker 之间同步；
+# 命令行、Streamlit 直连、其他实例的写入由数据库的数据版本发现
+read_cache = open_cache(pool)
+
+# 接口里的数据库调用在读线程池 / 写线程中执行，不阻塞事件循环（见 aiodb.py）
+adb = AsyncDB()
+
+# 合同/发票读写（见 repository.py，与 Streamlit 版共用）；新增发票经写线程组提交
+repo = Repository(pool, read_cache, writer=adb.writer)
 
-init_db()
+def fetch_all(sql: str, params=()) -> list:
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+# 合同变化推送（见 events.py），多 worker 时任一 worker 发布、所有 worker 推送
+events = open_broker()
+
+# 列式快照（见 snapshot.py）：后台定期导出，财务分析只读快照不读数据库
+snapshots = SnapshotExporter()
+
+# ETag = 数据库的数据版本（见 db.commit_versioned）：任何进程、实例的写入都会变化，各 worker、实例一致，重启后不变
+async def check_etag(request: Request, response: Response) -> Optional[Response]:
+    """设置 ETag；客户端的 If-None-Match 与当前数据版本一致时返回 304 响应"""
+    # 先取版本再查询：查询期间有写入时 ETag 偏旧，客户端下次会拿到新数据，不会缓存住旧数据
+    etag = f'"{await adb.read(read_cache.data_version)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
 # 数据模型
+class ContractLine(BaseModel):
+    spec_model: str
+    unit_price: float
+    quantity: int
+
 class ContractCreate(BaseModel):
     po_number: str
     order_date: str
     quantity: int
     total_amount: float
+    lines: List[ContractLine] = []
 
 class InvoiceCreate(BaseModel):
     contract_number: str
@@ -68,6 +115,9 @@ class InvoiceCreate(BaseModel):
     quantity: int
     amount: float
 
+class InvoiceLink(BaseModel):
+    contract_id: int
+
 class ContractStatus(BaseModel):
     id: int
     po_number: str
@@ -75,144 +125,670 @@ class ContractStatus(BaseModel):
     quantity: int
     total_amount: float
     invoiced_amount: float
+    total_amount_fen: int  # 金额以分为单位的精确值
+    invoiced_amount_fen: int
     invoiced_quantity: int
     status: str  # 'complete' (green) or 'incomplete' (yellow)
     invoice_count: int
 
 # API路由
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "发票检查器 API v0.1.0", "status": "running"}
 
-@app.post("/upload/contract")
-async def upload_contract(file: UploadFile = File(...)):
-    """上传合同文件"""
-    # TODO: OCR识别
-    # 模拟OCR结果
-    mock_ocr_result = {
-        "po_number": f"PO-2024{len(get_all_contracts()) + 1:03d}",
-        "order_date": "2024-01-15",
-        "quantity": 100,
-        "total_amount": 50000.00
+def publish_contract_changes(previous: dict, current: dict):
+    """写入提交后调用：按合同失效读缓存，并推送变化后的汇总（previous 为写入前的 {id: status}）"""
+    read_cache.invalidate_contracts(*current)
+    for contract_id, contract in current.items():
+        events.publish("contract", {**contract, "previous_status": previous.get(contract_id)})
+
+def match_contract(conn: sqlite3.Connection, contract_number: str):
+    """
+    合同号模糊匹配（精确匹配失败后调用）：返回 (决定, 匹配信息)
+    决定为 link（自动关联第一个候选）/ review（转人工复核）/ none（未找到合同）
+    """
+    # 先补上其他 worker 新增的合同
+    po_index.refresh(conn)
+    while True:
+        candidates = po_index.search(contract_number)
+        # 索引不知道其他进程（Streamlit、命令行）删除的合同：候选须在库中仍存在，否则移出索引后重新匹配
+        existing = fetch_contracts(conn.cursor(), [candidate.contract_id for candidate in candidates])
+        missing = [candidate.contract_id for candidate in candidates if candidate.contract_id not in existing]
+        if not missing:
+            break
+        po_index.remove(*missing)
+    decision = decide(candidates)
+    match = {
+        "method": "fuzzy",
+        "confidence": candidates[0].score if candidates else 0.0,
+        "candidates": [candidate._asdict() for candidate in candidates],
     }
-    
-    # 保存文件
-    file_path = f"uploads/contracts/{mock_ocr_result['po_number']}.pdf"
-    os.makedirs("uploads/contracts", exist_ok=True)
-    
-    # 插入数据库
-    conn = sqlite3.connect(DB_PATH)
+    return decision, match
+
+def save_contract(job, ocr_result: dict) -> dict:
+    """合同识别完成后入库（在任务队列的入库线程中调用）"""
+    ocr_text = ocr_result.pop("text", None)
+    conn = pool.acquire()
     c = conn.cursor()
     try:
-        c.execute('''INSERT INTO contracts (po_number, order_date, quantity, total_amount, file_path)
-                     VALUES (?, ?, ?, ?, ?)''',
-                  (mock_ocr_result['po_number'], mock_ocr_result['order_date'], 
-                   mock_ocr_result['quantity'], mock_ocr_result['total_amount'], file_path))
+        if not ocr_result.get("po_number"):
+            # 识别不到采购单号时按顺序编号
+            c.execute("SELECT COUNT(*) FROM contracts")
+            ocr_result["po_number"] = f"PO-2024{c.fetchone()[0] + 1:03d}"
+        contract_id = insert_contract(c, ocr_result['po_number'], ocr_result['order_date'], ocr_result['quantity'],
+                                      ocr_result['total_amount'], ocr_result.get('lines') or [],
+                                      file_path=job.file_path, file_name=job.file_name, file_hash=job.file_hash,
+                                      ocr_text=ocr_text)
+        current = fetch_contracts(c, [contract_id])
         conn.commit()
-        contract_id = c.lastrowid
-    except sqlite3.IntegrityError:
-        raise HTTPException(status_code=400, detail="采购单号已存在")
+    except Conflict as e:
+        raise HTTPException(status_code=400, detail=str(e))
     finally:
-        conn.close()
+        pool.release(conn)
+    po_index.add(contract_id, ocr_result['po_number'])
+    publish_contract_changes({}, current)
     
-    return {"message": "合同上传成功", "contract_id": contract_id, **mock_ocr_result}
+    return {"message": "合同上传成功", "contract_id": contract_id, **ocr_result}
 
-@app.post("/upload/invoice")
-async def upload_invoice(file: UploadFile = File(...)):
-    """上传发票文件"""
-    # TODO: OCR识别
-    # 模拟OCR结果
-    mock_ocr_result = {
-        "contract_number": "PO-2024001",  # 从发票备注栏识别
-        "spec_model": "SKU-A001",
-        "quantity": 50,
-        "amount": 25000.00
-    }
+def insert_review_invoice(c: sqlite3.Cursor, ocr_result: dict, source: dict) -> int:
+    """合同号无法确认的发票：不关联合同入库，状态 review，等待 POST /invoices/{id}/link"""
+    c.execute(INSERT_INVOICE, invoice_row(None, ocr_result, "review", UNKNOWN_CONTRACT, source))
+    return c.lastrowid
+
+def save_invoice(job, ocr_result: dict) -> Future:
+    """
+    发票识别完成后核对合同并入库（在任务队列的入库线程中调用）
+    同时完成的发票合并为一次提交（组提交，见 writer.py）；返回的 Future 在提交后才有结果
+    """
+    source = {"file_path": job.file_path, "file_name": job.file_name, "file_hash": job.file_hash,
+              "ocr_text": ocr_result.pop("text", None)}
+    return adb.writer.submit_group(insert_ocr_invoice, ocr_result, source, after_commit=publish_invoice)
+
+def insert_ocr_invoice(conn: sqlite3.Connection, ocr_result: dict, source: dict) -> tuple:
+    """在组提交事务中查找合同、核对并插入发票；返回 (结果, 合同原状态, 合同现状态)"""
+    c = conn.cursor()
+    try:
+        # 查找对应合同
+        contract = find_contract(c, ocr_result['contract_number'])
+        match = None
+        
+        if contract is None:
+            # 识别的合同号有噪声：模糊匹配，高置信度自动关联，其余转人工复核或报未找到
+            decision, match = match_contract(conn, ocr_result['contract_number'])
+            if decision == "none":
+                raise HTTPException(status_code=404, detail="未找到对应合同")
+            if decision == "link":
+                linked_id = match["candidates"][0]["contract_id"]
+                contract = fetch_contracts(c, [linked_id]).get(linked_id)
+            if contract is None:
+                # 不确定，或自动关联的合同已不存在：转人工复核
+                invoice_id = insert_review_invoice(c, ocr_result, source)
+                return ({"message": "合同号无法确认，发票已转人工复核", "invoice_id": invoice_id,
+                         "status": "review", "match": match, **ocr_result}, {}, {})
+        
+        contract_id = contract["id"]
+        previous = {contract_id: contract["status"]}
+        
+        # 按合同明细核对规格型号、单价、数量；有问题的发票照常入库，状态为 mismatch
+        # 同组中先插入的发票已由触发器计入合同累计，核对时可见
+        amount_fen = to_fen(ocr_result['amount'])
+        check_flags = check_invoice(conn, contract, ocr_result['spec_model'], ocr_result['quantity'], amount_fen)
+        c.execute(INSERT_INVOICE, invoice_row(contract_id, ocr_result, invoice_status(check_flags), check_flags, source))
+        current = fetch_contracts(c, [contract_id])
+    except sqlite3.IntegrityError:
+        # 并发上传同一文件，唯一索引兜底
+        raise HTTPException(status_code=409, detail="发票已存在（重复上传）")
+    
+    issues = describe_flags(check_flags)
+    message = "发票验证通过" if not issues else "发票已入库，核对发现问题"
+    result = {"message": message, "contract_id": contract_id, "issues": issues, **ocr_result}
+    if match:
+        result["match"] = match
+    return result, previous, current
+
+def publish_invoice(saved: tuple) -> dict:
+    """组提交后通知合同状态变化"""
+    result, previous, current = saved
+    if current:
+        publish_contract_changes(previous, current)
+    return result
+
+def save_invoice_batch(job, entries: List[dict]) -> dict:
+    """批量发票入库：一次查询解析所有合同号，一个事务内 executemany 插入"""
+    pending = [e for e in entries if not e.get("status")]
+    for entry in pending:
+        if entry.get("error"):
+            entry["status"] = "failed"
+    recognized = [e for e in pending if not e.get("status")]
     
-    # 查找对应合同
-    conn = sqlite3.connect(DB_PATH)
+    conn = pool.acquire()
     c = conn.cursor()
-    c.execute("SELECT id, po_number, quantity, total_amount FROM contracts WHERE po_number = ?", 
-              (mock_ocr_result['contract_number'],))
-    contract = c.fetchone()
+    try:
+        # 一次性解析合同号
+        numbers = list({e["ocr"]["contract_number"] for e in recognized})
+        contracts = resolve_contract_numbers(c, numbers)
+        
+        # 写锁内复查哈希，防止与并发上传重复入库
+        c.execute("BEGIN IMMEDIATE")
+        existing = find_invoice_hashes(c, [e["file_hash"] for e in recognized])
+        
+        # 精确匹配不到的合同号逐个模糊匹配
+        matches = {}
+        for number in numbers:
+            if number not in contracts:
+                matches[number] = match_contract(conn, number)
+                if matches[number][0] == "link":
+                    contracts[number] = matches[number][1]["candidates"][0]["contract_id"]
+        
+        # 写入前后的合同状态都在同一个写事务内读取
+        before = fetch_contracts(c, set(contracts.values()))
+        # 明细与已开票数量按本批涉及的合同一次读取，逐张核对时不再查询
+        lines = load_lines(conn, before.values())
+        rows = []
+        batch_totals = {}  # 本批中已核对、尚未插入的发票累计
+        for entry in recognized:
+            ocr_result = entry["ocr"]
+            source = {"file_path": entry["file_path"], "file_name": entry["name"], "file_hash": entry["file_hash"],
+                      "ocr_text": ocr_result.pop("text", None)}
+            contract = before.get(contracts.get(ocr_result["contract_number"]))
+            decision, match = matches.get(ocr_result["contract_number"], (None, None))
+            if match:
+                entry["match"] = match
+            if entry["file_hash"] in existing:
+                entry.update(status="duplicate", invoice_id=existing[entry["file_hash"]])
+            elif decision == "review" or (decision == "link" and contract is None):
+                # 自动关联的合同已不存在时同样转人工复核
+                invoice_id = insert_review_invoice(c, ocr_result, source)
+                entry.update(status="review", invoice_id=invoice_id)
+            elif contract is None:
+                entry.update(status="failed", error="未找到对应合同")
+            else:
+                amount_fen = to_fen(ocr_result['amount'])
+                check_flags = check_invoice(conn, contract, ocr_result['spec_model'], ocr_result['quantity'],
+                                            amount_fen, pending=batch_totals, lines=lines)
+                entry.update(status="created", contract_id=contract["id"], issues=describe_flags(check_flags))
+                rows.append(invoice_row(contract["id"], ocr_result, invoice_status(check_flags), check_flags, source))
+        
+        touched = {row[0] for row in rows}
+        previous = {cid: before[cid]["status"] for cid in touched}
+        c.executemany(INSERT_INVOICE, rows)
+        current = fetch_contracts(c, touched)
+        conn.commit()
+    finally:
+        pool.release(conn)
+    publish_contract_changes(previous, current)
     
-    if not contract:
-        conn.close()
-        raise HTTPException(status_code=404, detail="未找到对应合同")
+    report = []
+    for entry in entries:
+        item = {"file": entry["name"], "status": entry["status"], "file_hash": entry.get("file_hash")}
+        for key in ("error", "invoice_id", "contract_id", "issues", "match"):
+            if entry.get(key) is not None:
+                item[key] = entry[key]
+        if entry.get("ocr"):
+            item.update(entry["ocr"])
+        report.append(item)
+    summary = {status: sum(1 for item in report if item["status"] == status)
+               for status in ("created", "review", "duplicate", "failed")}
+    return {"message": "批量发票处理完成", "total": len(report), **summary, "files": report}
+
+# OCR任务队列：识别在进程池中运行，不占用请求处理
+SAVE_HANDLERS = {"contract": save_contract, "invoice": save_invoice, "invoice_batch": save_invoice_batch}
+# 入库与接口的写入共用一个写线程
+# 多 worker 时任务状态写入共享目录，轮询 /jobs 落到任一 worker 都能查到
+ocr_jobs = JobQueue(on_result=lambda job, ocr_result: SAVE_HANDLERS[job.kind](job, ocr_result), saver=adb.writer,
+                    state_dir=state_path("jobs"))
+
+def start_snapshots():
+    try:
+        require_pyarrow()
+    except SnapshotUnavailable:
+        # 未安装 pyarrow：不导出快照，分析接口返回 503
+        return
+    # 多 worker 时只由一个 worker 定期导出
+    if claim("snapshot"):
+        snapshots.start()
+
+def shutdown_jobs():
+    snapshots.stop()
+    ocr_jobs.shutdown()
+    adb.close()
+    events.close()
+    pool.close()
+
+@app.post("/upload/contract")
+async def upload_contract(response: Response, file: UploadFile = File(...)):
+    """上传合同文件，返回识别任务ID"""
+    # 流式落盘（同时计算哈希）
+    try:
+        stored = await save_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
-    contract_id, po_number, contract_qty, contract_amount = contract
+    # 重复上传：直接返回已有合同，跳过OCR和入库
+    duplicate = await adb.read(repo.find_duplicate, "contracts", stored.sha256)
+    if duplicate:
+        stored.discard()
+        return {"message": "合同已存在（重复上传）", "duplicate": True,
+                "contract_id": duplicate[0], "po_number": duplicate[1], "file_hash": stored.sha256}
     
-    # TODO: 验证规格型号
-    # 简化版：直接插入
-    file_path = f"uploads/invoices/{po_number}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-    os.makedirs("uploads/invoices", exist_ok=True)
+    # 保存文件（内容寻址），提交识别任务
+    job = ocr_jobs.submit("contract", stored.commit_blob(), stored.sha256, file.filename)
+    response.status_code = 202
+    return {"message": "合同已提交识别", "job_id": job.id, "status": job.status,
+            "file_hash": stored.sha256, "file_size": stored.size}
+
+@app.post("/upload/invoice")
+async def upload_invoice(response: Response, file: UploadFile = File(...)):
+    """上传发票文件，返回识别任务ID"""
+    try:
+        stored = await save_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
-    c.execute('''INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount, file_path, status)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
-              (contract_id, mock_ocr_result['contract_number'], mock_ocr_result['spec_model'],
-               mock_ocr_result['quantity'], mock_ocr_result['amount'], file_path, 'verified'))
-    conn.commit()
-    conn.close()
+    # 重复上传：跳过OCR和入库，避免重复计入已开票金额
+    duplicate = await adb.read(repo.find_duplicate, "invoices", stored.sha256)
+    if duplicate:
+        stored.discard()
+        return {"message": "发票已存在（重复上传）", "duplicate": True, "invoice_id": duplicate[0],
+                "contract_id": duplicate[1], "contract_number": duplicate[2], "file_hash": stored.sha256}
     
-    return {"message": "发票验证通过", **mock_ocr_result}
+    job = ocr_jobs.submit("invoice", stored.commit_blob(), stored.sha256, file.filename)
+    response.status_code = 202
+    return {"message": "发票已提交识别", "job_id": job.id, "status": job.status,
+            "file_hash": stored.sha256, "file_size": stored.size}
 
-@app.get("/contracts", response_model=List[ContractStatus])
-def get_all_contracts():
-    """获取所有合同及状态"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+@app.post("/upload/invoices/batch")
+async def upload_invoices_batch(response: Response, files: List[UploadFile] = File(...)):
+    """批量上传发票（多个文件或ZIP包），返回识别任务ID；逐文件结果在任务结果中"""
+    entries = []
+    for file in files:
+        try:
+            stored = await save_upload(file, max_size=MAX_ZIP_SIZE if is_zip(file) else None)
+        except UploadTooLarge as e:
+            entries.append({"name": file.filename, "status": "failed", "error": str(e)})
+            continue
+        if not is_zip(file):
+            entries.append({"name": file.filename, "stored": stored})
+            continue
+        try:
+            members = await extract_zip(stored)
+        except (zipfile.BadZipFile, ValueError) as e:
+            entries.append({"name": file.filename, "status": "failed", "error": f"无效的ZIP文件: {e}"})
+            continue
+        for name, member in members:
+            if isinstance(member, Exception):
+                entries.append({"name": name, "status": "failed", "error": str(member)})
+            else:
+                entries.append({"name": name, "stored": member})
+    
+    if len(entries) > MAX_BATCH_FILES:
+        for entry in entries:
+            if entry.get("stored"):
+                entry["stored"].discard()
+        raise HTTPException(status_code=413, detail=f"文件数超过上限 ({MAX_BATCH_FILES})")
     
-    c.execute('''
-        SELECT 
-            c.id, c.po_number, c.order_date, c.quantity, c.total_amount,
-            COALESCE(SUM(i.amount), 0) as invoiced_amount,
-            COALESCE(SUM(i.quantity), 0) as invoiced_quantity,
-            COUNT(i.id) as invoice_count
-        FROM contracts c
-        LEFT JOIN invoices i ON c.id = i.contract_id
-        GROUP BY c.id
-        ORDER BY c.order_date ASC
-    ''')
+    # 去重：批内重复 + 库内已有（按哈希批量查询）
+    stored_entries = [e for e in entries if e.get("stored")]
+    existing = await adb.read(repo.invoice_hashes, {e["stored"].sha256 for e in stored_entries})
     
-    results = []
-    for row in c.fetchall():
-        contract_id, po_number, order_date, qty, total_amt, invoiced_amt, invoiced_qty, inv_count = row
-        status = 'complete' if abs(total_amt - invoiced_amt) < 0.01 else 'incomplete'
-        results.append({
-            "id": contract_id,
-            "po_number": po_number,
-            "order_date": order_date,
-            "quantity": qty,
-            "total_amount": total_amt,
-            "invoiced_amount": invoiced_amt,
-            "invoiced_quantity": invoiced_qty,
-            "status": status,
-            "invoice_count": inv_count
-        })
+    seen = set()
+    for entry in stored_entries:
+        stored = entry.pop("stored")
+        entry["file_hash"] = stored.sha256
+        if stored.sha256 in existing:
+            stored.discard()
+            entry.update(status="duplicate", invoice_id=existing[stored.sha256])
+        elif stored.sha256 in seen:
+            stored.discard()
+            entry.update(status="duplicate", error="与本批次中的其他文件重复")
+        else:
+            seen.add(stored.sha256)
+            entry["file_path"] = stored.commit_blob()
     
-    conn.close()
+    job = ocr_jobs.submit_batch("invoice", entries)
+    response.status_code = 202
+    return {"message": "批量发票已提交识别", "job_id": job.id, "status": job.status,
+            "total": len(entries), "queued": job.total}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询识别任务状态与进度"""
+    job = ocr_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.to_dict()
+
+# 合同列表分页
+MAX_PAGE_SIZE = 500
+
+@app.get("/contracts", response_model=List[ContractStatus])
+async def get_all_contracts(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页条数，不传则返回全部"),
+    after: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    offset: int = Query(0, ge=0, description="跳过的条数（按页码翻页时使用，与 after 二选一）"),
+    status: Optional[Literal["complete", "incomplete"]] = None,
+    sort: Literal["order_date", "total_amount"] = "order_date",
+    order: Literal["asc", "desc"] = "asc",
+):
+    """获取合同及状态（游标分页，筛选和排序都走索引）；还有下一页时返回 X-Next-Cursor 响应头"""
+    not_modified = await check_etag(request, response)
+    if not_modified:
+        return not_modified
+    try:
+        results, next_cursor = await adb.read(repo.list_contracts, limit, after, status, sort, order, offset)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return results
 
+@app.get("/contracts/stats")
+async def get_contract_stats(request: Request, response: Response):
+    """合同总数与已完成数"""
+    not_modified = await check_etag(request, response)
+    if not_modified:
+        return not_modified
+    return await adb.read(repo.contract_stats)
+
+@app.get("/contracts/{contract_id}", response_model=ContractStatus)
+async def get_contract(contract_id: int, request: Request, response: Response):
+    """获取单个合同及状态"""
+    not_modified = await check_etag(request, response)
+    if not_modified:
+        return not_modified
+    contract = await adb.read(repo.get_contract, contract_id)
+    if contract is None:
+        raise HTTPException(status_code=404, detail="合同不存在")
+    return contract
+
 @app.get("/contracts/{contract_id}/invoices")
-def get_contract_invoices(contract_id: int):
-    """获取某个合同的所有发票"""
-    conn = sqlite3.connect(DB_PATH)
+async def get_contract_invoices(contract_id: int, request: Request, response: Response):
+    """获取某个合同的所有发票（新的在前）"""
+    not_modified = await check_etag(request, response)
+    if not_modified:
+        return not_modified
+    return await adb.read(repo.contract_invoices, contract_id)
+
+@app.get("/contracts/{contract_id}/lines")
+async def get_contract_lines(contract_id: int):
+    """获取合同明细"""
+    rows = await adb.read(fetch_all, '''SELECT spec_model, unit_price_fen, quantity FROM contract_lines
+                                       WHERE contract_id = ? ORDER BY id''', (contract_id,))
+    return [{"spec_model": spec, "unit_price": to_yuan(price), "unit_price_fen": price, "quantity": qty}
+            for spec, price, qty in rows]
+
+@app.put("/contracts/{contract_id}/lines")
+async def replace_contract_lines(contract_id: int, lines: List[ContractLine]):
+    """整体替换合同明细（识别结果不含明细或需要人工修正时使用）"""
+    await adb.write(save_contract_lines, contract_id, [line.model_dump() for line in lines])
+    return await get_contract_lines(contract_id)
+
+def save_contract_lines(contract_id: int, lines: List[dict]):
+    conn = pool.acquire()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        contract = c.execute("SELECT po_number FROM contracts WHERE id = ?", (contract_id,)).fetchone()
+        if not contract:
+            raise HTTPException(status_code=404, detail="合同不存在")
+        c.execute("DELETE FROM contract_lines WHERE contract_id = ?", (contract_id,))
+        insert_contract_lines(c, contract_id, contract[0], lines)
+        conn.commit()
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="合同明细中规格型号重复")
+    finally:
+        pool.release(conn)
+
+# 全文检索（FTS5 trigram 分词，表与触发器见 migrations.py）：各列的 bm25 权重，编号类列优先
+SEARCH_SQL = {
+    "contract": '''SELECT 'contract', c.id, c.po_number, c.id, NULL, c.file_name, c.created_at,
+                          snippet(contracts_fts, -1, '<mark>', '</mark>', '…', 16),
+                          bm25(contracts_fts, 10.0, 2.0, 1.0) AS score
+                   FROM contracts_fts JOIN contracts c ON c.id = contracts_fts.rowid
+                   WHERE contracts_fts MATCH ?''',
+    "invoice": '''SELECT 'invoice', i.id, i.contract_number, i.contract_id, i.spec_model, i.file_name, i.created_at,
+                         snippet(invoices_fts, -1, '<mark>', '</mark>', '…', 16),
+                         bm25(invoices_fts, 10.0, 10.0, 2.0, 1.0) AS score
+                  FROM invoices_fts JOIN invoices i ON i.id = invoices_fts.rowid
+                  WHERE invoices_fts MATCH ?''',
+}
+
+def fts_query(q: str) -> str:
+    """用户输入转 FTS5 查询：按空白拆词，每个词作为短语（子串）匹配，词之间为 AND"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+# PostgreSQL：拼接文本上的 pg_trgm GIN 索引加速 ILIKE 子串匹配（见 migrations.py），每个词一个条件；
+# 相关度为各列 word_similarity 的加权和（权重同上），摘要在取回后截取
+PG_SEARCH = {
+    "contract": ("contracts", "c", [10.0, 2.0, 1.0],
+                 "'contract', c.id, c.po_number, c.id, NULL, c.file_name, c.created_at"),
+    "invoice": ("invoices", "i", [10.0, 10.0, 2.0, 1.0],
+                "'invoice', i.id, i.contract_number, i.contract_id, i.spec_model, i.file_name, i.created_at"),
+}
+
+def pg_search_sql(kind: str, terms: List[str]):
+    """返回 (SQL, 参数)；摘要列为拼接文本"""
+    table, alias, weights, columns = PG_SEARCH[kind]
+    indexed = SEARCH_INDEXES[table]
+    document = search_document(indexed, alias)
+    score = " + ".join(f"{weight} * word_similarity(?, COALESCE({alias}.{col}, ''))"
+                       for weight, col in zip(weights, indexed))
+    sql = f'''SELECT {columns}, {document}, -({score}) AS score
+              FROM {table} {alias} WHERE {" AND ".join([f"{document} ILIKE ?"] * len(terms))}'''
+    q = " ".join(terms)
+    patterns = ["%" + re.sub(r"([%_\\])", r"\\\1", term) + "%" for term in terms]
+    return sql, [q] * len(indexed) + patterns
+
+def highlight(text: str, terms: List[str], width: int = 48) -> str:
+    """与 FTS5 snippet 相同格式的摘要：第一个命中词附近的一段，命中词用 <mark> 标出"""
+    text = " ".join(text.split())
+    lower = text.lower()
+    first = min((pos for pos in (lower.find(term.lower()) for term in terms) if pos >= 0), default=0)
+    start = max(0, first - width // 4)
+    end = min(len(text), start + width)
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    marked = pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", text[start:end])
+    return ("…" if start > 0 else "") + marked + ("…" if end < len(text) else "")
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., description="搜索词（采购单号、规格型号、文件名或识别全文的片段，每个词至少3个字符）"),
+    type: Optional[Literal["contract", "invoice"]] = Query(None, description="只搜索合同或发票"),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    """按相关度排序的全文检索，offset 分页；还有下一页时 next_offset 不为空"""
+    terms = q.split()
+    if not terms or any(len(term) < 3 for term in terms):
+        raise HTTPException(status_code=400, detail="每个搜索词至少3个字符")
+    kinds = [type] if type else ["contract", "invoice"]
+    if pool.dialect == "postgresql":
+        queries = [pg_search_sql(kind, terms) for kind in kinds]
+        sql = " UNION ALL ".join(query for query, _ in queries)
+        params = [param for _, query_params in queries for param in query_params]
+    else:
+        sql = " UNION ALL ".join(SEARCH_SQL[kind] for kind in kinds)
+        params = [fts_query(q)] * len(kinds)
+    sql += " ORDER BY score, 1, 2 LIMIT ? OFFSET ?"
+    rows = await adb.read(fetch_all, sql, params + [limit + 1, offset])
+    if pool.dialect == "postgresql":
+        rows = [(*row[:7], highlight(row[7], terms), row[8]) for row in rows]
+    results = [{
+        "type": kind,
+        "id": row_id,
+        "contract_number": number,
+        "contract_id": contract_id,
+        "spec_model": spec,
+        "file_name": file_name,
+        "created_at": created_at,
+        "snippet": snippet,
+        # 不取整：bm25 在常见词上的分值可小于 1e-4，取整后都成了 0、看不出排序
+        "score": -score or 0.0,
+    } for kind, row_id, number, contract_id, spec, file_name, created_at, snippet, score in rows[:limit]]
+    return {"results": results, "next_offset": offset + limit if len(rows) > limit else None}
+
+@app.post("/import")
+async def import_file(
+    type: Literal["contracts", "invoices"] = Query(..., description="导入合同或发票"),
+    file: UploadFile = File(..., description="CSV（UTF-8）或 XLSX；发票导入前需先导入对应合同"),
+):
+    """批量导入（一个事务，任一行有误整体回滚）；已存在的采购单号跳过，发票导入后自动核对"""
+    try:
+        fmt = detect_format(file.filename)
+        # 整个导入是一个写事务，排在写线程上，不与其他写入争写锁
+        summary = await adb.write(import_upload, type, read_records(file.file, fmt))
+    except BulkImportError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if summary["inserted"]:
+        # 批量变化不逐个推送合同，通知客户端全量刷新
+        read_cache.clear()
+        snapshots.invalidate()
+        events.publish("reset", {})
+    return {"type": type, **summary}
+
+def import_upload(type: str, records) -> dict:
+    with connection() as conn:
+        summary = import_records(conn, type, records)
+        if type == "contracts" and summary["inserted"]:
+            po_index.load(conn)
+    return summary
+
+@app.get("/export")
+def export_file(
+    type: Literal["contracts", "invoices"] = Query(..., description="导出合同或发票"),
+    format: Literal["csv", "xlsx"] = "csv",
+):
+    """流式导出全部合同或发票（金额为元，发票 issues 为核对问题，以 | 分隔）"""
+    filename = f"{type}-{datetime.now():%Y%m%d}.{format}"
+    try:
+        detect_format(filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def body():
+        with connection() as conn:
+            yield from stream_export(conn, type, format)
+    return StreamingResponse(body(), media_type=FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/invoices/review")
+async def get_review_invoices(limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """待人工复核的发票（合同号无法确认），附模糊匹配候选合同"""
+    return await adb.read(query_review_invoices, limit)
+
+def query_review_invoices(limit: int) -> list:
+    with connection() as conn:
+        rows = conn.execute('''SELECT id, contract_number, spec_model, quantity, amount_fen, created_at
+                               FROM invoices WHERE status = 'review' ORDER BY id LIMIT ?''', (limit,)).fetchall()
+        po_index.refresh(conn)
+    return [{
+        "id": invoice_id,
+        "contract_number": number,
+        "spec_model": spec,
+        "quantity": qty,
+        "amount": to_yuan(fen) if fen is not None else None,
+        "created_at": created_at,
+        "candidates": [candidate._asdict() for candidate in po_index.search(number)],
+    } for invoice_id, number, spec, qty, fen, created_at in rows]
+
+@app.post("/invoices/{invoice_id}/link")
+async def link_invoice(invoice_id: int, link: InvoiceLink):
+    """人工确认复核发票对应的合同：关联并核对"""
+    return await adb.write(link_review_invoice, invoice_id, link.contract_id)
+
+def link_review_invoice(invoice_id: int, contract_id: int) -> dict:
+    conn = pool.acquire()
     c = conn.cursor()
-    c.execute('''SELECT id, spec_model, quantity, amount, status, created_at 
-                 FROM invoices WHERE contract_id = ?''', (contract_id,))
-    invoices = []
-    for row in c.fetchall():
-        invoices.append({
-            "id": row[0],
-            "spec_model": row[1],
-            "quantity": row[2],
-            "amount": row[3],
-            "status": row[4],
-            "created_at": row[5]
-        })
-    conn.close()
-    return invoices
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        invoice = c.execute("SELECT spec_model, quantity, amount_fen, status FROM invoices WHERE id = ?",
+                            (invoice_id,)).fetchone()
+        if not invoice:
+            raise HTTPException(status_code=404, detail="发票不存在")
+        if invoice[3] != "review":
+            raise HTTPException(status_code=409, detail="发票不在复核队列中")
+        previous = fetch_contracts(c, [contract_id])
+        if not previous:
+            raise HTTPException(status_code=404, detail="合同不存在")
+        check_flags = check_invoice(conn, previous[contract_id], invoice[0], invoice[1], invoice[2])
+        c.execute("UPDATE invoices SET contract_id = ?, status = ?, check_flags = ? WHERE id = ?",
+                  (contract_id, invoice_status(check_flags), check_flags, invoice_id))
+        current = fetch_contracts(c, [contract_id])
+        conn.commit()
+    finally:
+        pool.release(conn)
+    publish_contract_changes({contract_id: previous[contract_id]["status"]}, current)
+    return {"invoice_id": invoice_id, "contract_id": contract_id,
+            "status": invoice_status(check_flags), "issues": describe_flags(check_flags)}
+
+@app.post("/reconcile")
+async def run_reconcile(contract_id: Optional[List[int]] = Query(None, description="只核对这些合同，不传则核对全部")):
+    """向量化核对发票（超额开票、数量不符、单价偏差、规格型号缺失），结果写回发票状态"""
+    summary = await adb.write(reconcile_contracts, contract_id)
+    if summary["updated"]:
+        read_cache.clear()
+        snapshots.invalidate()
+    return summary
+
+def reconcile_contracts(contract_ids: Optional[List[int]]) -> dict:
+    with connection() as conn:
+        return reconcile(conn, contract_ids=contract_ids)
+
+@app.get("/events")
+def stream_events(request: Request, last_event_id: Optional[int] = Query(None, description="从该事件之后开始补发")):
+    """
+    SSE 推送合同变化：event: contract，data 为合同最新汇总及 previous_status（新合同为 null）；
+    断线重连时浏览器自动带 Last-Event-ID 补发，收到 event: reset 时应全量刷新列表
+    """
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        events.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/analytics/monthly")
+def get_monthly_totals(start: Optional[str] = Query(None, description="起始订单月份，如 2024-01"),
+                       end: Optional[str] = Query(None, description="结束订单月份（含）")):
+    """按订单月份的合同额、已开票、未开票与核对问题汇总（基于最近一次列式快照）"""
+    try:
+        return monthly_totals(start, end, directory=snapshots.directory)
+    except SnapshotUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/analytics/outstanding")
+def get_outstanding_balances(limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                             start: Optional[str] = None, end: Optional[str] = None):
+    """未开票余额最大的合同及余额合计（基于最近一次列式快照）"""
+    try:
+        return outstanding_balances(limit, start, end, directory=snapshots.directory)
+    except SnapshotUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/snapshots")
+def get_snapshot_status():
+    """快照版本、更新时间及最近一次导出结果"""
+    return snapshots.status()
+
+@app.post("/snapshots/refresh")
+def refresh_snapshots(full: bool = False):
+    """立即增量导出快照（full=true 全部重写）"""
+    try:
+        return snapshots.run(full=full)
+    except SnapshotUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """读缓存命中/未命中统计"""
+    return read_cache.stats()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=5)
@@ -0,0 +1,484 @@
+"""
+数据库迁移
+用 PRAGMA user_version 记录库结构版本，启动时按顺序执行尚未应用的迁移；
+每个迁移在独立事务中执行，失败时回滚，不会丢失已有数据
+
+PostgreSQL（见 pg.py）的版本号记在 schema_version 表，新库直接建成与 SQLite 版本 10 相同的结构，之后的版本与 SQLite 一一对应
+
+新增迁移：在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，版本号递增，已发布的迁移不要修改；
+PG_MIGRATIONS 追加同一版本号的 PostgreSQL 写法
+"""
+
+import ntpath
+import sqlite3
+from typing import Callable, List, Tuple
+
+from db import dialect
+from money import to_fen
+from po_match import normalize_po
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    """列不存在时追加（兼容在迁移框架之前就已手动加过列的旧库）"""
+    if column not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def rebuild_table(conn: sqlite3.Connection, table: str, create_sql: str, columns: dict):
+    """
+    按新结构重建表（SQLite 不支持修改列类型）
+
+    create_sql 中的表名写作 {table}；columns 为 {新列名: 取值表达式}，表达式基于旧表。
+    旧表上的索引和触发器随旧表删除，需由调用方重建；AUTOINCREMENT 序号保留。
+    """
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    conn.execute(create_sql.format(table=f"{table}_new"))
+    conn.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) "
+                 f"SELECT {', '.join(columns.values())} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    if seq is not None:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq[0], table))
+
+
+def _create_base_tables(conn: sqlite3.Connection):
+    # 旧版 Streamlit 应用自建的库（无版本号）用 file_name 记录文件，改名为 file_path 后按正常路径升级
+    for table in ("contracts", "invoices"):
+        columns = table_columns(conn, table)
+        if "file_name" in columns and "file_path" not in columns:
+            conn.execute(f"ALTER TABLE {table} RENAME COLUMN file_name TO file_path")
+
+    # 合同表
+    conn.execute('''CREATE TABLE IF NOT EXISTS contracts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        po_number TEXT UNIQUE NOT NULL,
+        order_date TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        total_amount REAL NOT NULL,
+        file_path TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    # 发票表
+    conn.execute('''CREATE TABLE IF NOT EXISTS invoices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        contract_id INTEGER,
+        contract_number TEXT,
+        spec_model TEXT,
+        quantity INTEGER,
+        amount REAL,
+        file_path TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (contract_id) REFERENCES contracts (id)
+    )''')
+
+
+def _add_file_hash(conn: sqlite3.Connection):
+    add_column(conn, "contracts", "file_hash", "TEXT")
+    add_column(conn, "invoices", "file_hash", "TEXT")
+    # 按内容哈希去重（NULL不参与唯一约束）
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contracts_file_hash ON contracts(file_hash)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_file_hash ON invoices(file_hash)")
+
+
+def _add_lookup_indexes(conn: sqlite3.Connection):
+    # 按合同查发票、按合同号关联、合同列表按日期排序（id 作为同日期的次序）
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_contract_id ON invoices(contract_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_contract_number ON invoices(contract_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contracts_order_date ON contracts(order_date, id)")
+    conn.execute("ANALYZE")
+
+
+def totals_triggers(amount: str, invoiced_amount: str) -> List[str]:
+    """发票增删改时增量维护合同上的汇总列（金额列名随版本不同）"""
+    delta = f'''
+            {invoiced_amount} = {invoiced_amount} {{sign}} COALESCE({{row}}.{amount}, 0),
+            invoiced_quantity = invoiced_quantity {{sign}} COALESCE({{row}}.quantity, 0),
+            invoice_count = invoice_count {{sign}} 1
+        WHERE id = {{row}}.contract_id;'''
+    add, sub = delta.format(sign="+", row="NEW"), delta.format(sign="-", row="OLD")
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_invoices_totals_insert AFTER INSERT ON invoices
+    BEGIN
+        UPDATE contracts SET{add}
+    END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_invoices_totals_delete AFTER DELETE ON invoices
+    BEGIN
+        UPDATE contracts SET{sub}
+    END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_invoices_totals_update
+    AFTER UPDATE OF contract_id, {amount}, quantity ON invoices
+    BEGIN
+        UPDATE contracts SET{sub}
+        UPDATE contracts SET{add}
+    END""",
+    ]
+
+
+def _add_contract_totals(conn: sqlite3.Connection):
+    add_column(conn, "contracts", "invoiced_amount", "REAL NOT NULL DEFAULT 0")
+    add_column(conn, "contracts", "invoiced_quantity", "INTEGER NOT NULL DEFAULT 0")
+    add_column(conn, "contracts", "invoice_count", "INTEGER NOT NULL DEFAULT 0")
+    for sql in totals_triggers("amount", "invoiced_amount"):
+        conn.execute(sql)
+    conn.execute('''
+        UPDATE contracts SET
+            invoiced_amount = COALESCE((SELECT SUM(amount) FROM invoices WHERE contract_id = contracts.id), 0),
+            invoiced_quantity = COALESCE((SELECT SUM(quantity) FROM invoices WHERE contract_id = contracts.id), 0),
+            invoice_count = (SELECT COUNT(*) FROM invoices WHERE contract_id = contracts.id)
+    ''')
+
+
+def _add_contract_list_indexes(conn: sqlite3.Connection):
+    # 完成状态作为虚拟生成列，可建索引，按状态筛选不必扫描全表
+    add_column(conn, "contracts", "is_complete",
+               "INTEGER GENERATED ALWAYS AS (ABS(total_amount - invoiced_amount) < 0.01) VIRTUAL")
+    # 合同列表的游标分页：每种排序键都以 id 作为同值时的次序
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contracts_total_amount ON contracts(total_amount, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contracts_status_order_date ON contracts(is_complete, order_date, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contracts_status_total_amount ON contracts(is_complete, total_amount, id)")
+
+
+def _amounts_to_fen(conn: sqlite3.Connection):
+    # 金额改为整数「分」：REAL 列换成 INTEGER 列需要重建表；换算与应用层一致（十进制四舍五入）
+    conn.create_function("to_fen", 1, lambda yuan: None if yuan is None else to_fen(yuan), deterministic=True)
+    for trigger in ("trg_invoices_totals_insert", "trg_invoices_totals_delete", "trg_invoices_totals_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    rebuild_table(conn, "contracts", '''CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        po_number TEXT UNIQUE NOT NULL,
+        order_date TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        total_amount_fen INTEGER NOT NULL,
+        file_path TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        file_hash TEXT,
+        invoiced_amount_fen INTEGER NOT NULL DEFAULT 0,
+        invoiced_quantity INTEGER NOT NULL DEFAULT 0,
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        is_complete INTEGER GENERATED ALWAYS AS (total_amount_fen = invoiced_amount_fen) VIRTUAL
+    )''', {
+        "id": "id", "po_number": "po_number", "order_date": "order_date", "quantity": "quantity",
+        "total_amount_fen": "to_fen(total_amount)",
+        "file_path": "file_path", "created_at": "created_at", "file_hash": "file_hash",
+        "invoiced_quantity": "invoiced_quantity", "invoice_count": "invoice_count",
+    })
+
+    rebuild_table(conn, "invoices", '''CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        contract_id INTEGER,
+        contract_number TEXT,
+        spec_model TEXT,
+        quantity INTEGER,
+        amount_fen INTEGER,
+        file_path TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        file_hash TEXT,
+        FOREIGN KEY (contract_id) REFERENCES contracts (id)
+    )''', {
+        "id": "id", "contract_id": "contract_id", "contract_number": "contract_number",
+        "spec_model": "spec_model", "quantity": "quantity",
+        "amount_fen": "to_fen(amount)",
+        "file_path": "file_path", "status": "status", "created_at": "created_at", "file_hash": "file_hash",
+    })
+
+    # 重建随旧表删除的索引（先于重新汇总，汇总的子查询按 contract_id 走索引）
+    for sql in (
+        "CREATE UNIQUE INDEX idx_contracts_file_hash ON contracts(file_hash)",
+        "CREATE INDEX idx_contracts_order_date ON contracts(order_date, id)",
+        "CREATE INDEX idx_contracts_total_amount ON contracts(total_amount_fen, id)",
+        "CREATE INDEX idx_contracts_status_order_date ON contracts(is_complete, order_date, id)",
+        "CREATE INDEX idx_contracts_status_total_amount ON contracts(is_complete, total_amount_fen, id)",
+        "CREATE UNIQUE INDEX idx_invoices_file_hash ON invoices(file_hash)",
+        "CREATE INDEX idx_invoices_contract_id ON invoices(contract_id)",
+        "CREATE INDEX idx_invoices_contract_number ON invoices(contract_number)",
+    ):
+        conn.execute(sql)
+    # 已开票金额按分重新汇总（不沿用浮点累加的旧值）
+    conn.execute('''
+        UPDATE contracts SET invoiced_amount_fen =
+            COALESCE((SELECT SUM(amount_fen) FROM invoices WHERE contract_id = contracts.id), 0)
+    ''')
+    for sql in totals_triggers("amount_fen", "invoiced_amount_fen"):
+        conn.execute(sql)
+
+    conn.execute("ANALYZE")
+
+
+def _add_invoice_check_flags(conn: sqlite3.Connection):
+    # 核对结果位掩码（见 reconcile.py），NULL 表示尚未核对
+    add_column(conn, "invoices", "check_flags", "INTEGER")
+
+
+def _add_contract_lines(conn: sqlite3.Connection):
+    # 合同明细：每个规格型号一行，发票按 (采购单号, 规格型号) 一次索引查找对应明细
+    conn.execute('''CREATE TABLE IF NOT EXISTS contract_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        contract_id INTEGER NOT NULL,
+        po_number TEXT NOT NULL,
+        spec_model TEXT NOT NULL,
+        unit_price_fen INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (contract_id) REFERENCES contracts (id)
+    )''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contract_lines_po_spec ON contract_lines(po_number, spec_model)")
+    # 按明细累计已开票数量；前缀 contract_id 覆盖原来的单列索引
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_contract_spec ON invoices(contract_id, spec_model)")
+    conn.execute("DROP INDEX IF EXISTS idx_invoices_contract_id")
+
+
+def _add_po_key(conn: sqlite3.Connection):
+    # 采购单号归一化匹配键（见 po_match.py）；合同号模糊匹配不确定的发票进入复核队列
+    conn.create_function("normalize_po", 1, normalize_po, deterministic=True)
+    add_column(conn, "contracts", "po_key", "TEXT")
+    conn.execute("UPDATE contracts SET po_key = normalize_po(po_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contracts_po_key ON contracts(po_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_review ON invoices(id) WHERE status = 'review'")
+
+
+# 全文检索：外部内容 FTS5 表（trigram 分词，支持任意 3 个字符以上的子串匹配，如部分规格型号），触发器同步
+SEARCH_INDEXES = {
+    "contracts": ["po_number", "file_name", "ocr_text"],
+    "invoices": ["contract_number", "spec_model", "file_name", "ocr_text"],
+}
+
+
+def search_triggers(table: str, columns: List[str]) -> List[str]:
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{col}" for col in columns)
+    old = ", ".join(f"old.{col}" for col in columns)
+    insert = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        # 只在被索引的列变化时更新（汇总列、核对结果的更新不触发）
+        f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {cols} ON {table} BEGIN {delete} {insert} END",
+    ]
+
+
+def _add_search_index(conn: sqlite3.Connection):
+    # 原始文件名与识别全文
+    for table in SEARCH_INDEXES:
+        add_column(conn, table, "file_name", "TEXT")
+        add_column(conn, table, "ocr_text", "TEXT")
+    for table, columns in SEARCH_INDEXES.items():
+        conn.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+            {", ".join(columns)}, content='{table}', content_rowid='id', tokenize='trigram')''')
+        for sql in search_triggers(table, columns):
+            conn.execute(sql)
+        conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def file_basename(path: str) -> str:
+    """路径中的文件名（/ 与 \\ 都视为分隔符）"""
+    return ntpath.basename(path) if path else path
+
+
+def _backfill_file_name(conn: sqlite3.Connection):
+    # 旧版 Streamlit 库的 file_name（原始文件名）在版本 1 改名为 file_path，版本 10 新增的 file_name 因此为空：
+    # 取 file_path 的文件名回填（内容寻址 blob 的文件名是哈希，不是原始文件名，跳过），再重建检索索引
+    conn.create_function("file_basename", 1, file_basename, deterministic=True)
+    for table in SEARCH_INDEXES:
+        conn.execute(f'''UPDATE {table} SET file_name = file_basename(file_path)
+                        WHERE file_name IS NULL AND file_path IS NOT NULL
+                          AND file_basename(file_path) IS NOT file_hash''')
+        conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def search_document(columns: List[str], alias: str = "") -> str:
+    """PostgreSQL 检索用的拼接文本（表达式须与 GIN 索引的定义一致）"""
+    prefix = f"{alias}." if alias else ""
+    return " || ' ' || ".join(f"COALESCE({prefix}{col}, '')" for col in columns)
+
+
+# PostgreSQL 建表：BIGINT 自增主键、金额为 BIGINT 分、is_complete 为存储生成列；
+# created_at 与 SQLite 的 CURRENT_TIMESTAMP 相同（UTC，YYYY-MM-DD HH:MM:SS 文本）；order_date 按字节序排序
+PG_CREATED_AT = "TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+PG_TOTALS_FUNCTION = '''CREATE OR REPLACE FUNCTION invoices_totals() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE contracts SET
+                invoiced_amount_fen = invoiced_amount_fen - COALESCE(OLD.amount_fen, 0),
+                invoiced_quantity = invoiced_quantity - COALESCE(OLD.quantity, 0),
+                invoice_count = invoice_count - 1
+            WHERE id = OLD.contract_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE contracts SET
+                invoiced_amount_fen = invoiced_amount_fen + COALESCE(NEW.amount_fen, 0),
+                invoiced_quantity = invoiced_quantity + COALESCE(NEW.quantity, 0),
+                invoice_count = invoice_count + 1
+            WHERE id = NEW.contract_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql'''
+
+
+def _pg_create_schema(conn):
+    conn.execute(f'''CREATE TABLE contracts (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        po_number TEXT UNIQUE NOT NULL,
+        order_date TEXT COLLATE "C" NOT NULL,
+        quantity INTEGER NOT NULL,
+        total_amount_fen BIGINT NOT NULL,
+        file_path TEXT,
+        created_at {PG_CREATED_AT},
+        file_hash TEXT,
+        invoiced_amount_fen BIGINT NOT NULL DEFAULT 0,
+        invoiced_quantity INTEGER NOT NULL DEFAULT 0,
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        is_complete INTEGER GENERATED ALWAYS AS (CASE WHEN total_amount_fen = invoiced_amount_fen THEN 1 ELSE 0 END) STORED,
+        po_key TEXT,
+        file_name TEXT,
+        ocr_text TEXT
+    )''')
+    conn.execute(f'''CREATE TABLE invoices (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        contract_id BIGINT REFERENCES contracts (id),
+        contract_number TEXT,
+        spec_model TEXT,
+        quantity INTEGER,
+        amount_fen BIGINT,
+        file_path TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at {PG_CREATED_AT},
+        file_hash TEXT,
+        check_flags INTEGER,
+        file_name TEXT,
+        ocr_text TEXT
+    )''')
+    conn.execute('''CREATE TABLE contract_lines (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        contract_id BIGINT NOT NULL REFERENCES contracts (id),
+        po_number TEXT NOT NULL,
+        spec_model TEXT NOT NULL,
+        unit_price_fen BIGINT NOT NULL,
+        quantity INTEGER NOT NULL
+    )''')
+    # 索引与 SQLite 同名同列
+    for sql in (
+        "CREATE UNIQUE INDEX idx_contracts_file_hash ON contracts(file_hash)",
+        "CREATE INDEX idx_contracts_order_date ON contracts(order_date, id)",
+        "CREATE INDEX idx_contracts_total_amount ON contracts(total_amount_fen, id)",
+        "CREATE INDEX idx_contracts_status_order_date ON contracts(is_complete, order_date, id)",
+        "CREATE INDEX idx_contracts_status_total_amount ON contracts(is_complete, total_amount_fen, id)",
+        "CREATE INDEX idx_contracts_po_key ON contracts(po_key)",
+        "CREATE UNIQUE INDEX idx_invoices_file_hash ON invoices(file_hash)",
+        "CREATE INDEX idx_invoices_contract_number ON invoices(contract_number)",
+        "CREATE INDEX idx_invoices_contract_spec ON invoices(contract_id, spec_model)",
+        "CREATE INDEX idx_invoices_review ON invoices(id) WHERE status = 'review'",
+        "CREATE UNIQUE INDEX idx_contract_lines_po_spec ON contract_lines(po_number, spec_model)",
+    ):
+        conn.execute(sql)
+    # 合同开票汇总：一个触发器函数处理增删改
+    conn.execute(PG_TOTALS_FUNCTION)
+    conn.execute("CREATE TRIGGER trg_invoices_totals_insert AFTER INSERT ON invoices "
+                 "FOR EACH ROW EXECUTE FUNCTION invoices_totals()")
+    conn.execute("CREATE TRIGGER trg_invoices_totals_delete AFTER DELETE ON invoices "
+                 "FOR EACH ROW EXECUTE FUNCTION invoices_totals()")
+    conn.execute("CREATE TRIGGER trg_invoices_totals_update AFTER UPDATE OF contract_id, amount_fen, quantity ON invoices "
+                 "FOR EACH ROW EXECUTE FUNCTION invoices_totals()")
+    # 全文检索：pg_trgm 三元组 GIN 索引，与 FTS5 trigram 一样支持任意 3 个字符以上的子串匹配（ILIKE）
+    conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, columns in SEARCH_INDEXES.items():
+        conn.execute(f"CREATE INDEX idx_{table}_search ON {table} USING gin (({search_document(columns)}) gin_trgm_ops)")
+
+
+def _pg_backfill_file_name(conn):
+    # 与 SQLite 版本 11 相同；GIN 表达式索引随更新维护，无需重建
+    for table in SEARCH_INDEXES:
+        conn.execute(f'''UPDATE {table} SET file_name = regexp_replace(file_path, '^.*[\\\\/]', '')
+                        WHERE file_name IS NULL AND file_path IS NOT NULL
+                          AND regexp_replace(file_path, '^.*[\\\\/]', '') IS DISTINCT FROM file_hash''')
+
+
+def _add_data_version(conn: sqlite3.Connection):
+    # 单行表，经连接池提交的写事务加一（见 db.commit_versioned）；库标识区分重建或恢复的库
+    conn.execute("CREATE TABLE data_version (epoch TEXT NOT NULL, version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO data_version (epoch, version) VALUES (lower(hex(randomblob(8))), 0)")
+
+
+def _pg_add_data_version(conn):
+    conn.execute("CREATE TABLE data_version (epoch TEXT NOT NULL, version BIGINT NOT NULL)")
+    conn.execute("INSERT INTO data_version (epoch, version) VALUES (substr(md5(random()::text), 1, 16), 0)")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "合同表与发票表", _create_base_tables),
+    (2, "文件内容哈希及去重索引", _add_file_hash),
+    (3, "发票按合同查询、合同按日期排序的索引", _add_lookup_indexes),
+    (4, "合同开票汇总列及维护触发器", _add_contract_totals),
+    (5, "合同完成状态列及列表分页索引", _add_contract_list_indexes),
+    (6, "金额改为整数分存储，完成状态按分精确比较", _amounts_to_fen),
+    (7, "发票核对结果列", _add_invoice_check_flags),
+    (8, "合同明细表及规格型号索引", _add_contract_lines),
+    (9, "采购单号归一化匹配键及发票复核索引", _add_po_key),
+    (10, "合同与发票全文检索（FTS5）", _add_search_index),
+    (11, "旧库原始文件名回填并重建检索索引", _backfill_file_name),
+    (12, "数据版本表（发现其他进程、实例的写入）", _add_data_version),
+]
+
+
+PG_MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (10, "合同表、发票表、合同明细表及索引、汇总触发器、检索索引", _pg_create_schema),
+    (11, "旧库原始文件名回填", _pg_backfill_file_name),
+    (12, "数据版本表", _pg_add_data_version),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    if dialect(conn) == "postgresql":
+        if conn.execute("SELECT to_regclass('schema_version')").fetchone()[0] is None:
+            return 0
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _set_version(conn: sqlite3.Connection, version: int):
+    if dialect(conn) == "postgresql":
+        conn.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+    else:
+        conn.execute(f"PRAGMA user_version = {version}")
+
+
+def migrate(conn: sqlite3.Connection, migrations=None) -> int:
+    """执行所有未应用的迁移，返回迁移后的版本号"""
+    if dialect(conn) == "postgresql":
+        migrations = PG_MIGRATIONS if migrations is None else migrations
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        conn.commit()
+    migrations = MIGRATIONS if migrations is None else migrations
+    for version, description, apply in migrations:
+        if version <= current_version(conn):
+            continue
+        # 写锁内复查版本，多个进程（实例）同时启动时只有一个执行迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version > current_version(conn):
+                apply(conn)
+                _set_version(conn, version)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return current_version(conn)
+
+
+if __name__ == "__main__":
+    from db import DB_NAME, connection
+    with connection() as conn:
+        before = current_version(conn)
+        after = migrate(conn)
+    print(f"{DB_NAME}: 版本 {before} → {after}")
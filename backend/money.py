@@ -0,0 +1,19 @@
+"""
+金额换算
+库内金额一律以整数「分」存储和比较；元（浮点）只出现在识别结果和接口响应的边界上
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Union
+
+
+def to_fen(yuan: Union[int, float, str, Decimal]) -> int:
+    """元 → 分（按十进制四舍五入，避免 0.1 + 0.2 这类二进制误差）"""
+    if isinstance(yuan, int):
+        return yuan * 100
+    return int((Decimal(str(yuan)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_yuan(fen: int) -> float:
+    """分 → 元（仅用于展示和接口响应）"""
+    return fen / 100
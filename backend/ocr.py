@@ -0,0 +1,115 @@
+"""
+OCR识别
+可插拔的识别器接口；通过环境变量 OCR_EXTRACTOR=模块:类名 切换实现，
+默认使用确定性的本地 StubExtractor（开发与测试用）
+"""
+
+import importlib
+import os
+import re
+from typing import Optional
+
+OCR_EXTRACTOR = os.getenv("OCR_EXTRACTOR", "ocr:StubExtractor")
+
+
+class OCRError(Exception):
+    """识别失败"""
+
+
+class OCRExtractor:
+    """
+    识别器接口
+
+    实现类需可在子进程中无参构造（识别任务在进程池中运行），
+    并返回与 ContractCreate / InvoiceCreate 字段一致的字典；
+    可选的 text 字段为识别全文，入库后用于全文检索。
+    """
+
+    def extract_contract(self, path: str) -> dict:
+        raise NotImplementedError
+
+    def extract_invoice(self, path: str) -> dict:
+        raise NotImplementedError
+
+
+class StubExtractor(OCRExtractor):
+    """
+    本地桩识别器（不做真实OCR，结果只取决于文件内容）
+
+    文件开头若包含 `字段: 值` 或 `字段=值` 形式的文本行则按其取值，
+    缺失的字段使用演示默认值；合同缺少采购单号时返回 None，由调用方编号。
+    合同明细每行一条：`line: 规格型号, 单价, 数量`。
+    """
+
+    CONTRACT_DEFAULTS = {
+        "po_number": None,
+        "order_date": "2024-01-15",
+        "quantity": 100,
+        "total_amount": 50000.00,
+    }
+    INVOICE_DEFAULTS = {
+        "contract_number": "PO-2024001",  # 从发票备注栏识别
+        "spec_model": "SKU-A001",
+        "quantity": 50,
+        "amount": 25000.00,
+    }
+    _FIELD_RE = re.compile(r"^\s*(\w+)\s*[:=]\s*(.+?)\s*$", re.MULTILINE)
+
+    def _read_text(self, path: str) -> str:
+        with open(path, "rb") as f:
+            head = f.read(64 * 1024)
+        return head.decode("utf-8", errors="ignore")
+
+    def _extract(self, text: str, defaults: dict) -> dict:
+        fields = dict(self._FIELD_RE.findall(text))
+        result = {}
+        for key, default in defaults.items():
+            value = fields.get(key)
+            if value is None:
+                result[key] = default
+            elif default is None:
+                result[key] = value
+            else:
+                result[key] = type(default)(value)
+        result["text"] = text
+        return result
+
+    def extract_contract(self, path: str) -> dict:
+        text = self._read_text(path)
+        result = self._extract(text, self.CONTRACT_DEFAULTS)
+        result["lines"] = []
+        for key, value in self._FIELD_RE.findall(text):
+            if key == "line":
+                spec_model, unit_price, quantity = (part.strip() for part in value.split(","))
+                result["lines"].append({"spec_model": spec_model, "unit_price": float(unit_price),
+                                        "quantity": int(quantity)})
+        return result
+
+    def extract_invoice(self, path: str) -> dict:
+        return self._extract(self._read_text(path), self.INVOICE_DEFAULTS)
+
+
+def load_extractor(spec: Optional[str] = None) -> OCRExtractor:
+    """按 `模块:类名` 加载识别器"""
+    module_name, _, class_name = (spec or OCR_EXTRACTOR).partition(":")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    return cls()
+
+
+# 子进程内复用识别器实例（真实OCR引擎加载模型较慢）
+_extractors = {}
+
+
+def run_extraction(spec: str, kind: str, path: str) -> dict:
+    """进程池入口：kind 为 'contract' 或 'invoice'"""
+    extractor = _extractors.get(spec)
+    if extractor is None:
+        extractor = _extractors[spec] = load_extractor(spec)
+    try:
+        if kind == "contract":
+            return extractor.extract_contract(path)
+        return extractor.extract_invoice(path)
+    except OCRError:
+        raise
+    except Exception as e:
+        raise OCRError(f"识别失败: {e}") from e
@@ -0,0 +1,141 @@
+"""
+PostgreSQL 存储
+设置 DATABASE_URL=postgresql://用户:密码@主机:端口/库名 时使用（见 db.py），多个后端实例可共用一个数据库。
+连接提供与 sqlite3 相同的一组接口，仓储、核对、导入导出等模块两种数据库共用同一份 SQL：
+
+    ? 占位符            转为 %s
+    BEGIN IMMEDIATE     取事务级咨询锁：与 SQLite 的写锁相同，同一时刻只有一个写事务（跨实例），读不受影响；
+                        等锁超过 DB_BUSY_TIMEOUT_MS 报错
+    BEGIN               可重复读事务：事务内的多次查询读同一快照
+    cursor.lastrowid    本连接最近一次插入生成的 id
+    唯一约束冲突        抛出 sqlite3.IntegrityError
+    commit              写事务提交前数据版本加一（与 SQLite 相同，见 db.commit_versioned）
+    SUM 等聚合          整数结果为 int（PostgreSQL 返回 numeric）
+
+表结构见 migrations.py（PG_MIGRATIONS）；需要 psycopg 3（pip install "psycopg[binary]"）
+"""
+
+import sqlite3
+from decimal import Decimal
+from functools import lru_cache
+from typing import Iterable, Optional
+
+try:
+    import psycopg
+    from psycopg.adapt import Loader
+    from psycopg.conninfo import conninfo_to_dict
+    from psycopg.pq import TransactionStatus
+except ImportError:
+    raise ImportError('使用 PostgreSQL 需要安装 psycopg（pip install "psycopg[binary]"）')
+
+from db import DB_BUSY_TIMEOUT_MS, DB_POOL_SIZE, DB_POOL_TIMEOUT, ConnectionPool, commit_versioned
+
+WRITE_LOCK = 0x696E766F  # 写锁的咨询锁编号，所有实例相同
+
+
+@lru_cache(maxsize=1024)
+def translate(sql: str) -> str:
+    statement = sql.strip().upper()
+    if statement == "BEGIN IMMEDIATE":
+        return f"SELECT pg_advisory_xact_lock({WRITE_LOCK})"
+    if statement == "BEGIN":
+        return "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+    return sql.replace("%", "%%").replace("?", "%s")
+
+
+class NumericLoader(Loader):
+    def load(self, data):
+        value = Decimal(bytes(data).decode())
+        return int(value) if value == value.to_integral_value() else float(value)
+
+
+class PgCursor:
+    def __init__(self, cursor: psycopg.Cursor):
+        self._cursor = cursor
+
+    def execute(self, sql: str, params: Iterable = ()) -> "PgCursor":
+        try:
+            self._cursor.execute(translate(sql), params)
+        except psycopg.errors.IntegrityError as e:
+            raise sqlite3.IntegrityError(str(e)) from e
+        return self
+
+    def executemany(self, sql: str, seq_of_params: Iterable) -> "PgCursor":
+        try:
+            self._cursor.executemany(translate(sql), seq_of_params)
+        except psycopg.errors.IntegrityError as e:
+            raise sqlite3.IntegrityError(str(e)) from e
+        return self
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cursor.connection.execute("SELECT lastval()").fetchone()[0]
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: int):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class PgConnection:
+    dialect = "postgresql"
+
+    def __init__(self, raw: psycopg.Connection, watchers=()):
+        self.raw = raw
+        self.watchers = watchers
+        self.versioned = False  # 库中已有 data_version 表
+
+    def cursor(self, name: Optional[str] = None) -> PgCursor:
+        """name 不为空时为服务端游标：fetchmany 分批取回，不把整个结果读进内存"""
+        return PgCursor(self.raw.cursor(name) if name else self.raw.cursor())
+
+    def execute(self, sql: str, params: Iterable = ()) -> PgCursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Iterable) -> PgCursor:
+        return self.cursor().executemany(sql, seq_of_params)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+    def commit(self):
+        # 写事务提交前数据版本加一（见 db.commit_versioned）
+        commit_versioned(self, self.raw.commit, self.raw.info.transaction_status == TransactionStatus.INTRANS)
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+
+class PgPool(ConnectionPool):
+    """连接池（接口同 db.ConnectionPool）；path 为连接串"""
+
+    dialect = "postgresql"
+    errors = (psycopg.Error,)
+
+    def __init__(self, url: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        super().__init__(url, size, timeout)
+
+    def _connect(self) -> PgConnection:
+        # 保留连接串中已有的 options（如 -csearch_path=…）
+        options = conninfo_to_dict(self.path).get("options", "")
+        raw = psycopg.connect(self.path, options=f"{options} -c lock_timeout={DB_BUSY_TIMEOUT_MS}".strip())
+        raw.adapters.register_loader("numeric", NumericLoader)
+        return PgConnection(raw, self.watchers)
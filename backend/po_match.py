@@ -0,0 +1,153 @@
+"""
+采购单号模糊匹配
+OCR 从发票备注栏识别的合同号常有噪声（O/0、I/1 混淆，多余的横线、空格，全角字符），
+先归一化成匹配键（存于 contracts.po_key），再用内存中的三元组倒排索引召回候选，按编辑距离打分
+
+置信度 = 1 - 编辑距离 / 较长键长度；最高分达到 PO_AUTO_LINK_SCORE 且领先第二名 PO_AUTO_LINK_MARGIN 时自动关联，
+不低于 PO_REVIEW_MIN_SCORE 时转人工复核，否则视为未找到合同
+"""
+
+import os
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+PO_AUTO_LINK_SCORE = float(os.getenv("PO_AUTO_LINK_SCORE", "0.9"))
+PO_AUTO_LINK_MARGIN = float(os.getenv("PO_AUTO_LINK_MARGIN", "0.05"))
+PO_REVIEW_MIN_SCORE = float(os.getenv("PO_REVIEW_MIN_SCORE", "0.6"))
+PO_MATCH_TOP_K = int(os.getenv("PO_MATCH_TOP_K", "5"))
+
+# OCR 易混字符统一成数字（两侧同样归一化，只用于匹配，不用于展示）
+_CONFUSABLES = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "B": "8"})
+
+# 召回时最多累计的倒排项数：优先用最稀有的三元组，避免 "^P0" 这类所有合同共有的前缀拖慢查询
+_POSTING_BUDGET = 10000
+_RERANK = 20  # 参与编辑距离打分的候选数
+
+
+def normalize_po(text: Optional[str]) -> str:
+    """全角转半角、大写、易混字符归一，去掉字母数字以外的字符"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).upper().translate(_CONFUSABLES)
+    return "".join(ch for ch in text if ch.isascii() and ch.isalnum())
+
+
+def _grams(key: str) -> set:
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein 距离"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
+
+
+class Candidate(NamedTuple):
+    contract_id: int
+    po_number: str
+    score: float
+
+
+class POIndex:
+    """合同号三元组倒排索引（线程安全）"""
+
+    def __init__(self):
+        self._postings: Dict[str, set] = defaultdict(set)
+        self._contracts: Dict[int, tuple] = {}  # contract_id -> (po_number, po_key)
+        self._by_key: Dict[str, set] = defaultdict(set)  # po_key -> {contract_id}
+        self._last_id = 0  # 已索引的最大合同 id
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._contracts)
+
+    def add(self, contract_id: int, po_number: str, po_key: Optional[str] = None):
+        po_key = po_key if po_key is not None else normalize_po(po_number)
+        with self._lock:
+            self._contracts[contract_id] = (po_number, po_key)
+            self._last_id = max(self._last_id, contract_id)
+            self._by_key[po_key].add(contract_id)
+            for gram in _grams(po_key):
+                self._postings[gram].add(contract_id)
+
+    def remove(self, *contract_ids: int):
+        """删除已不存在的合同（如其他进程删除的）"""
+        with self._lock:
+            for contract_id in contract_ids:
+                entry = self._contracts.pop(contract_id, None)
+                if entry is None:
+                    continue
+                po_key = entry[1]
+                self._by_key[po_key].discard(contract_id)
+                if not self._by_key[po_key]:
+                    del self._by_key[po_key]
+                for gram in _grams(po_key):
+                    self._postings[gram].discard(contract_id)
+
+    def load(self, conn):
+        """从合同表重建索引"""
+        with self._lock:
+            self._postings.clear()
+            self._contracts.clear()
+            self._by_key.clear()
+            self._last_id = 0
+        for contract_id, po_number, po_key in conn.execute("SELECT id, po_number, po_key FROM contracts"):
+            self.add(contract_id, po_number, po_key)
+
+    def refresh(self, conn):
+        """追加 id 大于已索引合同的新合同（多 worker 时由其他进程写入的）"""
+        for contract_id, po_number, po_key in conn.execute(
+                "SELECT id, po_number, po_key FROM contracts WHERE id > ?", (self._last_id,)):
+            self.add(contract_id, po_number, po_key)
+
+    def search(self, text: str, k: int = PO_MATCH_TOP_K) -> List[Candidate]:
+        """返回相似度最高的 k 个合同（按分数降序）"""
+        key = normalize_po(text)
+        if not key:
+            return []
+        with self._lock:
+            exact = self._by_key.get(key)
+            if exact and len(exact) == 1 and len(key) * PO_AUTO_LINK_MARGIN <= 1:
+                # 归一化后唯一命中：其他合同至少差一次编辑，分数不超过 1 - 1/len(key)，必然可以自动关联
+                contract_id = next(iter(exact))
+                return [Candidate(contract_id, self._contracts[contract_id][0], 1.0)]
+            postings = sorted((self._postings.get(gram, ()) for gram in _grams(key)), key=len)
+            counts = Counter()
+            used = 0
+            for ids in postings:
+                if used and used + len(ids) > _POSTING_BUDGET:
+                    break
+                counts.update(ids)
+                used += len(ids)
+            shortlisted = [(cid, self._contracts[cid]) for cid, _ in counts.most_common(_RERANK)]
+        candidates = [Candidate(cid, po_number, round(similarity(key, po_key), 4))
+                      for cid, (po_number, po_key) in shortlisted]
+        candidates.sort(key=lambda c: (-c.score, c.contract_id))
+        return candidates[:k]
+
+
+def decide(candidates: List[Candidate]) -> str:
+    """'link'（自动关联第一个候选）/ 'review'（人工复核）/ 'none'（无可信候选）"""
+    if not candidates or candidates[0].score < PO_REVIEW_MIN_SCORE:
+        return "none"
+    best = candidates[0].score
+    runner_up = candidates[1].score if len(candidates) > 1 else 0.0
+    if best >= PO_AUTO_LINK_SCORE and best - runner_up >= PO_AUTO_LINK_MARGIN:
+        return "link"
+    return "review"
@@ -0,0 +1,459 @@
+"""
+数据访问层
+FastAPI 后端和两个 Streamlit 界面共用：表结构只由 migrations.py 定义，合同/发票的 SQL 只在这里写一份。
+语句文本都是模块常量，sqlite3 按连接缓存编译结果，重复执行不再解析；按 id / 合同号 / 哈希的批量查询
+按 SQL_BATCH 分块走 IN 列表
+
+两种实现，读接口相同：
+    Repository     直接读写数据库（SQLite 或 PostgreSQL，连接池见 db.py）；读结果经可替换的缓存，写入提交后按合同失效
+    ApiRepository  只读，经后端 HTTP 接口读取（Streamlit 设置 INVOICE_API_URL 时使用），带 ETag 条件请求
+
+缓存只需实现 get_or_load(key, loader) / invalidate_contracts(*ids) / clear()，如 cache.LRUCache；默认不缓存
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from cache import INVOICES, SUMMARY
+from db import ConnectionPool, pool as default_pool
+from migrations import migrate
+from money import to_fen, to_yuan
+from po_match import normalize_po
+from reconcile import check_invoice, describe_flags
+from writer import Writer
+
+INVOICE_API_URL = os.getenv("INVOICE_API_URL", "")  # 设置后 Streamlit 经后端接口只读，不直接打开数据库
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "10"))
+
+# SQLite 单条语句的参数个数上限（旧版本为999）
+SQL_BATCH = 900
+
+SORT_COLUMNS = {"order_date": "order_date", "total_amount": "total_amount_fen"}
+STATUS_VALUES = {"complete": 1, "incomplete": 0}
+
+
+class DataError(Exception):
+    """读写被拒绝；消息可直接展示给用户"""
+
+
+class NotFound(DataError):
+    pass
+
+
+class Conflict(DataError):
+    """唯一约束冲突（采购单号、明细规格型号、文件重复）"""
+
+
+class InvalidCursor(DataError):
+    pass
+
+
+def chunks(items: list, size: int = SQL_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _placeholders(n: int) -> str:
+    return ",".join("?" * n)
+
+
+CONTRACT_COLUMNS = '''id, po_number, order_date, quantity, total_amount_fen,
+               invoiced_amount_fen, invoiced_quantity, invoice_count, is_complete'''
+
+SELECT_CONTRACT = f"SELECT {CONTRACT_COLUMNS} FROM contracts WHERE id = ?"
+SELECT_CONTRACT_BY_PO = f"SELECT {CONTRACT_COLUMNS} FROM contracts WHERE po_number = ?"
+SELECT_STATS = "SELECT COUNT(*), COALESCE(SUM(is_complete), 0) FROM contracts"
+SELECT_INVOICES = '''SELECT id, spec_model, quantity, amount_fen, status, created_at, check_flags, file_name
+                     FROM invoices WHERE contract_id = ? ORDER BY id DESC'''
+
+INSERT_CONTRACT = '''INSERT INTO contracts (po_number, po_key, order_date, quantity, total_amount_fen,
+                                           file_path, file_name, file_hash, ocr_text)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+INSERT_CONTRACT_LINE = '''INSERT INTO contract_lines (contract_id, po_number, spec_model, unit_price_fen, quantity)
+                          VALUES (?, ?, ?, ?, ?)'''
+INSERT_INVOICE = '''INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen, status, check_flags,
+                                         file_path, file_name, file_hash, ocr_text)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def contract_to_dict(row) -> dict:
+    contract_id, po_number, order_date, qty, total_fen, invoiced_fen, invoiced_qty, inv_count, is_complete = row
+    return {
+        "id": contract_id,
+        "po_number": po_number,
+        "order_date": order_date,
+        "quantity": qty,
+        "total_amount": to_yuan(total_fen),
+        "invoiced_amount": to_yuan(invoiced_fen),
+        "total_amount_fen": total_fen,
+        "invoiced_amount_fen": invoiced_fen,
+        "invoiced_quantity": invoiced_qty,
+        "status": 'complete' if is_complete else 'incomplete',
+        "invoice_count": inv_count
+    }
+
+
+def invoice_to_dict(row) -> dict:
+    invoice_id, spec_model, qty, amount_fen, status, created_at, check_flags, file_name = row
+    return {
+        "id": invoice_id,
+        "spec_model": spec_model,
+        "quantity": qty,
+        "amount": to_yuan(amount_fen) if amount_fen is not None else None,
+        "amount_fen": amount_fen,
+        "status": status,
+        "created_at": created_at,
+        "file_name": file_name,
+        "issues": describe_flags(check_flags or 0)
+    }
+
+
+def invoice_status(check_flags: int) -> str:
+    return 'verified' if check_flags == 0 else 'mismatch'
+
+
+def encode_cursor(sort_value, contract_id: int) -> str:
+    """游标 = 上一页最后一行的 (排序值, id)，对客户端不透明"""
+    return base64.urlsafe_b64encode(json.dumps([sort_value, contract_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        sort_value, contract_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, int(contract_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("无效的分页游标")
+
+
+# 以下函数在调用方的事务中执行（传入游标，由调用方提交）
+
+def fetch_contracts(c: sqlite3.Cursor, contract_ids) -> Dict[int, dict]:
+    """按 id 读取合同当前状态：{id: 合同}"""
+    contracts = {}
+    for chunk in chunks(list(contract_ids)):
+        c.execute(f"SELECT {CONTRACT_COLUMNS} FROM contracts WHERE id IN ({_placeholders(len(chunk))})", chunk)
+        contracts.update((row[0], contract_to_dict(row)) for row in c.fetchall())
+    return contracts
+
+
+def find_contract(c: sqlite3.Cursor, po_number: str) -> Optional[dict]:
+    row = c.execute(SELECT_CONTRACT_BY_PO, (po_number,)).fetchone()
+    return contract_to_dict(row) if row else None
+
+
+def resolve_contract_numbers(c: sqlite3.Cursor, numbers: Iterable[str]) -> Dict[str, int]:
+    """合同号精确匹配：{采购单号: 合同id}，找不到的不在结果中"""
+    contracts = {}
+    for chunk in chunks(list(numbers)):
+        c.execute(f"SELECT po_number, id FROM contracts WHERE po_number IN ({_placeholders(len(chunk))})", chunk)
+        contracts.update(c.fetchall())
+    return contracts
+
+
+def find_invoice_hashes(c: sqlite3.Cursor, hashes: Iterable[str]) -> Dict[str, int]:
+    """已入库的发票文件：{文件哈希: 发票id}"""
+    existing = {}
+    for chunk in chunks(list(hashes)):
+        c.execute(f"SELECT file_hash, id FROM invoices WHERE file_hash IN ({_placeholders(len(chunk))})", chunk)
+        existing.update(c.fetchall())
+    return existing
+
+
+def insert_contract_lines(c: sqlite3.Cursor, contract_id: int, po_number: str, lines: List[dict]):
+    c.executemany(INSERT_CONTRACT_LINE,
+                  [(contract_id, po_number, line['spec_model'], to_fen(line['unit_price']), line['quantity'])
+                   for line in lines])
+
+
+def insert_contract(c: sqlite3.Cursor, po_number: str, order_date: str, quantity: int, total_amount,
+                    lines: List[dict] = (), file_path: Optional[str] = None, file_name: Optional[str] = None,
+                    file_hash: Optional[str] = None, ocr_text: Optional[str] = None) -> int:
+    """插入合同及明细，返回合同 id；采购单号、合同文件（file_hash）或明细规格型号重复时抛出 Conflict"""
+    try:
+        c.execute(INSERT_CONTRACT, (po_number, normalize_po(po_number), order_date, quantity, to_fen(total_amount),
+                                    file_path, file_name, file_hash, ocr_text))
+        contract_id = c.lastrowid
+        insert_contract_lines(c, contract_id, po_number, list(lines))
+    except sqlite3.IntegrityError as e:
+        # 按违反的约束区分（SQLite 报表名.列名，PostgreSQL 报索引名，都含下列名称）
+        if "contract_lines" in str(e):
+            raise Conflict("合同明细中规格型号重复")
+        if "file_hash" in str(e):
+            raise Conflict("合同已存在（重复上传）")
+        raise Conflict("采购单号已存在")
+    return contract_id
+
+
+def insert_invoice(conn: sqlite3.Connection, invoice: dict, source: dict) -> dict:
+    """
+    按采购单号精确关联合同，入库前核对（规则见 reconcile.py）后插入发票；有问题的发票照常入库，状态为 mismatch
+    返回 {invoice_id, contract_id, status, issues}
+    """
+    c = conn.cursor()
+    contract = find_contract(c, invoice["contract_number"])
+    if contract is None:
+        raise NotFound(f"未找到合同号: {invoice['contract_number']}")
+    check_flags = check_invoice(conn, contract, invoice["spec_model"], invoice["quantity"], to_fen(invoice["amount"]))
+    try:
+        c.execute(INSERT_INVOICE, invoice_row(contract["id"], invoice, invoice_status(check_flags), check_flags, source))
+    except sqlite3.IntegrityError:
+        raise Conflict("发票已存在（重复上传）")
+    return {"invoice_id": c.lastrowid, "contract_id": contract["id"], "status": invoice_status(check_flags),
+            "issues": describe_flags(check_flags)}
+
+
+def invoice_row(contract_id: Optional[int], invoice: dict, status: str, check_flags: int, source: dict) -> tuple:
+    """INSERT_INVOICE 的参数；source 为文件信息（file_path / file_name / file_hash / ocr_text）"""
+    return (contract_id, invoice['contract_number'], invoice['spec_model'], invoice['quantity'],
+            to_fen(invoice['amount']), status, check_flags,
+            source.get('file_path'), source.get('file_name'), source.get('file_hash'), source.get('ocr_text'))
+
+
+class NoCache:
+    """不缓存（Repository 的默认缓存）"""
+    version = 0
+
+    def get_or_load(self, key, loader):
+        return loader()
+
+    def invalidate_contracts(self, *contract_ids: int):
+        pass
+
+    def clear(self):
+        pass
+
+
+class Repository:
+    """
+    直接读写数据库的数据访问对象（线程安全，连接来自连接池）
+    传入 writer（见 writer.py）时，并发新增的发票合并为组提交；否则每张发票单独提交
+    """
+
+    read_only = False
+
+    def __init__(self, pool: ConnectionPool = default_pool, cache=None, writer: Optional[Writer] = None):
+        self.pool = pool
+        self.cache = cache if cache is not None else NoCache()
+        self.writer = writer
+
+    def migrate(self) -> int:
+        with self.pool.connection() as conn:
+            return migrate(conn)
+
+    # 读
+
+    def list_contracts(self, limit: Optional[int] = None, after: Optional[str] = None, status: Optional[str] = None,
+                       sort: str = "order_date", order: str = "asc", offset: int = 0) -> Tuple[List[dict], Optional[str]]:
+        """
+        一页合同，返回 (合同列表, 下一页游标或None)；筛选和排序都走索引
+        翻页用 after（上一页返回的游标，逐页往后）或 offset（跳到第几条，页码翻页）
+        """
+        return self.cache.get_or_load((SUMMARY, limit, after, status, sort, order, offset),
+                                      lambda: self._query_contracts(limit, after, status, sort, order, offset))
+
+    def _query_contracts(self, limit, after, status, sort, order, offset):
+        column = SORT_COLUMNS[sort]
+        direction, compare = ("ASC", ">") if order == "asc" else ("DESC", "<")
+        where, params = [], []
+        if status is not None:
+            where.append("is_complete = ?")
+            params.append(STATUS_VALUES[status])
+        if after:
+            sort_value, last_id = decode_cursor(after)
+            where.append(f"({column}, id) {compare} (?, ?)")
+            params.extend([sort_value, last_id])
+        sql = f'''
+            SELECT {CONTRACT_COLUMNS}
+            FROM contracts
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {column} {direction}, id {direction}
+        '''
+        if limit is not None:
+            # 多取一行判断是否还有下一页
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit + 1, offset])
+
+        # 汇总列由触发器维护，只读合同表
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[4] if sort == "total_amount" else last[2], last[0])
+
+        return [contract_to_dict(row) for row in rows], next_cursor
+
+    def contract_stats(self) -> dict:
+        """合同总数与已完成数"""
+        def load():
+            with self.pool.connection() as conn:
+                total, complete = conn.execute(SELECT_STATS).fetchone()
+            return {"total": total, "complete": int(complete)}
+        return self.cache.get_or_load((SUMMARY, "stats"), load)
+
+    def count_contracts(self, status: Optional[str] = None) -> int:
+        stats = self.contract_stats()
+        if status is None:
+            return stats["total"]
+        return stats["complete"] if status == "complete" else stats["total"] - stats["complete"]
+
+    def get_contract(self, contract_id: int) -> Optional[dict]:
+        def load():
+            with self.pool.connection() as conn:
+                row = conn.execute(SELECT_CONTRACT, (contract_id,)).fetchone()
+            return contract_to_dict(row) if row else None
+        return self.cache.get_or_load((SUMMARY, "contract", contract_id), load)
+
+    def contract_invoices(self, contract_id: int) -> List[dict]:
+        """某个合同的所有发票，新的在前"""
+        def load():
+            with self.pool.connection() as conn:
+                rows = conn.execute(SELECT_INVOICES, (contract_id,)).fetchall()
+            return [invoice_to_dict(row) for row in rows]
+        return self.cache.get_or_load((INVOICES, contract_id), load)
+
+    def find_duplicate(self, table: str, file_hash: str):
+        """按内容哈希查找已上传的记录（走唯一索引）"""
+        with self.pool.connection() as conn:
+            if table == "contracts":
+                return conn.execute("SELECT id, po_number FROM contracts WHERE file_hash = ?", (file_hash,)).fetchone()
+            return conn.execute("SELECT id, contract_id, contract_number FROM invoices WHERE file_hash = ?",
+                                (file_hash,)).fetchone()
+
+    def invoice_hashes(self, hashes: Iterable[str]) -> Dict[str, int]:
+        """已入库的发票文件：{文件哈希: 发票id}"""
+        with self.pool.connection() as conn:
+            return find_invoice_hashes(conn.cursor(), hashes)
+
+    # 写
+
+    def add_contract(self, po_number: str, order_date: str, quantity: int, total_amount,
+                     lines: List[dict] = (), **source) -> dict:
+        """新增合同（source 为 file_path / file_name / file_hash / ocr_text），返回合同汇总"""
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            contract_id = insert_contract(c, po_number, order_date, quantity, total_amount, lines, **source)
+            contract = fetch_contracts(c, [contract_id])[contract_id]
+            conn.commit()
+        self.cache.invalidate_contracts(contract_id)
+        return contract
+
+    def add_invoice(self, contract_number: str, spec_model: str, quantity: int, amount, **source) -> dict:
+        """新增发票（核对规则见 insert_invoice），提交后返回 {invoice_id, contract_id, status, issues}"""
+        invoice = {"contract_number": contract_number, "spec_model": spec_model, "quantity": quantity,
+                   "amount": amount}
+        if self.writer is not None:
+            result = self.writer.submit_group(insert_invoice, invoice, source).result()
+        else:
+            with self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                result = insert_invoice(conn, invoice, source)
+                conn.commit()
+        self.cache.invalidate_contracts(result["contract_id"])
+        return result
+
+    def delete_contract(self, contract_id: int) -> bool:
+        """删除合同及其明细和关联发票"""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM invoices WHERE contract_id = ?", (contract_id,))
+            conn.execute("DELETE FROM contract_lines WHERE contract_id = ?", (contract_id,))
+            deleted = conn.execute("DELETE FROM contracts WHERE id = ?", (contract_id,)).rowcount
+            conn.commit()
+        self.cache.invalidate_contracts(contract_id)
+        return bool(deleted)
+
+    def delete_invoice(self, invoice_id: int) -> Optional[int]:
+        """删除单张发票，返回其合同 id（发票不存在时返回 None）"""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT contract_id FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+            conn.commit()
+        self.cache.invalidate_contracts(row[0])
+        return row[0]
+
+
+class ApiRepository:
+    """
+    经后端 HTTP 接口只读，读方法与 Repository 相同；写方法抛出 DataError
+    响应按 URL 连同 ETag 保存，再次读取时带 If-None-Match，数据未变时后端返回 304，直接用保存的结果
+    """
+
+    read_only = True
+    MAX_ENTRIES = 256
+
+    def __init__(self, base_url: str = INVOICE_API_URL, timeout: float = API_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._responses: Dict[str, tuple] = {}  # url -> (etag, 响应体, 下一页游标)
+        self._lock = threading.Lock()
+
+    def _get(self, path: str, **params):
+        query = urlencode({key: value for key, value in params.items() if value is not None})
+        url = f"{self.base_url}{path}{'?' + query if query else ''}"
+        with self._lock:
+            saved = self._responses.get(url)
+        request = Request(url, headers={"If-None-Match": saved[0]} if saved and saved[0] else {})
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                body = json.load(response)
+                etag, next_cursor = response.headers.get("ETag"), response.headers.get("X-Next-Cursor")
+        except HTTPError as e:
+            if e.code == 304 and saved:
+                return saved[1], saved[2]
+            try:
+                detail = json.load(e).get("detail")
+            except ValueError:
+                detail = None
+            raise (NotFound if e.code == 404 else DataError)(detail or f"后端接口返回 {e.code}")
+        with self._lock:
+            if len(self._responses) >= self.MAX_ENTRIES:
+                self._responses.clear()
+            self._responses[url] = (etag, body, next_cursor)
+        return body, next_cursor
+
+    def list_contracts(self, limit: Optional[int] = None, after: Optional[str] = None, status: Optional[str] = None,
+                       sort: str = "order_date", order: str = "asc", offset: int = 0) -> Tuple[List[dict], Optional[str]]:
+        return self._get("/contracts", limit=limit, after=after, status=status, sort=sort, order=order,
+                         offset=offset or None)
+
+    def contract_stats(self) -> dict:
+        return self._get("/contracts/stats")[0]
+
+    def count_contracts(self, status: Optional[str] = None) -> int:
+        return Repository.count_contracts(self, status)
+
+    def get_contract(self, contract_id: int) -> Optional[dict]:
+        try:
+            return self._get(f"/contracts/{contract_id}")[0]
+        except NotFound:
+            return None
+
+    def contract_invoices(self, contract_id: int) -> List[dict]:
+        return self._get(f"/contracts/{contract_id}/invoices")[0]
+
+    def _read_only(self, *args, **kwargs):
+        raise DataError("经后端接口只读，不能修改数据；请通过后端上传")
+
+    add_contract = add_invoice = delete_contract = delete_invoice = _read_only
+
+
+def open_repository():
+    """Streamlit 用：设置了 INVOICE_API_URL 时经后端接口只读，否则直接打开数据库（先执行迁移）"""
+    if INVOICE_API_URL:
+        return ApiRepository(INVOICE_API_URL)
+    repository = Repository(writer=Writer())
+    repository.migrate()
+    return repository
@@ -0,0 +1,43 @@
+"""
+生产环境启动：多个 worker 进程
+    python serve.py        WEB_WORKERS 个 worker（默认每个 CPU 核一个），监听 HOST:PORT
+
+启动 worker 之前在本进程执行一次数据库迁移，再新建共享状态目录（见 shared.py）：
+各 worker 的读缓存失效、SSE 事件与识别任务状态经该目录共享，定期导出快照只由一个 worker 执行。
+开发时仍可用 uvicorn main:app --reload 单进程运行
+"""
+
+import os
+import shutil
+import tempfile
+
+import uvicorn
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+
+def main():
+    from db import DB_NAME, connection, pool
+    from migrations import migrate
+
+    with connection() as conn:
+        version = migrate(conn)
+    pool.close()
+    print(f"{DB_NAME}: 版本 {version}，启动 {WEB_WORKERS} 个 worker")
+
+    # 共享状态目录在迁移完成后才设置：worker 据此跳过迁移（见 main.py）
+    state_dir = tempfile.mkdtemp(prefix="invoice-checker-")
+    os.environ["SHARED_STATE_DIR"] = state_dir
+    # 每个 worker 各有一个识别进程池：未指定 OCR_WORKERS 时按 worker 数均分 CPU
+    os.environ.setdefault("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+    try:
+        # SSE 长连接不会自行结束，关闭时最多等待5秒
+        uvicorn.run("main:app", host=HOST, port=PORT, workers=WEB_WORKERS, timeout_graceful_shutdown=5)
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
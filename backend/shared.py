@@ -0,0 +1,152 @@
+"""
+多 worker 进程间共享状态
+serve.py 以多个 worker 进程运行时，在 SHARED_STATE_DIR（由 serve.py 在迁移完成后创建并设置）下放置：
+
+    cache.log     读缓存失效记录（见 cache.py）：各 worker 按合同失效自己的读缓存
+    events.log    合同变化事件（见 events.py）：任一 worker 发布，所有 worker 推送，事件 ID 全局递增
+    jobs/         识别任务状态（见 jobs.py）：任一 worker 都能查询
+    *.lock        只由一个 worker 运行的后台任务（如定期导出快照）
+
+SHARED_STATE_DIR 为空时（uvicorn main:app 单进程运行、Streamlit、命令行）以上都留在进程内，不创建文件
+"""
+
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows：只支持单进程运行
+    fcntl = None
+
+STATE_DIR = os.getenv("SHARED_STATE_DIR") or None
+
+_roles = {}  # 已取得的角色 -> 锁文件描述符（进程退出时释放）
+
+
+def state_path(name: str) -> Optional[str]:
+    """共享状态目录下的路径；单进程运行时为 None"""
+    return os.path.join(STATE_DIR, name) if STATE_DIR else None
+
+
+def claim(role: str) -> bool:
+    """
+    取得只由一个 worker 承担的角色（非阻塞文件锁，持有到进程退出）；单进程运行时总是取得。
+    持有者退出后由之后调用 claim 的进程接替
+    """
+    if not STATE_DIR or fcntl is None:
+        return True
+    if role in _roles:
+        return True
+    fd = os.open(state_path(f"{role}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _roles[role] = fd
+    return True
+
+
+@contextmanager
+def file_lock(path: str):
+    """跨进程互斥（同一进程内的线程仍需另加线程锁）；没有 fcntl 时不加锁"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class SharedLog:
+    """
+    定长记录的环形日志（内存映射文件，所有 worker 映射同一个文件）：
+    append 追加记录并返回最新序号，read(after) 取序号 after 之后的记录。
+    追加在文件锁内进行；读取先不加锁比较序号，有新记录时才加锁复制，没有写入时读取不做系统调用
+    """
+
+    _HEADER = struct.Struct("<Q")  # 已追加的记录总数，即最新记录的序号（从 1 开始）
+    _LENGTH = struct.Struct("<I")  # 每个槽位开头的记录长度
+
+    def __init__(self, path: str, slots: int, slot_size: int):
+        if fcntl is None:
+            raise RuntimeError("多 worker 运行需要 fcntl（Linux/macOS）")
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = self._LENGTH.size + slot_size
+        size = self._HEADER.size + slots * self._stride
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            existing = os.fstat(self._fd).st_size
+            if existing == 0:
+                os.ftruncate(self._fd, size)
+            elif existing != size:
+                raise ValueError(f"{path} 的大小与配置不符（各 worker 的配置应相同）")
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        # flock 对同一进程的线程不互斥
+        self._lock = threading.Lock()
+
+    @property
+    def seq(self) -> int:
+        return self._HEADER.unpack_from(self._map, 0)[0]
+
+    def append(self, *records: bytes) -> int:
+        for record in records:
+            if len(record) > self.slot_size:
+                raise ValueError(f"记录长度 {len(record)} 超过槽位大小 {self.slot_size}")
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                seq = self.seq
+                for record in records:
+                    offset = self._HEADER.size + seq % self.slots * self._stride
+                    self._LENGTH.pack_into(self._map, offset, len(record))
+                    start = offset + self._LENGTH.size
+                    self._map[start:start + len(record)] = record
+                    seq += 1
+                # 最后更新序号：不加锁的读取方看到新序号时记录已写完
+                self._HEADER.pack_into(self._map, 0, seq)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return seq
+
+    def read(self, after: int) -> Tuple[int, Optional[List[bytes]]]:
+        """返回 (最新序号, after 之后的记录)；落后超过 slots 条、记录已被覆盖时记录为 None"""
+        if self.seq == after:
+            return after, []
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                seq = self.seq
+                if after > seq or seq - after > self.slots:
+                    return seq, None
+                records = []
+                for n in range(after, seq):
+                    offset = self._HEADER.size + n % self.slots * self._stride
+                    (length,) = self._LENGTH.unpack_from(self._map, offset)
+                    start = offset + self._LENGTH.size
+                    records.append(self._map[start:start + length])
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return seq, records
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def open_log(name: str, slots: int, slot_size: int) -> Optional[SharedLog]:
+    """共享状态目录下的环形日志；单进程运行时为 None"""
+    path = state_path(name)
+    return SharedLog(path, slots, slot_size) if path else None
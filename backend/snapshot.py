@@ -0,0 +1,234 @@
+"""
+列式快照
+后台线程定期把合同和发票导出为 Arrow IPC 文件，按合同订单月份分区：
+    {SNAPSHOT_DIR}/contracts/month=2024-01.arrow
+    {SNAPSHOT_DIR}/invoices/month=2024-01.arrow
+    {SNAPSHOT_DIR}/manifest.json
+
+增量：每次先按月份汇总合同表得到指纹（合同数、最大 id、合同额与已开票汇总），只重写指纹变化的月份；
+只改发票核对结果（不影响合同汇总）的写入由调用方 invalidate() 后整体重写。
+分区文件写入临时文件后原子替换，正在内存映射读取旧文件的分析查询不受影响（见 analytics.py）；
+重写标记与导出锁都在快照目录中，多个 worker 或命令行同时导出时依次进行
+
+需要 pyarrow（按需导入）；命令行：
+    python snapshot.py          增量导出
+    python snapshot.py --full   全部重写
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from db import connection, dialect
+from shared import file_lock
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "300"))  # 后台导出间隔秒数，0 表示不自动导出
+
+# 订单月份（订单日期不是 YYYY-MM 开头的归入 unknown）与浮点求和（空表为 0），两种数据库写法不同
+MONTH_SQL = {
+    "sqlite": "CASE WHEN {col} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr({col}, 1, 7) ELSE 'unknown' END",
+    "postgresql": "CASE WHEN {col} ~ '^[0-9]{{4}}-[0-9]{{2}}' THEN substr({col}, 1, 7) ELSE 'unknown' END",
+}
+TOTAL_SQL = {"sqlite": "TOTAL({})", "postgresql": "COALESCE(SUM({})::float8, 0)"}
+
+
+def snapshot_sql(dialect: str) -> Dict[str, str]:
+    month, total = MONTH_SQL[dialect].format, TOTAL_SQL[dialect].format
+    return {
+        "fingerprint": f'''SELECT {month(col="order_date")} AS month, COUNT(*), MAX(id), {total("total_amount_fen")},
+                                  {total("invoiced_amount_fen")}, {total("invoiced_quantity")}, {total("invoice_count")}
+                           FROM contracts GROUP BY month''',
+        "contracts": f'''SELECT id, po_number, order_date, {month(col="order_date")} AS month, quantity,
+                                total_amount_fen, invoiced_amount_fen, invoiced_quantity, invoice_count, is_complete
+                         FROM contracts WHERE {month(col="order_date")} = ? ORDER BY id''',
+        # 发票随合同分区（复核中、未关联合同的发票不进入快照）
+        "invoices": f'''SELECT i.id, i.contract_id, {month(col="c.order_date")} AS month, i.spec_model, i.quantity,
+                               i.amount_fen, i.status, i.check_flags, i.created_at
+                        FROM contracts c JOIN invoices i ON i.contract_id = c.id
+                        WHERE {month(col="c.order_date")} = ? ORDER BY i.id''',
+    }
+
+
+SNAPSHOT_SQL = {name: snapshot_sql(name) for name in MONTH_SQL}
+
+
+class SnapshotUnavailable(Exception):
+    """未安装 pyarrow 或还没有快照"""
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError:
+        raise SnapshotUnavailable("列式快照需要安装 pyarrow（pip install pyarrow）")
+    return pyarrow
+
+
+def schemas() -> dict:
+    pa = require_pyarrow()
+    return {
+        "contracts": pa.schema([
+            ("id", pa.int64()), ("po_number", pa.string()), ("order_date", pa.string()), ("month", pa.string()),
+            ("quantity", pa.int64()), ("total_amount_fen", pa.int64()), ("invoiced_amount_fen", pa.int64()),
+            ("invoiced_quantity", pa.int64()), ("invoice_count", pa.int64()), ("is_complete", pa.int8()),
+        ]),
+        "invoices": pa.schema([
+            ("id", pa.int64()), ("contract_id", pa.int64()), ("month", pa.string()), ("spec_model", pa.string()),
+            ("quantity", pa.int64()), ("amount_fen", pa.int64()), ("status", pa.string()),
+            ("check_flags", pa.int64()), ("created_at", pa.string()),
+        ]),
+    }
+
+
+def partition_path(directory: str, kind: str, month: str) -> str:
+    return os.path.join(directory, kind, f"month={month}.arrow")
+
+
+def read_manifest(directory: str = SNAPSHOT_DIR) -> dict:
+    try:
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": 0, "updated_at": None, "months": {}}
+
+
+def _write_atomic(path: str, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_partition(pa, schema, path: str, rows: List[tuple]):
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                 schema=schema)
+
+    def write(tmp):
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table, max_chunksize=64 * 1024)
+    _write_atomic(path, write)
+
+
+class SnapshotExporter:
+    """快照导出（线程安全）；start() 启动后台定期导出"""
+
+    def __init__(self, directory: str = SNAPSHOT_DIR, interval: float = SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.last_result: Optional[dict] = None
+        self.last_error: Optional[str] = None
+        self._full_marker = os.path.join(directory, "FULL")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def invalidate(self):
+        """下次导出时全部重写（核对结果等不反映在合同汇总上的变化）"""
+        os.makedirs(self.directory, exist_ok=True)
+        open(self._full_marker, "w").close()
+
+    def run(self, full: bool = False) -> dict:
+        """导出一次，返回统计；每个月份各用一个短读事务（WAL 下长读事务会阻止检查点）"""
+        pa = require_pyarrow()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, file_lock(os.path.join(self.directory, "LOCK")):
+            started = time.perf_counter()
+            full = full or os.path.exists(self._full_marker)
+            if full:
+                try:
+                    os.remove(self._full_marker)
+                except FileNotFoundError:
+                    pass
+            manifest = read_manifest(self.directory)
+            with connection() as conn:
+                sql = SNAPSHOT_SQL[dialect(conn)]
+                fingerprints = {month: list(values) for month, *values in conn.execute(sql["fingerprint"])}
+            previous = manifest["months"]
+            changed = [month for month, fingerprint in fingerprints.items()
+                       if full or previous.get(month, {}).get("fingerprint") != fingerprint]
+            removed = [month for month in previous if month not in fingerprints]
+
+            months: Dict[str, dict] = {month: info for month, info in previous.items() if month in fingerprints}
+            for month in changed:
+                # 同一个月份的合同和发票在同一个读事务中读取，两个分区一致
+                with connection() as conn:
+                    conn.execute("BEGIN")
+                    rows = {kind: conn.execute(sql[kind], (month,)).fetchall() for kind in ("contracts", "invoices")}
+                    conn.rollback()
+                for kind, schema in schemas().items():
+                    _write_partition(pa, schema, partition_path(self.directory, kind, month), rows[kind])
+                months[month] = {"fingerprint": fingerprints[month],
+                                 **{kind: len(kind_rows) for kind, kind_rows in rows.items()}}
+
+            if changed or removed:
+                manifest = {"version": manifest["version"] + 1,
+                            "updated_at": datetime.now().isoformat(timespec="seconds"),
+                            "months": dict(sorted(months.items()))}
+
+                def write(tmp):
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(manifest, f, ensure_ascii=False)
+                # 先写清单再删文件：读取方只读清单里的月份
+                _write_atomic(os.path.join(self.directory, "manifest.json"), write)
+                for month in removed:
+                    for kind in ("contracts", "invoices"):
+                        try:
+                            os.remove(partition_path(self.directory, kind, month))
+                        except FileNotFoundError:
+                            pass
+
+            self.last_result = {"version": manifest["version"], "months": len(fingerprints),
+                                "written": sorted(changed), "removed": sorted(removed),
+                                "seconds": round(time.perf_counter() - started, 3)}
+            return self.last_result
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="snapshot-exporter", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.run()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> dict:
+        manifest = read_manifest(self.directory)
+        return {"directory": self.directory, "interval": self.interval, "version": manifest["version"],
+                "updated_at": manifest["updated_at"], "months": len(manifest["months"]),
+                "last_run": self.last_result, "last_error": self.last_error}
+
+
+if __name__ == "__main__":
+    from db import DB_NAME
+    from migrations import migrate
+
+    with connection() as conn:
+        migrate(conn)
+    try:
+        result = SnapshotExporter().run(full="--full" in sys.argv[1:])
+    except SnapshotUnavailable as e:
+        sys.exit(str(e))
+    print(f"{DB_NAME} → {SNAPSHOT_DIR}: {result}")
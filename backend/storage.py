@@ -0,0 +1,164 @@
+"""
+上传文件存储
+分块流式写盘（临时文件 + 原子重命名），写入过程中同步计算SHA-256；
+最终文件按内容哈希存放（uploads/blobs/ab/abcdef...），相同内容只存一份
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, List, Tuple, Union
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# 存储配置（可通过环境变量覆盖）
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))  # 默认50MB
+CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 默认1MB
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+MAX_ZIP_SIZE = int(os.getenv("MAX_ZIP_SIZE", str(1024 * 1024 * 1024)))  # ZIP包大小上限，默认1GB
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "5000"))  # 批量上传（含ZIP解包）的文件数上限
+
+
+class UploadTooLarge(Exception):
+    """上传文件超过 MAX_UPLOAD_SIZE"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"文件超过大小限制 ({limit} 字节)")
+        self.limit = limit
+
+
+@dataclass
+class StoredUpload:
+    """已落盘但尚未确定最终路径的上传文件"""
+    tmp_path: str
+    sha256: str
+    size: int
+
+    def commit(self, dest_path: str) -> str:
+        """原子重命名到最终路径"""
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        os.replace(self.tmp_path, dest_path)
+        return dest_path
+
+    def commit_blob(self) -> str:
+        """存入内容寻址存储；同内容的blob已存在时直接丢弃临时文件"""
+        dest_path = blob_path(self.sha256)
+        if os.path.exists(dest_path):
+            self.discard()
+            return dest_path
+        return self.commit(dest_path)
+
+    def discard(self):
+        """丢弃临时文件（处理失败时调用）"""
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def blob_path(sha256: str) -> str:
+    """内容哈希对应的blob路径（按前两位分目录，避免单目录文件过多）"""
+    return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+
+def _copy_stream(src: BinaryIO, tmp_dir: str, max_size: int, chunk_size: int) -> StoredUpload:
+    """按块复制到临时文件，边写边算哈希；超限时删除临时文件并抛出 UploadTooLarge"""
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(max_size)
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return StoredUpload(tmp_path=tmp_path, sha256=digest.hexdigest(), size=size)
+
+
+async def save_upload(file: UploadFile, max_size: int = None, chunk_size: int = None) -> StoredUpload:
+    """
+    将上传文件流式写入 UPLOAD_DIR/tmp
+
+    整个复制过程在线程池中执行，不阻塞事件循环；内存占用只有一个块大小。
+    """
+    return await run_in_threadpool(
+        _copy_stream,
+        file.file,
+        os.path.join(UPLOAD_DIR, "tmp"),
+        max_size or MAX_UPLOAD_SIZE,
+        chunk_size or CHUNK_SIZE,
+    )
+
+
+def is_zip(file: UploadFile) -> bool:
+    return (file.filename or "").lower().endswith(".zip") or file.content_type in (
+        "application/zip", "application/x-zip-compressed")
+
+
+def _extract_zip(stored: StoredUpload, tmp_dir: str, max_size: int, chunk_size: int,
+                 max_files: int) -> List[Tuple[str, Union[StoredUpload, Exception]]]:
+    """逐个成员流式解包（不整体解压到内存），每个成员单独计算哈希"""
+    members = []
+    try:
+        with zipfile.ZipFile(stored.tmp_path) as zf:
+            infos = [info for info in zf.infolist()
+                     if not info.is_dir() and not info.filename.startswith("__MACOSX/")]
+            if len(infos) > max_files:
+                raise ValueError(f"ZIP内文件数超过上限 ({max_files})")
+            for info in infos:
+                name = os.path.basename(info.filename)
+                if info.file_size > max_size:
+                    members.append((name, UploadTooLarge(max_size)))
+                    continue
+                try:
+                    with zf.open(info) as src:
+                        members.append((name, _copy_stream(src, tmp_dir, max_size, chunk_size)))
+                except UploadTooLarge as e:
+                    members.append((name, e))
+                except (zipfile.BadZipFile, zlib.error, EOFError, RuntimeError, NotImplementedError) as e:
+                    # 单个成员损坏（CRC/压缩数据错误、截断）、加密或压缩方式不支持：只记该成员失败
+                    members.append((name, ValueError(f"ZIP内文件解压失败: {e}")))
+    except BaseException:
+        for _, member in members:
+            if isinstance(member, StoredUpload):
+                member.discard()
+        raise
+    finally:
+        stored.discard()
+    return members
+
+
+async def extract_zip(stored: StoredUpload, max_files: int = None) -> List[Tuple[str, Union[StoredUpload, Exception]]]:
+    """
+    解包已落盘的ZIP，返回 [(文件名, StoredUpload 或 异常)]
+
+    ZIP本身的临时文件在解包后删除；损坏的ZIP（目录区无法读取）抛出 zipfile.BadZipFile，
+    单个成员解压失败时该成员为异常，其余成员照常返回。
+    """
+    return await run_in_threadpool(
+        _extract_zip,
+        stored,
+        os.path.join(UPLOAD_DIR, "tmp"),
+        MAX_UPLOAD_SIZE,
+        CHUNK_SIZE,
+        max_files or MAX_BATCH_FILES,
+    )
@@ -0,0 +1,93 @@
+"""
+测试公共配置
+    cd backend && python -m pytest tests
+
+默认只测 SQLite。设置 TEST_DATABASE_URL=postgresql://用户:密码@主机:端口/库名 时同时测试 PostgreSQL，
+接口测试也改用该库；测试只使用其中的 invoice_test、invoice_test_api 两个 schema，每次运行时重建。
+本地可用一次性容器：docker run --rm -e POSTGRES_PASSWORD=pw -p 5432:5432 postgres:16
+"""
+
+import os
+import sys
+import tempfile
+from urllib.parse import quote
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+SCHEMA = "invoice_test"  # 存储层测试，每个测试前重建
+API_SCHEMA = "invoice_test_api"  # 接口测试（main 在导入时连接），每次运行重建一次
+
+
+def schema_url(url: str, schema: str) -> str:
+    """连接串加上 search_path（pg_trgm 装在 public 中）"""
+    return f"{url}{'&' if '?' in url else '?'}options={quote(f'-csearch_path={schema},public')}"
+
+
+def reset_schema(schema: str):
+    import psycopg
+    with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public")
+        conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.execute(f"CREATE SCHEMA {schema}")
+
+
+# 后端模块在导入时读取环境变量，须在导入之前设置
+_tmp = tempfile.mkdtemp(prefix="invoice-tests-")
+os.environ.update(
+    DB_PATH=os.path.join(_tmp, "api.db"),
+    UPLOAD_DIR=os.path.join(_tmp, "uploads"),
+    SNAPSHOT_DIR=os.path.join(_tmp, "snapshots"),
+    SNAPSHOT_INTERVAL="0",
+    OCR_WORKERS="2",
+    GROUP_COMMIT_DELAY_MS="1",
+)
+os.environ.pop("SHARED_STATE_DIR", None)
+os.environ.pop("INVOICE_API_URL", None)
+if TEST_DATABASE_URL:
+    reset_schema(API_SCHEMA)
+    os.environ["DATABASE_URL"] = schema_url(TEST_DATABASE_URL, API_SCHEMA)
+else:
+    os.environ.pop("DATABASE_URL", None)
+
+
+@pytest.fixture
+def sqlite_pool(tmp_path):
+    from db import ConnectionPool
+    from migrations import migrate
+    pool = ConnectionPool(str(tmp_path / "test.db"))
+    with pool.connection() as conn:
+        migrate(conn)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def pg_pool():
+    if not TEST_DATABASE_URL:
+        pytest.skip("未设置 TEST_DATABASE_URL")
+    from pg import PgPool
+    from migrations import migrate
+    reset_schema(SCHEMA)
+    pool = PgPool(schema_url(TEST_DATABASE_URL, SCHEMA))
+    with pool.connection() as conn:
+        migrate(conn)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def pool(request):
+    """两种数据库各跑一遍"""
+    return request.getfixturevalue("sqlite_pool" if request.param == "sqlite" else "pg_pool")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """接口测试客户端（整个测试会话共用一个 main 与数据库，各测试使用不同的采购单号）"""
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,138 @@
+"""接口测试（数据库由 conftest.py 选择：默认 SQLite，设置 TEST_DATABASE_URL 时为 PostgreSQL）"""
+
+import csv
+import io
+
+
+def import_csv(client, kind: str, text: str) -> dict:
+    response = client.post("/import", params={"type": kind}, files={"file": (f"{kind}.csv", io.BytesIO(text.encode()))})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def add_contracts(client, prefix: str, count: int, total_amount: str = "100") -> list:
+    """导入 count 个合同（采购单号 prefix-000 起），返回合同列表"""
+    import_csv(client, "contracts", "po_number,order_date,quantity,total_amount\n" + "".join(
+        f"{prefix}-{i:03d},2024-03-{i % 28 + 1:02d},10,{total_amount}\n" for i in range(count)))
+    numbers = {f"{prefix}-{i:03d}" for i in range(count)}
+    return [c for c in client.get("/contracts").json() if c["po_number"] in numbers]
+
+
+def test_root(client):
+    assert client.get("/").json()["status"] == "running"
+
+
+def test_contract_detail_and_stats(client):
+    contract = add_contracts(client, "API-DETAIL", 1)[0]
+    assert client.get(f"/contracts/{contract['id']}").json() == contract
+    assert client.get("/contracts/999999999").status_code == 404
+    stats = client.get("/contracts/stats").json()
+    assert stats["total"] >= 1 and 0 <= stats["complete"] <= stats["total"]
+
+
+def test_cursor_paging(client):
+    add_contracts(client, "API-PAGE", 7)
+    everything = [c["id"] for c in client.get("/contracts", params={"sort": "total_amount", "order": "desc"}).json()]
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, "sort": "total_amount", "order": "desc"}
+        if cursor:
+            params["after"] = cursor
+        response = client.get("/contracts", params=params)
+        seen += [c["id"] for c in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == everything
+    offset_page = client.get("/contracts", params={"limit": 3, "offset": 3, "sort": "total_amount", "order": "desc"})
+    assert [c["id"] for c in offset_page.json()] == everything[3:6]
+    assert client.get("/contracts", params={"after": "bad"}).status_code == 400
+
+
+def test_contract_lines(client):
+    contract = add_contracts(client, "API-LINES", 1)[0]
+    lines = client.put(f"/contracts/{contract['id']}/lines",
+                       json=[{"spec_model": "A", "unit_price": 10.05, "quantity": 10}]).json()
+    assert lines == [{"spec_model": "A", "unit_price": 10.05, "unit_price_fen": 1005, "quantity": 10}]
+    duplicate = [{"spec_model": "A", "unit_price": 1, "quantity": 1}] * 2
+    assert client.put(f"/contracts/{contract['id']}/lines", json=duplicate).status_code == 400
+    # 失败的替换整体回滚
+    assert client.get(f"/contracts/{contract['id']}/lines").json() == lines
+    assert client.put("/contracts/999999999/lines", json=[]).status_code == 404
+
+
+def test_import_invoices_and_reconcile(client):
+    contract = add_contracts(client, "API-IMPORT", 1)[0]
+    summary = import_csv(client, "invoices", "contract_number,spec_model,quantity,amount\n"
+                                             "API-IMPORT-000,A,4,40\nAPI-IMPORT-000,A,6,70\n")
+    assert summary["inserted"] == 2
+    updated = client.get(f"/contracts/{contract['id']}").json()
+    assert (updated["invoiced_amount_fen"], updated["invoice_count"]) == (11000, 2)
+    statuses = [invoice["status"] for invoice in client.get(f"/contracts/{contract['id']}/invoices").json()]
+    assert statuses == ["mismatch", "verified"]  # 新的在前，第二张超额
+    assert client.post("/reconcile", params={"contract_id": contract["id"]}).json()["mismatch"] == 1
+    bad = client.post("/import", params={"type": "contracts"}, files={"file": ("a.txt", io.BytesIO(b"x"))})
+    assert bad.status_code == 400
+    missing = client.post("/import", params={"type": "invoices"}, files={"file": (
+        "i.csv", io.BytesIO(b"contract_number,spec_model,quantity,amount\nAPI-NO-SUCH,A,1,1\n"))})
+    assert missing.status_code == 400
+
+
+def test_search(client):
+    add_contracts(client, "APISEARCH", 2)
+    results = client.get("/search", params={"q": "APISEARCH-001"}).json()["results"]
+    assert results[0]["contract_number"] == "APISEARCH-001"
+    assert "<mark>" in results[0]["snippet"]
+    assert client.get("/search", params={"q": "ab"}).status_code == 400
+
+
+def test_search_scores_of_common_terms(client):
+    # 超过一半的合同都含 "APICOMMON"：bm25 的 IDF 取下限，分值很小，但仍应为正且按相关度降序
+    add_contracts(client, "APICOMMON", 200)
+    scores = [result["score"] for result in client.get("/search", params={"q": "APICOMMON", "limit": 50}).json()["results"]]
+    assert len(scores) == 50 and all(score > 0 for score in scores)
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_etag(client):
+    contract = add_contracts(client, "API-ETAG", 1)[0]
+    first = client.get(f"/contracts/{contract['id']}")
+    etag = first.headers["etag"]
+    assert client.get(f"/contracts/{contract['id']}", headers={"If-None-Match": etag}).status_code == 304
+    import_csv(client, "invoices", "contract_number,spec_model,quantity,amount\nAPI-ETAG-000,A,1,10\n")
+    changed = client.get(f"/contracts/{contract['id']}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["invoice_count"] == 1
+
+
+def test_external_writes_invalidate_cache_and_etag(client):
+    import main
+    contract = add_contracts(client, "API-EXT", 1)[0]
+    path = f"/contracts/{contract['id']}/invoices"
+    first = client.get(path)
+    assert first.json() == [] and client.get(path).json() == []  # 第二次命中缓存
+    # 另一个进程（命令行工具、Streamlit 直连、其他实例）的连接池写入，不经过本进程的失效
+    other = type(main.pool)(main.pool.path)
+    with other.connection() as conn:
+        conn.execute("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen) "
+                     "VALUES (?, 'API-EXT-000', 'A', 1, 1000)", (contract["id"],))
+        conn.commit()
+    other.close()
+    changed = client.get(path, headers={"If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200 and len(changed.json()) == 1
+    assert changed.headers["etag"] != first.headers["etag"]
+
+
+def test_analytics_without_snapshot(client):
+    # 未安装 pyarrow 或还没有导出快照
+    assert client.get("/analytics/monthly").status_code == 503
+    assert client.get("/analytics/outstanding").status_code == 503
+
+
+def test_export(client):
+    add_contracts(client, "API-EXPORT", 2)
+    response = client.get("/export", params={"type": "contracts"})
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert rows[0][:2] == ["id", "po_number"]
+    assert {"API-EXPORT-000", "API-EXPORT-001"} <= {row[1] for row in rows[1:]}
@@ -0,0 +1,106 @@
+"""读缓存（LRU、按合同失效、命中统计），数据版本（db.commit_versioned）与核对外部写入（两种数据库各跑一遍）"""
+
+from cache import INVOICES, SUMMARY, LRUCache
+from db import read_data_version
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUCache(2)
+    loads = []
+    load = lambda key: cache.get_or_load(key, lambda: loads.append(key) or key)
+    assert load((INVOICES, 1)) == (INVOICES, 1)
+    load((INVOICES, 2)), load((INVOICES, 1))  # 1 变为最近使用
+    load((INVOICES, 3))  # 淘汰最久未用的 2
+    load((INVOICES, 1)), load((INVOICES, 2))
+    assert loads == [(INVOICES, 1), (INVOICES, 2), (INVOICES, 3), (INVOICES, 2)]
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 4, "evictions": 2, "hit_rate": 0.3333}
+
+
+def test_invalidate_contracts_drops_only_affected_keys():
+    cache = LRUCache(16)
+    for key in [(SUMMARY, None, "order_date"), (SUMMARY, 10, "total_amount"), (INVOICES, 1), (INVOICES, 2)]:
+        cache.get_or_load(key, lambda: "cached")
+    cache.invalidate_contracts(1)
+    reloaded = {key: cache.get_or_load(key, lambda: "reloaded") for key in
+                [(SUMMARY, None, "order_date"), (SUMMARY, 10, "total_amount"), (INVOICES, 1), (INVOICES, 2)]}
+    # 合同列表（汇总）与该合同的发票失效，其他合同的发票保留
+    assert list(reloaded.values()) == ["reloaded", "reloaded", "reloaded", "cached"]
+    cache.invalidate_contracts()  # 不指定合同：只清合同列表
+    assert cache.get_or_load((INVOICES, 1), lambda: "again") == "reloaded"
+    assert cache.get_or_load((SUMMARY, 10, "total_amount"), lambda: "again") == "again"
+    cache.clear()
+    assert cache.get_or_load((INVOICES, 2), lambda: "again") == "again"
+
+
+def test_loads_racing_an_invalidation_are_not_cached():
+    cache = LRUCache(16)
+    # 查询期间有写入失效：返回结果但不缓存，避免缓存住写入前读到的旧数据
+    def loader():
+        cache.invalidate_contracts(1)
+        return "stale"
+    assert cache.get_or_load((INVOICES, 1), loader) == "stale"
+    assert cache.get_or_load((INVOICES, 1), lambda: "fresh") == "fresh"
+    # maxsize=0：不缓存
+    uncached = LRUCache(0)
+    assert [uncached.get_or_load((INVOICES, 1), lambda: "x") for _ in range(2)] == ["x", "x"]
+    assert (uncached.stats()["size"], uncached.misses) == (0, 2)
+
+
+def insert_contract(pool, po_number: str) -> int:
+    with pool.connection() as conn:
+        contract_id = conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) "
+                                   "VALUES (?, '2024-01-01', 10, 10000)", (po_number,)).lastrowid
+        conn.commit()
+    return contract_id
+
+
+def version(pool) -> int:
+    with pool.connection() as conn:
+        return read_data_version(conn)[1]
+
+
+def test_write_transactions_bump_version(pool):
+    before = version(pool)
+    with pool.connection() as conn:
+        conn.execute("SELECT COUNT(*) FROM contracts").fetchone()
+        conn.commit()  # 只读事务不加
+        conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) "
+                     "VALUES ('V-1', '2024-01-01', 1, 100)")
+        conn.rollback()
+    assert version(pool) == before
+    insert_contract(pool, "V-2")
+    assert version(pool) == before + 1
+
+
+def test_cache_clears_on_external_writes_only(pool):
+    cache = LRUCache(16, pool=pool)
+    loads = []
+    load = lambda key: cache.get_or_load(key, lambda: loads.append(key) or len(loads))
+    load((SUMMARY,)), load((INVOICES, 999999))
+    # 本进程的写入：由写入方按合同精确失效，其他缓存保留
+    contract_id = insert_contract(pool, "V-OWN")
+    cache.invalidate_contracts(contract_id)
+    load((SUMMARY,)), load((INVOICES, 999999))
+    assert loads == [(SUMMARY,), (INVOICES, 999999), (SUMMARY,)]
+    etag = cache.data_version()
+
+    # 另一个连接池（另一个进程或实例）的写入：清空整个缓存，数据版本变化
+    other = type(pool)(pool.path)
+    insert_contract(other, "V-EXT")
+    other.close()
+    assert cache.data_version() != etag
+    load((INVOICES, 999999))
+    assert loads[-1] == (INVOICES, 999999) and cache.misses == 4
+
+
+def test_version_check_is_one_query(sqlite_pool):
+    cache = LRUCache(16, pool=sqlite_pool)
+    cache.data_version()
+    statements = []
+    with sqlite_pool.connection() as conn:  # 后进先出：与核对用的是同一个连接
+        conn.set_trace_callback(statements.append)
+    cache.data_version()
+    cache.get_or_load((SUMMARY,), lambda: 1)
+    cache.get_or_load((SUMMARY,), lambda: 1)
+    # 查到表存在后不再查 sqlite_master：每次核对只读一行版本号
+    assert statements == ["SELECT epoch, version FROM data_version"] * 4
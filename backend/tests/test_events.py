@@ -0,0 +1,76 @@
+"""SSE 推送（events.py）：按 Last-Event-ID 补发、缺口过大或重启后的 reset、消费太慢的客户端断开"""
+
+import asyncio
+
+import pytest
+
+from events import EventBroker
+
+
+def parse(text: str) -> tuple:
+    """SSE 文本 → (事件 ID, 事件名)"""
+    fields = dict(line.split(": ", 1) for line in text.strip().splitlines())
+    return int(fields["id"]), fields["event"]
+
+
+def broker_with(count: int, history: int = 3, queue_size: int = 10) -> EventBroker:
+    broker = EventBroker(history=history, queue_size=queue_size)
+    for i in range(1, count + 1):
+        broker.publish("contract", {"id": i})
+    return broker
+
+
+async def take(stream, count: int) -> list:
+    return [parse(await asyncio.wait_for(stream.__anext__(), 5)) for _ in range(count)]
+
+
+def test_replay_after_last_event_id():
+    async def scenario():
+        broker = broker_with(5)
+        stream = broker.stream(last_event_id=2)  # 最早保留的是 3，没有缺口
+        assert await take(stream, 3) == [(3, "contract"), (4, "contract"), (5, "contract")]
+        broker.publish("contract", {"id": 6})  # 补发之后接着推送新事件
+        assert await take(stream, 1) == [(6, "contract")]
+        await stream.aclose()
+        assert broker.subscriber_count == 0
+    asyncio.run(scenario())
+
+
+def test_reset_when_gap_exceeds_history_or_after_restart():
+    async def scenario():
+        broker = broker_with(5)
+        # 事件 2 已不在缓冲区中
+        assert await take(broker.stream(last_event_id=1), 1) == [(5, "reset")]
+        # 客户端的 ID 比当前的还新：服务重启过
+        assert await take(broker.stream(last_event_id=99), 1) == [(5, "reset")]
+        assert await take(broker_with(0).stream(last_event_id=3), 1) == [(0, "reset")]
+        # 已是最新：不补发，直接等新事件
+        stream = broker.stream(last_event_id=5)
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        assert not pending.done()
+        broker.publish("contract", {"id": 6})
+        assert parse(await asyncio.wait_for(pending, 5)) == (6, "contract")
+        await stream.aclose()
+    asyncio.run(scenario())
+
+
+def test_slow_client_is_disconnected():
+    async def scenario():
+        broker = broker_with(0, queue_size=2)
+        stream = broker.stream()
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)  # 注册订阅
+        broker.publish("contract", {"id": 1})
+        assert parse(await asyncio.wait_for(first, 5)) == (1, "contract")
+        # 客户端不再读取：积压超过 queue_size 时断开，最早积压的一条让位给结束标记
+        for i in range(2, 5):
+            broker.publish("contract", {"id": i})
+        await asyncio.sleep(0.01)
+        assert broker.subscriber_count == 0
+        assert await take(stream, 1) == [(3, "contract")]
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        # 重连后按 Last-Event-ID 补发错过的事件
+        assert await take(broker.stream(last_event_id=3), 1) == [(4, "contract")]
+    asyncio.run(scenario())
@@ -0,0 +1,135 @@
+"""上传 → 识别任务（JobQueue + StubExtractor，进程池中识别）→ 入库 的完整流程"""
+
+import io
+import zipfile
+
+import main
+
+JOB_TIMEOUT = 60
+
+
+def upload(client, path: str, content: str):
+    response = client.post(path, files={"file": ("upload.txt", io.BytesIO(content.encode()))})
+    assert response.status_code in (200, 202), response.text
+    return response.json()
+
+
+def run_job(client, path: str, content: str) -> dict:
+    """上传并等待识别任务结束，返回任务状态"""
+    submitted = upload(client, path, content)
+    job = main.ocr_jobs.wait(submitted["job_id"], JOB_TIMEOUT)
+    assert job is not None and job.status in ("succeeded", "failed"), job
+    return client.get(f"/jobs/{submitted['job_id']}").json()
+
+
+def contract_file(po_number: str, total_amount: float = 100, quantity: int = 10) -> str:
+    return (f"po_number: {po_number}\norder_date: 2024-06-01\nquantity: {quantity}\n"
+            f"total_amount: {total_amount}\nline: A, {total_amount / quantity}, {quantity}\n")
+
+
+def invoice_file(contract_number: str, quantity: int = 4, amount: float = 40, note: str = "") -> str:
+    return f"contract_number: {contract_number}\nspec_model: A\nquantity: {quantity}\namount: {amount}\n{note}\n"
+
+
+def test_contract_upload_and_duplicate(client):
+    job = run_job(client, "/upload/contract", contract_file("JOB-C-001"))
+    assert job["status"] == "succeeded", job
+    contract_id = job["result"]["contract_id"]
+    contract = client.get(f"/contracts/{contract_id}").json()
+    assert (contract["po_number"], contract["total_amount_fen"]) == ("JOB-C-001", 10000)
+    assert client.get(f"/contracts/{contract_id}/lines").json()[0]["spec_model"] == "A"
+
+    # 同一文件再次上传：按内容哈希直接返回已有合同，不再识别
+    again = upload(client, "/upload/contract", contract_file("JOB-C-001"))
+    assert again["duplicate"] is True and again["contract_id"] == contract_id
+
+
+def test_invoice_upload_and_duplicate(client):
+    contract_id = run_job(client, "/upload/contract", contract_file("JOB-I-001"))["result"]["contract_id"]
+    job = run_job(client, "/upload/invoice", invoice_file("JOB-I-001"))
+    assert job["status"] == "succeeded", job
+    assert job["result"]["contract_id"] == contract_id and job["result"]["issues"] == []
+
+    again = upload(client, "/upload/invoice", invoice_file("JOB-I-001"))
+    assert again["duplicate"] is True and again["contract_id"] == contract_id
+    contract = client.get(f"/contracts/{contract_id}").json()
+    assert (contract["invoice_count"], contract["invoiced_amount_fen"]) == (1, 4000)
+
+    # 超额的发票照常入库，核对结果为问题
+    job = run_job(client, "/upload/invoice", invoice_file("JOB-I-001", quantity=8, amount=80))
+    assert job["status"] == "succeeded" and job["result"]["issues"], job
+
+
+def test_fuzzy_contract_number_links(client):
+    contract_id = run_job(client, "/upload/contract", contract_file("JOB-FZ-73519"))["result"]["contract_id"]
+    # OCR 噪声：小写、O/0 混淆、分隔符不同
+    job = run_job(client, "/upload/invoice", invoice_file("j0b fz 73519"))
+    assert job["status"] == "succeeded", job
+    assert job["result"]["contract_id"] == contract_id
+    assert job["result"]["match"]["method"] == "fuzzy"
+    assert job["result"]["match"]["candidates"][0]["po_number"] == "JOB-FZ-73519"
+    assert client.get(f"/contracts/{contract_id}").json()["invoice_count"] == 1
+
+
+def test_failed_jobs(client):
+    # 识别失败（数量不是数字）
+    job = run_job(client, "/upload/invoice", invoice_file("JOB-F-001").replace("quantity: 4", "quantity: abc"))
+    assert job["status"] == "failed" and job["error"]
+    # 合同不存在
+    job = run_job(client, "/upload/invoice", invoice_file("NO-SUCH-CONTRACT-9Q8W7E"))
+    assert job["status"] == "failed" and job["error"] == "未找到对应合同"
+    assert client.get("/jobs/no-such-job").status_code == 404
+
+
+def test_invoice_batch(client):
+    run_job(client, "/upload/contract", contract_file("JOB-B-001"))
+    existing = invoice_file("JOB-B-001", note="existing")
+    run_job(client, "/upload/invoice", existing)
+    files = [("files", (name, io.BytesIO(content.encode()))) for name, content in (
+        ("new.txt", invoice_file("JOB-B-001", quantity=2, amount=20)),
+        ("same.txt", invoice_file("JOB-B-001", quantity=2, amount=20)),
+        ("existing.txt", existing),
+        ("bad.txt", invoice_file("JOB-B-001").replace("quantity: 4", "quantity: abc")),
+    )]
+    submitted = client.post("/upload/invoices/batch", files=files).json()
+    job = main.ocr_jobs.wait(submitted["job_id"], JOB_TIMEOUT).to_dict()
+    assert job["status"] == "succeeded", job
+    statuses = {item["file"]: item["status"] for item in job["result"]["files"]}
+    assert statuses == {"new.txt": "created", "same.txt": "duplicate", "existing.txt": "duplicate", "bad.txt": "failed"}
+    assert (job["result"]["created"], job["result"]["duplicate"], job["result"]["failed"]) == (1, 2, 1)
+
+
+def test_invoice_batch_zip_with_corrupt_member(client):
+    run_job(client, "/upload/contract", contract_file("JOB-ZIP-001"))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("good.txt", invoice_file("JOB-ZIP-001", note="zip good"))
+        zf.writestr("bad.txt", invoice_file("JOB-ZIP-001", note="zip bad " * 50))
+        bad = zf.getinfo("bad.txt")
+    data = bytearray(buffer.getvalue())
+    # 损坏 bad.txt 的压缩数据（本地文件头 30 字节 + 文件名之后）
+    start = bad.header_offset + 30 + len(bad.filename)
+    data[start:start + bad.compress_size] = b"\xff" * bad.compress_size
+    files = [("files", ("invoices.zip", io.BytesIO(bytes(data)), "application/zip"))]
+    response = client.post("/upload/invoices/batch", files=files)
+    assert response.status_code == 202, response.text
+    job = main.ocr_jobs.wait(response.json()["job_id"], JOB_TIMEOUT).to_dict()
+    assert job["status"] == "succeeded", job
+    statuses = {item["file"]: item["status"] for item in job["result"]["files"]}
+    assert statuses == {"good.txt": "created", "bad.txt": "failed"}
+    failed = next(item for item in job["result"]["files"] if item["file"] == "bad.txt")
+    assert failed["error"].startswith("ZIP内文件解压失败")
+
+
+def test_fuzzy_match_skips_contracts_deleted_elsewhere(client):
+    from repository import Repository
+    deleted = run_job(client, "/upload/contract", contract_file("JOB-DEL-48213"))["result"]["contract_id"]
+    kept = run_job(client, "/upload/contract", contract_file("JOB-DEL-48299"))["result"]["contract_id"]
+    # 其他进程（如 Streamlit 直连数据库）删除合同，API 进程的合同号索引中仍有它
+    assert Repository(main.pool).delete_contract(deleted)
+    job = run_job(client, "/upload/invoice", invoice_file("job del 48213"))
+    assert job["status"] == "succeeded", job
+    assert job["result"]["status"] == "review"
+    candidates = [c["contract_id"] for c in job["result"]["match"]["candidates"]]
+    assert candidates[0] == kept and deleted not in candidates
+    assert deleted not in [c.contract_id for c in main.po_index.search("JOB-DEL-48213")]
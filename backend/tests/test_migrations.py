@@ -0,0 +1,61 @@
+"""SQLite 迁移：旧版 Streamlit 应用自建的库（无版本号）升级到最新结构"""
+
+import sqlite3
+
+from migrations import MIGRATIONS, current_version, migrate
+
+
+def legacy_db(path) -> sqlite3.Connection:
+    """旧版 Streamlit 应用的建表语句，file_name 存原始文件名"""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE contracts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        po_number TEXT UNIQUE NOT NULL,
+        order_date TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        total_amount REAL NOT NULL,
+        file_name TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute('''CREATE TABLE invoices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        contract_id INTEGER,
+        contract_number TEXT,
+        spec_model TEXT,
+        quantity INTEGER,
+        amount REAL,
+        file_name TEXT,
+        status TEXT DEFAULT 'verified',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (contract_id) REFERENCES contracts (id)
+    )''')
+    conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount, file_name) "
+                 "VALUES ('PO-OLD-1', '2023-05-01', 10, 100.5, 'scans\\合同扫描件-2023.pdf')")
+    conn.execute("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount, file_name) "
+                 "VALUES (1, 'PO-OLD-1', 'A', 10, 100.5, 'uploads/发票-0501.jpg')")
+    conn.commit()
+    return conn
+
+
+def test_legacy_streamlit_db(tmp_path):
+    conn = legacy_db(str(tmp_path / "legacy.db"))
+    assert migrate(conn) == MIGRATIONS[-1][0] == current_version(conn)
+
+    # 旧的 file_name 改名为 file_path，原始文件名回填到 file_name，并进入检索索引
+    assert conn.execute("SELECT file_path, file_name, total_amount_fen, invoiced_amount_fen FROM contracts").fetchone() \
+        == ("scans\\合同扫描件-2023.pdf", "合同扫描件-2023.pdf", 10050, 10050)
+    assert conn.execute("SELECT file_name FROM invoices").fetchone() == ("发票-0501.jpg",)
+    assert conn.execute("SELECT rowid FROM contracts_fts WHERE contracts_fts MATCH '\"扫描件\"'").fetchall() == [(1,)]
+    assert conn.execute("SELECT rowid FROM invoices_fts WHERE invoices_fts MATCH '\"0501\"'").fetchall() == [(1,)]
+    assert migrate(conn) == MIGRATIONS[-1][0]
+    conn.close()
+
+
+def test_blob_paths_are_not_backfilled(sqlite_pool):
+    # 内容寻址存储的文件名是哈希，不作为原始文件名
+    with sqlite_pool.connection() as conn:
+        conn.execute("INSERT INTO invoices (contract_number, file_path, file_hash) VALUES ('PO-1', 'uploads/blobs/ab/abc', 'abc')")
+        conn.commit()
+        from migrations import _backfill_file_name
+        _backfill_file_name(conn)
+        assert conn.execute("SELECT file_name FROM invoices").fetchone() == (None,)
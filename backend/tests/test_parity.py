@@ -0,0 +1,121 @@
+"""SQLite 与 PostgreSQL 存储行为一致：同一组操作在两种数据库上的结果相同"""
+
+import io
+
+import pytest
+
+from bulk import export_rows, import_records, read_records
+from reconcile import reconcile
+from repository import Conflict, Repository
+from totals import find_mismatches
+from writer import Writer
+
+CONTRACTS = "po_number,order_date,quantity,total_amount\n" + "".join(
+    f"PO-{i:04d},2024-{i % 12 + 1:02d}-{i % 28 + 1:02d},{10 + i % 5},{(i % 97) * 10 + 100}.50\n" for i in range(300))
+INVOICES = "contract_number,spec_model,quantity,amount\n" + "".join(
+    f"PO-{i % 300:04d},SKU-{i % 7},{1 + i % 3},{(i % 13) * 7.25}\n" for i in range(2000))
+
+
+def _records(text: str):
+    return read_records(io.BytesIO(text.encode()), "csv")
+
+
+def _without_timing(summary: dict) -> dict:
+    summary = dict(summary, seconds=0)
+    if "reconcile" in summary:
+        summary["reconcile"] = dict(summary["reconcile"], seconds=0)
+    return summary
+
+
+def _without_created_at(rows):
+    # 最后一列为 created_at，两种数据库的写入时刻不同
+    return [row[:-1] for row in rows]
+
+
+def run_scenario(pool) -> dict:
+    """批量导入、改数后核对、导出、分页、单条增删；返回各步结果"""
+    results = {}
+    with pool.connection() as conn:
+        results["import contracts"] = _without_timing(import_records(conn, "contracts", _records(CONTRACTS)))
+        results["import invoices"] = _without_timing(import_records(conn, "invoices", _records(INVOICES)))
+        results["import again"] = import_records(conn, "contracts", _records(CONTRACTS))["inserted"]
+        results["mismatches"] = find_mismatches(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE invoices SET amount_fen = amount_fen + 1 WHERE id % 3 = 0")
+        conn.execute("UPDATE invoices SET contract_id = contract_id + 1 WHERE id % 5 = 0 AND contract_id < 300")
+        conn.execute("DELETE FROM invoices WHERE id % 11 = 0")
+        conn.commit()
+        results["mismatches after update"] = find_mismatches(conn)
+        results["reconcile"] = _without_timing(reconcile(conn))
+        results["export contracts"] = _without_created_at(export_rows(conn, "contracts"))
+        results["export invoices"] = _without_created_at(export_rows(conn, "invoices"))
+
+    repo = Repository(pool)
+    results["stats"] = repo.contract_stats()
+    for sort in ("order_date", "total_amount"):
+        for order in ("asc", "desc"):
+            for status in (None, "complete", "incomplete"):
+                seen, cursor = [], None
+                while True:
+                    page, cursor = repo.list_contracts(37, cursor, status, sort, order)
+                    seen += [contract["id"] for contract in page]
+                    if not cursor:
+                        break
+                offset_page = repo.list_contracts(20, None, status, sort, order, offset=40)[0]
+                results[f"list {sort} {order} {status}"] = (seen, [contract["id"] for contract in offset_page])
+
+    added = repo.add_contract("OVER-1", "2024-05-05", 10, 1.00, file_hash="c-over")
+    results["added"] = {key: value for key, value in added.items() if key not in ("id", "created_at")}
+    conflicts = []
+    for args, kwargs in ((("OVER-1", "2024-05-05", 10, 1.00), {}),
+                         (("OVER-2", "2024-05-05", 10, 1.00), {"file_hash": "c-over"}),
+                         (("LINES-1", "2024-05-05", 10, 1.00),
+                          {"lines": [{"spec_model": "SKU-1", "unit_price": 1.5, "quantity": 3}] * 2})):
+        with pytest.raises(Conflict) as error:
+            repo.add_contract(*args, **kwargs)
+        conflicts.append(str(error.value))
+    results["conflicts"] = conflicts
+
+    # 经写线程组提交：超开的发票状态为 mismatch
+    repo.writer = Writer(pool, delay_ms=1)
+    try:
+        results["over"] = [repo.add_invoice("OVER-1", "X", 1, 0.10, file_hash=f"over-{i}")["status"] for i in range(12)]
+    finally:
+        repo.writer.shutdown()
+    contract = repo.get_contract(added["id"])
+    results["over contract"] = {key: value for key, value in contract.items() if key not in ("id", "created_at")}
+    invoices = repo.contract_invoices(added["id"])
+    results["delete invoice"] = (repo.delete_invoice(invoices[0]["id"]) == added["id"], repo.delete_invoice(10 ** 9))
+    results["delete contract"] = (repo.delete_contract(added["id"]), repo.get_contract(added["id"]))
+    return results
+
+
+def test_scenario_invariants(pool):
+    results = run_scenario(pool)
+    assert results["import contracts"]["inserted"] == 300
+    assert results["import invoices"]["inserted"] == 2000
+    assert results["import again"] == 0
+    # 导入与直接改数后，触发器维护的汇总都与发票明细一致
+    assert results["mismatches"] == []
+    assert results["mismatches after update"] == []
+    assert len(results["export contracts"]) == 301
+    assert results["export invoices"][0][0] == "id"
+    assert results["stats"]["total"] == 300
+    for key, value in results.items():
+        if key.startswith("list "):
+            seen, offset_page = value
+            assert len(seen) == len(set(seen)), key
+            assert offset_page == seen[40:60], key
+    assert len(results["list order_date asc None"][0]) == 300
+    assert results["list total_amount desc None"][0] == results["list total_amount asc None"][0][::-1]
+    assert results["conflicts"] == ["采购单号已存在", "合同已存在（重复上传）", "合同明细中规格型号重复"]
+    assert results["over"] == ["verified"] * 10 + ["mismatch"] * 2
+    assert results["over contract"]["invoiced_amount"] == pytest.approx(1.20)
+    assert results["delete invoice"] == (True, None)
+    assert results["delete contract"] == (True, None)
+
+
+def test_sqlite_and_postgresql_agree(sqlite_pool, pg_pool):
+    sqlite_results, pg_results = run_scenario(sqlite_pool), run_scenario(pg_pool)
+    for key in sqlite_results:
+        assert pg_results[key] == sqlite_results[key], key
@@ -0,0 +1,117 @@
+"""PostgreSQL 适配层（pg.py）与 PG 表结构（migrations.PG_MIGRATIONS）"""
+
+import sqlite3
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+import db  # noqa: E402,F401  须先于 pg 导入：db 导入时按 DATABASE_URL 打开连接池
+from pg import WRITE_LOCK, translate  # noqa: E402
+
+
+def test_translate_placeholders_and_percent():
+    assert translate("SELECT * FROM t WHERE a = ? AND b LIKE '10%' AND c = ?") == \
+        "SELECT * FROM t WHERE a = %s AND b LIKE '10%%' AND c = %s"
+
+
+def test_translate_transactions():
+    assert translate("BEGIN IMMEDIATE") == f"SELECT pg_advisory_xact_lock({WRITE_LOCK})"
+    assert translate("  begin immediate ") == f"SELECT pg_advisory_xact_lock({WRITE_LOCK})"
+    assert translate("BEGIN") == "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+
+
+def _add_contract(conn, po_number: str, total_fen: int = 10000):
+    return conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) VALUES (?, ?, ?, ?)",
+                        (po_number, "2024-01-01", 10, total_fen))
+
+
+def test_lastrowid(pg_pool):
+    with pg_pool.connection() as conn:
+        first = _add_contract(conn, "PO-A").lastrowid
+        second = _add_contract(conn, "PO-B").lastrowid
+        conn.commit()
+        assert second == first + 1
+        assert conn.execute("SELECT po_number FROM contracts WHERE id = ?", (second,)).fetchone() == ("PO-B",)
+
+
+def test_integrity_error_is_sqlite3(pg_pool):
+    with pg_pool.connection() as conn:
+        _add_contract(conn, "PO-DUP")
+        conn.commit()
+        with pytest.raises(sqlite3.IntegrityError):
+            _add_contract(conn, "PO-DUP")
+        conn.rollback()
+        # 回滚后连接可继续使用
+        assert conn.execute("SELECT COUNT(*) FROM contracts").fetchone() == (1,)
+
+
+def test_begin_immediate_takes_cross_connection_write_lock(pg_pool):
+    first, second = pg_pool.acquire(), pg_pool.acquire()
+    try:
+        first.execute("BEGIN IMMEDIATE")
+        held = first.execute("SELECT COUNT(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = ? AND granted",
+                             (WRITE_LOCK,)).fetchone()[0]
+        assert held == 1
+        second.execute("SET lock_timeout = 100")
+        with pytest.raises(psycopg.errors.LockNotAvailable):
+            second.execute("BEGIN IMMEDIATE")
+        second.rollback()
+        # 读不受写锁影响
+        assert second.execute("SELECT COUNT(*) FROM contracts").fetchone() == (0,)
+        first.commit()
+        second.execute("BEGIN IMMEDIATE")
+        second.commit()
+    finally:
+        pg_pool.release(first)
+        pg_pool.release(second)
+
+
+def test_schema(pg_pool):
+    from migrations import PG_MIGRATIONS, current_version
+    with pg_pool.connection() as conn:
+        assert current_version(conn) == PG_MIGRATIONS[-1][0]
+        tables = {name for (name,) in conn.execute(
+            "SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")}
+        assert {"contracts", "invoices", "contract_lines", "schema_version"} <= tables
+        indexes = {name for (name,) in conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")}
+        assert {"idx_contracts_search", "idx_invoices_search"} <= indexes
+
+        contract_id = _add_contract(conn, "PO-T", total_fen=10000).lastrowid
+        conn.execute("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen) "
+                     "VALUES (?, ?, ?, ?, ?)", (contract_id, "PO-T", "A", 4, 6000))
+        invoice_id = conn.execute("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen) "
+                                  "VALUES (?, ?, ?, ?, ?)", (contract_id, "PO-T", "A", 6, 4000)).lastrowid
+        conn.commit()
+        # 触发器维护汇总，生成列计算完成状态；聚合结果为 int
+        row = conn.execute("SELECT invoiced_amount_fen, invoiced_quantity, invoice_count, is_complete "
+                           "FROM contracts WHERE id = ?", (contract_id,)).fetchone()
+        assert row == (10000, 10, 2, 1)
+        assert conn.execute("SELECT SUM(amount_fen) FROM invoices").fetchone() == (10000,)
+
+        conn.execute("UPDATE invoices SET amount_fen = 3000 WHERE id = ?", (invoice_id,))
+        conn.commit()
+        assert conn.execute("SELECT invoiced_amount_fen, is_complete FROM contracts WHERE id = ?",
+                            (contract_id,)).fetchone() == (9000, 0)
+        conn.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+        conn.commit()
+        assert conn.execute("SELECT invoiced_amount_fen, invoiced_quantity, invoice_count FROM contracts WHERE id = ?",
+                            (contract_id,)).fetchone() == (6000, 4, 1)
+
+
+def test_migrate_is_idempotent(pg_pool):
+    from migrations import PG_MIGRATIONS, migrate
+    with pg_pool.connection() as conn:
+        assert migrate(conn) == PG_MIGRATIONS[-1][0]
+        assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] >= 1
+
+
+def test_backfill_file_name(pg_pool):
+    from migrations import _pg_backfill_file_name
+    with pg_pool.connection() as conn:
+        conn.executemany("INSERT INTO invoices (contract_number, file_path, file_hash) VALUES (?, ?, ?)",
+                         [("PO-1", "scans\\2023/发票-0501.jpg", None), ("PO-2", "uploads/blobs/ab/abc", "abc")])
+        _pg_backfill_file_name(conn)
+        conn.commit()
+        assert conn.execute("SELECT file_name FROM invoices ORDER BY id").fetchall() == [("发票-0501.jpg",), (None,)]
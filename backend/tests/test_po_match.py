@@ -0,0 +1,17 @@
+"""合同号模糊匹配索引（po_match.py）"""
+
+from po_match import POIndex, decide
+
+
+def test_search_and_remove():
+    index = POIndex()
+    index.add(1, "PO-2024-0001")
+    index.add(2, "PO-2024-0099")
+    assert index.search("p0 2024 0001")[0] == (1, "PO-2024-0001", 1.0)
+    assert decide(index.search("p0 2024 0001")) == "link"
+
+    index.remove(1, 99)
+    assert len(index) == 1
+    candidates = index.search("p0 2024 0001")
+    assert [c.contract_id for c in candidates] == [2]
+    assert decide(candidates) == "review"
@@ -0,0 +1,50 @@
+"""批量核对（reconcile.py），两种数据库各跑一遍"""
+
+from reconcile import OVER_INVOICED, QUANTITY_MISMATCH, UNKNOWN_CONTRACT, UNKNOWN_SPEC, reconcile
+
+
+def test_review_invoices_stay_in_review_queue(pool):
+    with pool.connection() as conn:
+        contract_id = conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) "
+                                   "VALUES ('PO-R', '2024-01-01', 10, 10000)").lastrowid
+        conn.executemany("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen, status, "
+                         "check_flags) VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                             (contract_id, "PO-R", "A", 5, 5000, "pending", None),
+                             (contract_id, "PO-R", "A", 6, 6000, "pending", None),
+                             # 合同号无法确认的发票（见 main.insert_review_invoice）
+                             (None, "P0-R?", "A", 1, 1000, "review", UNKNOWN_CONTRACT),
+                             (None, "P0-R?", "", 1, 1000, "review", UNKNOWN_CONTRACT),
+                         ])
+        conn.commit()
+
+        summary = reconcile(conn)
+        assert (summary["verified"], summary["mismatch"], summary["review"]) == (1, 1, 2)
+        # 规格型号为空的复核发票核对结果有变化：只更新 check_flags，状态仍为 review
+        assert summary["updated"] == 3
+        rows = conn.execute("SELECT status, check_flags FROM invoices ORDER BY id").fetchall()
+        assert rows == [("verified", 0), ("mismatch", OVER_INVOICED | QUANTITY_MISMATCH),
+                        ("review", UNKNOWN_CONTRACT), ("review", UNKNOWN_CONTRACT | UNKNOWN_SPEC)]
+        assert reconcile(conn)["updated"] == 0
+
+
+def test_check_invoice_with_preloaded_lines(pool):
+    from reconcile import check_invoice, load_lines
+    from repository import fetch_contracts
+    with pool.connection() as conn:
+        ids = [conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) "
+                            "VALUES (?, '2024-01-01', 10, 10000)", (po_number,)).lastrowid for po_number in ("L-1", "L-2")]
+        conn.executemany("INSERT INTO contract_lines (contract_id, po_number, spec_model, unit_price_fen, quantity) "
+                         "VALUES (?, ?, ?, ?, ?)", [(ids[0], "L-1", "A", 1000, 6), (ids[0], "L-1", "B", 1000, 4)])
+        conn.executemany("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen) "
+                         "VALUES (?, ?, ?, ?, ?)", [(ids[0], "L-1", "A", 5, 5000), (ids[1], "L-2", "A", 2, 2000)])
+        conn.commit()
+        contracts = fetch_contracts(conn.cursor(), ids)
+        invoices = [(ids[0], "A", 1, 1000), (ids[0], "A", 1, 1000), (ids[0], "B", 2, 2600), (ids[0], "C", 1, 1000),
+                    (ids[0], None, 1, 1000), (ids[1], "A", 3, 3000), (ids[1], "Z", 0, 500)]
+        # 同一批次内逐张累计：预读的明细与逐张查询的结果相同
+        pending_queried, pending_loaded = {}, {}
+        lines = load_lines(conn, contracts.values())
+        for contract_id, spec, qty, fen in invoices:
+            assert check_invoice(conn, contracts[contract_id], spec, qty, fen, pending=pending_loaded, lines=lines) == \
+                check_invoice(conn, contracts[contract_id], spec, qty, fen, pending=pending_queried)
+        assert load_lines(conn, []) == {"lines": {}, "has_lines": set(), "invoiced": {}}
@@ -0,0 +1,68 @@
+"""多 worker 共享状态（shared.py）：环形日志与只由一个 worker 承担的角色"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import shared
+from shared import SharedLog
+
+pytest.importorskip("fcntl")
+
+
+def test_two_instances_see_each_others_appends(tmp_path):
+    path = str(tmp_path / "test.log")
+    first, second = SharedLog(path, 4, 8), SharedLog(path, 4, 8)
+    assert first.append(b"a", b"bb") == 2
+    assert second.read(0) == (2, [b"a", b"bb"])
+    assert second.append(b"ccc") == 3
+    assert first.read(2) == (3, [b"ccc"]) and first.read(3) == (3, [])
+    # 新打开的实例从已有的序号继续
+    third = SharedLog(path, 4, 8)
+    assert third.seq == 3
+    for log in (first, second, third):
+        log.close()
+
+
+def test_wraparound_and_lapped_reader(tmp_path):
+    log = SharedLog(str(tmp_path / "test.log"), 4, 8)
+    for i in range(6):
+        log.append(str(i).encode())
+    # 槽位循环使用：最近 4 条仍可读
+    assert log.read(2) == (6, [b"2", b"3", b"4", b"5"])
+    # 落后超过槽位数，记录已被覆盖
+    assert log.read(1) == (6, None)
+    # 读取方的序号比日志还新（日志被重建）
+    assert log.read(9) == (6, None)
+    log.close()
+
+
+def test_record_and_file_size_limits(tmp_path):
+    path = str(tmp_path / "test.log")
+    log = SharedLog(path, 4, 8)
+    with pytest.raises(ValueError):
+        log.append(b"ok", b"123456789")
+    assert log.seq == 0  # 一批中有超长记录时整批不写
+    assert log.append(b"12345678") == 1 and log.read(0) == (1, [b"12345678"])
+    with pytest.raises(ValueError):
+        SharedLog(path, 8, 8)  # 各 worker 的配置不同
+    log.close()
+
+
+def test_claim_is_held_by_one_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(shared, "_roles", {})
+    other = [sys.executable, "-c", "import shared; print(shared.claim('snapshot'))"]
+    env = {**os.environ, "SHARED_STATE_DIR": str(tmp_path)}
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def claimed_elsewhere() -> str:
+        return subprocess.run(other, env=env, cwd=backend, capture_output=True, text=True, check=True).stdout.strip()
+
+    assert shared.claim("snapshot") and shared.claim("snapshot")
+    assert claimed_elsewhere() == "False"
+    # 持有者退出（锁文件关闭）后由其他进程接替
+    os.close(shared._roles.pop("snapshot"))
+    assert claimed_elsewhere() == "True"
@@ -0,0 +1,121 @@
+"""列式快照（snapshot.py）与快照上的分析查询（analytics.py），两种数据库各跑一遍；需要 pyarrow"""
+
+import os
+
+import pytest
+
+import snapshot
+from analytics import monthly_totals, outstanding_balances
+from snapshot import SnapshotExporter, SnapshotUnavailable, partition_path, read_manifest
+
+pytest.importorskip("pyarrow")
+
+CONTRACTS = [  # (采购单号, 订单日期, 合同额分)
+    ("S-JAN-1", "2024-01-05", 10000), ("S-JAN-2", "2024-01-20", 5000),
+    ("S-FEB-1", "2024-02-03", 8000), ("S-MAR-1", "2024-03-15", 3000), ("S-BAD", "待定", 1000),
+]
+INVOICES = [  # (采购单号, 金额分, 状态)
+    ("S-JAN-1", 10000, "verified"), ("S-JAN-2", 2000, "mismatch"), ("S-FEB-1", 9000, "mismatch"),
+    ("S-MAR-1", 1000, "verified"),
+]
+
+
+@pytest.fixture
+def exporter(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "connection", pool.connection)
+    with pool.connection() as conn:
+        for po_number, order_date, fen in CONTRACTS:
+            conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) "
+                         "VALUES (?, ?, 10, ?)", (po_number, order_date, fen))
+        for po_number, fen, status in INVOICES:
+            add_invoice(conn, po_number, fen, status)
+        conn.commit()
+    return SnapshotExporter(str(tmp_path / "snapshots"), interval=0)
+
+
+def add_invoice(conn, po_number: str, fen: int, status: str = "verified"):
+    conn.execute("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen, status) "
+                 "SELECT id, po_number, 'A', 1, ?, ? FROM contracts WHERE po_number = ?", (fen, status, po_number))
+
+
+def inodes(directory: str) -> dict:
+    return {(kind, month): os.stat(partition_path(directory, kind, month)).st_ino
+            for month in read_manifest(directory)["months"] for kind in ("contracts", "invoices")}
+
+
+def test_incremental_export(pool, exporter):
+    months = ["2024-01", "2024-02", "2024-03", "unknown"]
+    first = exporter.run()
+    assert first["written"] == months and first["removed"] == [] and first["version"] == 1
+    manifest = read_manifest(exporter.directory)
+    assert manifest["months"]["2024-01"]["contracts"] == 2 and manifest["months"]["unknown"]["invoices"] == 0
+    before = inodes(exporter.directory)
+
+    # 只有 2 月的合同汇总变化：只重写 2 月的两个分区（原子替换为新文件）
+    with pool.connection() as conn:
+        add_invoice(conn, "S-FEB-1", 500)
+        conn.commit()
+    second = exporter.run()
+    assert second["written"] == ["2024-02"] and second["version"] == 2
+    after = inodes(exporter.directory)
+    assert {key for key in after if after[key] != before[key]} == {("contracts", "2024-02"), ("invoices", "2024-02")}
+    assert not [name for name in os.listdir(os.path.join(exporter.directory, "contracts")) if name.endswith(".tmp")]
+
+    # 没有变化：不重写，清单版本不变
+    assert exporter.run()["written"] == [] and read_manifest(exporter.directory)["version"] == 2
+
+    # invalidate()：核对结果等不反映在汇总上的变化，下次全部重写
+    exporter.invalidate()
+    assert exporter.run()["written"] == months
+    assert not os.path.exists(os.path.join(exporter.directory, "FULL"))
+
+    # 整月的合同删除后分区随之删除
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM invoices WHERE contract_number = 'S-MAR-1'")
+        conn.execute("DELETE FROM contracts WHERE po_number = 'S-MAR-1'")
+        conn.commit()
+    removed = exporter.run()
+    assert removed["written"] == [] and removed["removed"] == ["2024-03"]
+    assert "2024-03" not in read_manifest(exporter.directory)["months"]
+    assert not os.path.exists(partition_path(exporter.directory, "contracts", "2024-03"))
+
+
+def test_reports_match_sql(pool, exporter):
+    exporter.run()
+    with pool.connection() as conn:
+        expected = {month: row for month, *row in conn.execute(f'''
+            SELECT {snapshot.MONTH_SQL[pool.dialect].format(col="order_date")} AS month, COUNT(*), SUM(is_complete),
+                   SUM(total_amount_fen), SUM(invoiced_amount_fen), SUM(invoice_count)
+            FROM contracts GROUP BY month''')}
+        mismatch = {month: row for month, *row in conn.execute(f'''
+            SELECT {snapshot.MONTH_SQL[pool.dialect].format(col="c.order_date")} AS month, SUM(i.amount_fen), COUNT(*)
+            FROM contracts c JOIN invoices i ON i.contract_id = c.id WHERE i.status = 'mismatch' GROUP BY month''')}
+        balances = [row for row in conn.execute('''
+            SELECT id, total_amount_fen - invoiced_amount_fen FROM contracts ORDER BY 2 DESC, id''')]
+
+    report = monthly_totals(directory=exporter.directory)
+    assert [row["month"] for row in report["months"]] == sorted(expected)
+    for row in report["months"]:
+        count, complete, total, invoiced, invoice_count = expected[row["month"]]
+        mismatch_fen, mismatch_count = mismatch.get(row["month"], (0, 0))
+        assert (row["contracts"], row["complete"], row["total_amount"], row["invoiced_amount"],
+                row["outstanding_amount"], row["invoices"], row["mismatch_invoices"], row["mismatch_amount"]) == \
+            (count, complete, total / 100, invoiced / 100, (total - invoiced) / 100, invoice_count,
+             mismatch_count, mismatch_fen / 100)
+    assert [row["month"] for row in monthly_totals("2024-02", "2024-03", exporter.directory)["months"]] == \
+        ["2024-02", "2024-03"]
+
+    report = outstanding_balances(limit=2, directory=exporter.directory)
+    open_balances = [(contract_id, fen) for contract_id, fen in balances if fen > 0]
+    assert report["outstanding_amount"] == sum(fen for _, fen in open_balances) / 100
+    assert report["open_contracts"] == len(open_balances)
+    assert report["over_invoiced_contracts"] == len([fen for _, fen in balances if fen < 0])
+    assert [(c["id"], c["outstanding_amount"]) for c in report["contracts"]] == \
+        [(contract_id, fen / 100) for contract_id, fen in open_balances[:2]]
+
+
+def test_reports_need_a_snapshot(tmp_path):
+    with pytest.raises(SnapshotUnavailable):
+        monthly_totals(directory=str(tmp_path))
+    with pytest.raises(SnapshotUnavailable):
+        outstanding_balances(directory=str(tmp_path))
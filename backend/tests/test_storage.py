@@ -0,0 +1,46 @@
+"""上传文件流式落盘（storage.py）：边写边算哈希、大小限制、超限时删除临时文件"""
+
+import hashlib
+import io
+import os
+
+import pytest
+
+import main
+import storage
+from storage import UploadTooLarge, _copy_stream, blob_path
+
+
+def test_streamed_hash_matches_content(tmp_path):
+    content = os.urandom(10_000)
+    stored = _copy_stream(io.BytesIO(content), str(tmp_path), max_size=len(content), chunk_size=1024)
+    assert (stored.sha256, stored.size) == (hashlib.sha256(content).hexdigest(), len(content))
+    with open(stored.tmp_path, "rb") as f:
+        assert f.read() == content
+    stored.discard()
+    assert os.listdir(tmp_path) == []
+
+
+def test_overflow_removes_temp_file(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        _copy_stream(io.BytesIO(b"x" * 1025), str(tmp_path), max_size=1024, chunk_size=100)
+    assert os.listdir(tmp_path) == []
+
+
+def test_upload_size_limit(client, monkeypatch):
+    monkeypatch.setattr(storage, "MAX_UPLOAD_SIZE", 1024)
+    monkeypatch.setattr(storage, "CHUNK_SIZE", 100)
+    tmp_dir = os.path.join(storage.UPLOAD_DIR, "tmp")
+    for path in ("/upload/contract", "/upload/invoice"):
+        response = client.post(path, files={"file": ("big.txt", io.BytesIO(b"x" * 1025))})
+        assert response.status_code == 413, response.text
+        assert os.listdir(tmp_dir) == []
+
+    # 恰好等于上限的文件照常接收，按内容哈希存放
+    content = b"po_number: STORE-1\n".ljust(1024, b" ")
+    response = client.post("/upload/contract", files={"file": ("limit.txt", io.BytesIO(content))})
+    assert response.status_code == 202, response.text
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert (response.json()["file_hash"], response.json()["file_size"]) == (sha256, 1024)
+    assert os.path.exists(blob_path(sha256)) and os.listdir(tmp_dir) == []
+    main.ocr_jobs.wait(response.json()["job_id"], 60)
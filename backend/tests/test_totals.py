@@ -0,0 +1,60 @@
+"""合同开票汇总的检查与修复（totals.py），两种数据库各跑一遍"""
+
+import os
+import subprocess
+import sys
+
+from totals import recompute_all, rebuild_totals
+
+TOTALS_SQL = "SELECT po_number, invoiced_amount_fen, invoiced_quantity, invoice_count FROM contracts ORDER BY id"
+
+
+def corrupted(conn) -> list:
+    """两个合同、三张发票，然后手工改坏第一个合同的汇总；返回正确的汇总"""
+    ids = [conn.execute("INSERT INTO contracts (po_number, order_date, quantity, total_amount_fen) "
+                        "VALUES (?, '2024-01-01', 10, 10000)", (po_number,)).lastrowid for po_number in ("T-1", "T-2")]
+    conn.executemany("INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount_fen) "
+                     "VALUES (?, ?, 'A', ?, ?)", [(ids[0], "T-1", 3, 3000), (ids[0], "T-1", 2, 2500),
+                                                  (ids[1], "T-2", 1, 1000)])
+    conn.commit()
+    expected = conn.execute(TOTALS_SQL).fetchall()
+    assert expected == [("T-1", 5500, 5, 2), ("T-2", 1000, 1, 1)]
+    conn.execute("UPDATE contracts SET invoiced_amount_fen = 1, invoiced_quantity = 99 WHERE id = ?", (ids[0],))
+    conn.commit()
+    return expected
+
+
+def test_check_then_fix(pool):
+    with pool.connection() as conn:
+        expected = corrupted(conn)
+        mismatches = rebuild_totals(conn, dry_run=True)
+        assert [(m["po_number"], m["stored"], m["actual"]) for m in mismatches] == [(
+            "T-1", {"invoiced_amount_fen": 1, "invoiced_quantity": 99, "invoice_count": 2},
+            {"invoiced_amount_fen": 5500, "invoiced_quantity": 5, "invoice_count": 2})]
+        assert conn.execute(TOTALS_SQL).fetchall()[0] == ("T-1", 1, 99, 2)  # 只检查不修改
+
+        assert len(rebuild_totals(conn)) == 1
+        assert conn.execute(TOTALS_SQL).fetchall() == expected
+        assert rebuild_totals(conn, dry_run=True) == []
+
+
+def test_recompute_all(pool):
+    with pool.connection() as conn:
+        expected = corrupted(conn)
+        recompute_all(conn)
+        conn.commit()
+        assert conn.execute(TOTALS_SQL).fetchall() == expected
+
+
+def test_command_line(sqlite_pool):
+    with sqlite_pool.connection() as conn:
+        corrupted(conn)
+    env = {**os.environ, "DB_PATH": sqlite_pool.path}
+    env.pop("DATABASE_URL", None)
+    run = lambda *args: subprocess.run([sys.executable, "totals.py", *args], env=env, capture_output=True, text=True,
+                                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    check = run("--check")
+    assert check.returncode == 1 and "发现 1 个合同" in check.stdout and "T-1" in check.stdout
+    fix = run()
+    assert fix.returncode == 0 and "已修复 1 个合同" in fix.stdout
+    assert run("--check").returncode == 0
@@ -0,0 +1,118 @@
+"""写线程与组提交（writer.py）"""
+
+import threading
+
+import pytest
+
+from writer import Writer
+
+
+@pytest.fixture
+def writer(sqlite_pool):
+    with sqlite_pool.connection() as conn:
+        conn.execute("CREATE TABLE items (name TEXT NOT NULL)")
+        conn.commit()
+    writer = Writer(sqlite_pool, delay_ms=200, max_rows=100)
+    yield writer
+    writer.shutdown()
+
+
+def names(pool) -> list:
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT name FROM items ORDER BY rowid")]
+
+
+def insert(conn, name: str) -> str:
+    conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+    return name
+
+
+def hold(writer: Writer) -> threading.Event:
+    """占住写线程，直到返回的事件被设置：之后提交的任务在队列中排队"""
+    release = threading.Event()
+    writer.submit(release.wait, 10)
+    return release
+
+
+def test_failing_task_rolls_back_only_itself(writer):
+    def fail(conn):
+        insert(conn, "b")
+        raise ValueError("boom")
+
+    release = hold(writer)
+    futures = [writer.submit_group(insert, "a"), writer.submit_group(fail), writer.submit_group(insert, "c")]
+    release.set()
+    assert futures[0].result(10) == "a" and futures[2].result(10) == "c"
+    with pytest.raises(ValueError):
+        futures[1].result(10)
+    assert names(writer.pool) == ["a", "c"]
+    assert (writer.commits, writer.grouped) == (1, 2)
+
+
+def test_failed_commit_fails_the_whole_group(writer, monkeypatch):
+    def break_commit(conn):
+        def commit():
+            raise OSError("disk full")
+        monkeypatch.setattr(conn, "commit", commit)
+        return insert(conn, "a")
+
+    release = hold(writer)
+    futures = [writer.submit_group(break_commit), writer.submit_group(insert, "b")]
+    release.set()
+    for future in futures:
+        with pytest.raises(OSError):
+            future.result(10)
+    monkeypatch.undo()
+    assert names(writer.pool) == [] and writer.commits == 0
+    # 写线程继续工作
+    assert writer.submit_group(insert, "c").result(10) == "c"
+    assert names(writer.pool) == ["c"]
+
+
+def test_max_rows_cuts_group(writer):
+    writer.max_rows = 2
+    release = hold(writer)
+    futures = [writer.submit_group(insert, str(i)) for i in range(5)]
+    release.set()
+    assert [future.result(10) for future in futures] == ["0", "1", "2", "3", "4"]
+    assert (writer.commits, writer.grouped) == (3, 5)
+
+
+def test_delay_cuts_group(writer):
+    writer.delay = 0.01
+    assert writer.submit_group(insert, "a").result(10) == "a"
+    threading.Event().wait(0.05)
+    assert writer.submit_group(insert, "b").result(10) == "b"
+    assert writer.commits == 2
+
+
+def test_plain_task_between_groups_keeps_order(writer):
+    order = []
+
+    def plain():
+        # 普通任务自己借连接：前一组已经提交
+        order.append(("plain", names(writer.pool)))
+
+    release = hold(writer)
+    futures = [writer.submit_group(insert, "a", after_commit=lambda result: order.append(result)),
+               writer.submit(plain),
+               writer.submit_group(insert, "b", after_commit=lambda result: order.append(result))]
+    release.set()
+    for future in futures:
+        future.result(10)
+    assert order == ["a", ("plain", ["a"]), "b"]
+    assert writer.commits == 2
+
+
+def test_shutdown_drains_queue(sqlite_pool):
+    with sqlite_pool.connection() as conn:
+        conn.execute("CREATE TABLE items (name TEXT NOT NULL)")
+        conn.commit()
+    writer = Writer(sqlite_pool, delay_ms=200, max_rows=3)
+    release = hold(writer)
+    futures = [writer.submit_group(insert, str(i)) for i in range(7)] + [writer.submit(names, sqlite_pool)]
+    release.set()
+    writer.shutdown(wait=True)
+    assert all(future.done() for future in futures)
+    assert names(sqlite_pool) == [str(i) for i in range(7)] == futures[-1].result()
+    assert writer.commits == 3
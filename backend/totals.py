@@ -0,0 +1,87 @@
+"""
+合同开票汇总
+contracts.invoiced_amount_fen / invoiced_quantity / invoice_count 由 invoices 表上的触发器增量维护
+（触发器见 migrations.py），读合同列表时不再聚合发票表；本模块负责一致性检查与重建
+
+命令行：
+    python totals.py          检查并修复不一致的汇总
+    python totals.py --check  只检查，不修改（有不一致时退出码为1）
+"""
+
+import sqlite3
+import sys
+from typing import List
+
+# 按合同重新聚合发票，与存储的汇总比对（金额为整数分，精确比较）
+_MISMATCH_SQL = '''
+    SELECT c.id, c.po_number,
+           c.invoiced_amount_fen, c.invoiced_quantity, c.invoice_count,
+           COALESCE(a.amount_fen, 0), COALESCE(a.quantity, 0), COALESCE(a.count, 0)
+    FROM contracts c
+    LEFT JOIN (
+        SELECT contract_id, SUM(amount_fen) AS amount_fen, SUM(quantity) AS quantity, COUNT(*) AS count
+        FROM invoices GROUP BY contract_id
+    ) a ON a.contract_id = c.id
+    WHERE c.invoiced_amount_fen != COALESCE(a.amount_fen, 0)
+       OR c.invoiced_quantity != COALESCE(a.quantity, 0)
+       OR c.invoice_count != COALESCE(a.count, 0)
+'''
+
+
+def find_mismatches(conn: sqlite3.Connection) -> List[dict]:
+    mismatches = []
+    for row in conn.execute(_MISMATCH_SQL):
+        contract_id, po_number, stored_amt, stored_qty, stored_cnt, amt, qty, cnt = row
+        mismatches.append({
+            "id": contract_id,
+            "po_number": po_number,
+            "stored": {"invoiced_amount_fen": stored_amt, "invoiced_quantity": stored_qty, "invoice_count": stored_cnt},
+            "actual": {"invoiced_amount_fen": amt, "invoiced_quantity": qty, "invoice_count": cnt},
+        })
+    return mismatches
+
+
+def recompute_all(conn: sqlite3.Connection):
+    """按发票表重算全部合同的汇总（不提交，由调用方控制事务）"""
+    conn.execute('''
+        UPDATE contracts SET
+            invoiced_amount_fen = COALESCE((SELECT SUM(amount_fen) FROM invoices WHERE contract_id = contracts.id), 0),
+            invoiced_quantity = COALESCE((SELECT SUM(quantity) FROM invoices WHERE contract_id = contracts.id), 0),
+            invoice_count = (SELECT COUNT(*) FROM invoices WHERE contract_id = contracts.id)
+    ''')
+
+
+def rebuild_totals(conn: sqlite3.Connection, dry_run: bool = False) -> List[dict]:
+    """
+    检查汇总与发票明细是否一致，返回不一致的合同列表；
+    dry_run=False 时在同一个写事务内修正这些合同
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        mismatches = find_mismatches(conn)
+        if mismatches and not dry_run:
+            for m in mismatches:
+                actual = m["actual"]
+                conn.execute(
+                    "UPDATE contracts SET invoiced_amount_fen = ?, invoiced_quantity = ?, invoice_count = ? WHERE id = ?",
+                    (actual["invoiced_amount_fen"], actual["invoiced_quantity"], actual["invoice_count"], m["id"]))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return mismatches
+
+
+if __name__ == "__main__":
+    from db import DB_NAME, connection
+    from migrations import migrate
+
+    check_only = "--check" in sys.argv[1:]
+    with connection() as conn:
+        migrate(conn)
+        mismatches = rebuild_totals(conn, dry_run=check_only)
+    for m in mismatches:
+        print(f"{m['po_number']} (id={m['id']}): 存储 {m['stored']} → 实际 {m['actual']}")
+    action = "发现" if check_only else "已修复"
+    print(f"{DB_NAME}: {action} {len(mismatches)} 个合同的汇总不一致")
+    sys.exit(1 if check_only and mismatches else 0)
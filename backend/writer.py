@@ -0,0 +1,145 @@
+"""
+单写线程与组提交
+进程内的写入都交给一个线程依次执行，不在 SQLite 写锁上互相等待。两种任务：
+
+    writer.submit(func, *args)        普通任务：func 自己借连接、管理事务（接口同 ThreadPoolExecutor.submit）
+    writer.submit_group(func, *args)  组提交任务：func(conn, *args) 在写线程的连接上执行，不自己提交
+
+相邻的组提交任务合并成一个事务：第一个任务开始执行后的 GROUP_COMMIT_DELAY_MS 内到达的（最多 GROUP_COMMIT_ROWS 个）
+边到边执行，之后一次提交、一次 fsync。每个任务在自己的 SAVEPOINT 中执行，抛出异常只回滚它自己；
+返回的 Future 在事务提交之后才有结果，拿到结果时数据已落盘（写线程连接的 synchronous 默认为 FULL；
+PostgreSQL 的提交本身即落盘）
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from db import DB_SYNCHRONOUS, ConnectionPool, dialect, pool as default_pool
+
+GROUP_COMMIT_DELAY_MS = float(os.getenv("GROUP_COMMIT_DELAY_MS", "5"))
+GROUP_COMMIT_ROWS = int(os.getenv("GROUP_COMMIT_ROWS", "500"))
+GROUP_COMMIT_SYNCHRONOUS = os.getenv("GROUP_COMMIT_SYNCHRONOUS", "FULL")
+
+_STOP = object()
+
+
+class Writer(Executor):
+    def __init__(self, pool: ConnectionPool = default_pool, delay_ms: float = GROUP_COMMIT_DELAY_MS,
+                 max_rows: int = GROUP_COMMIT_ROWS):
+        self.pool = pool
+        self.delay = delay_ms / 1000
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        self._conn = None
+        self.commits = 0  # 组提交的事务数
+        self.grouped = 0  # 经组提交写入的任务数
+        self._thread = threading.Thread(target=self._run, name="db-write", daemon=True)
+        self._thread.start()
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        return self._put((False, Future(), func, args, kwargs, None))
+
+    def submit_group(self, func: Callable[..., Any], *args,
+                     after_commit: Optional[Callable[[Any], Any]] = None) -> Future:
+        """after_commit(结果) 在提交后于写线程中调用，其返回值作为 Future 的结果"""
+        return self._put((True, Future(), func, args, {}, after_commit))
+
+    def _put(self, task) -> Future:
+        self._queue.put(task)
+        return task[1]
+
+    def _run(self):
+        task = None
+        while True:
+            task = task or self._queue.get()
+            if task is _STOP:
+                break
+            if task[0]:
+                task = self._commit_group(task)
+                continue
+            _, future, func, args, kwargs, _ = task
+            task = None
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        if self._conn is not None:
+            if dialect(self._conn) == "sqlite":
+                self._conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+            self.pool.release(self._conn)
+            self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.pool.acquire()
+            if dialect(self._conn) == "sqlite":
+                self._conn.execute(f"PRAGMA synchronous={GROUP_COMMIT_SYNCHRONOUS}")
+        return self._conn
+
+    def _commit_group(self, task):
+        """执行一组组提交任务并提交，返回下一个待执行的任务（普通任务或停止标记）"""
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            # 等写锁超时等：只让这一个任务失败，写线程继续
+            if self._conn is not None and self._conn.in_transaction:
+                self._conn.rollback()
+            if task[1].set_running_or_notify_cancel():
+                task[1].set_exception(e)
+            return None
+        done: List[Tuple[Future, Any, Optional[Callable]]] = []
+        deadline = time.monotonic() + self.delay
+        while True:
+            self._apply(conn, task, done)
+            task = None
+            if len(done) >= self.max_rows:
+                break
+            timeout = deadline - time.monotonic()
+            try:
+                task = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is _STOP or not task[0]:
+                break
+        try:
+            conn.commit()
+        except BaseException as e:
+            conn.rollback()
+            for future, _, _ in done:
+                future.set_exception(e)
+            return task
+        self.commits += 1
+        self.grouped += len(done)
+        for future, result, after_commit in done:
+            try:
+                future.set_result(after_commit(result) if after_commit else result)
+            except BaseException as e:
+                future.set_exception(e)
+        return task
+
+    def _apply(self, conn, task, done: list):
+        _, future, func, args, _, after_commit = task
+        if not future.set_running_or_notify_cancel():
+            return
+        conn.execute("SAVEPOINT task")
+        try:
+            result = func(conn, *args)
+        except BaseException as e:
+            conn.execute("ROLLBACK TO task")
+            conn.execute("RELEASE task")
+            future.set_exception(e)
+            return
+        conn.execute("RELEASE task")
+        done.append((future, result, after_commit))
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        """执行完已提交的任务后退出写线程"""
+        self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
@@ -5,6 +5,7 @@ import { useDropzone } from 'react-dropzone'
 import axios from 'axios'
 
 const API_BASE = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
+const PAGE_SIZE = 20
 
 interface Contract {
   id: number
@@ -33,12 +34,16 @@ export default function Home() {
   const [contractInvoices, setContractInvoices] = useState<{ [key: number]: Invoice[] }>({})
   const [uploadType, setUploadType] = useState<'contract' | 'invoice'>('contract')
   const [uploading, setUploading] = useState(false)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
 
-  // 加载合同列表
-  const loadContracts = async () => {
+  // 加载合同列表（分页：传入游标时追加下一页）
+  const loadContracts = async (after?: string) => {
     try {
-      const res = await axios.get(`${API_BASE}/contracts`)
-      setContracts(res.data)
+      const res = await axios.get(`${API_BASE}/contracts`, {
+        params: { limit: PAGE_SIZE, after }
+      })
+      setContracts(prev => (after ? [...prev, ...res.data] : res.data))
+      setNextCursor(res.headers['x-next-cursor'] || null)
     } catch (error) {
       console.error('加载合同失败:', error)
     }
@@ -58,6 +63,40 @@ export default function Home() {
     loadContracts()
   }, [])
 
+  // 订阅合同变化推送：更新对应合同的汇总，并让其发票列表在需要时重新加载
+  useEffect(() => {
+    const source = new EventSource(`${API_BASE}/events`)
+    source.addEventListener('contract', (e) => {
+      const changed: Contract = JSON.parse((e as MessageEvent).data)
+      setContracts(prev => prev.map(c => (c.id === changed.id ? { ...c, ...changed } : c)))
+      setContractInvoices(prev => {
+        const { [changed.id]: _, ...rest } = prev
+        return rest
+      })
+    })
+    // 断线太久、错过的事件已无法补发：全量刷新
+    source.addEventListener('reset', () => loadContracts())
+    return () => source.close()
+  }, [])
+
+  // 展开的合同发票未加载（或已因推送失效）时加载
+  useEffect(() => {
+    if (expandedContract !== null && !contractInvoices[expandedContract]) {
+      loadContractInvoices(expandedContract)
+    }
+  }, [expandedContract, contractInvoices])
+
+  // 轮询识别任务直到结束
+  const waitForJob = async (jobId: string) => {
+    while (true) {
+      const res = await axios.get(`${API_BASE}/jobs/${jobId}`)
+      if (res.data.status === 'succeeded' || res.data.status === 'failed') {
+        return res.data
+      }
+      await new Promise(resolve => setTimeout(resolve, 500))
+    }
+  }
+
   // 文件上传
   const onDrop = useCallback(async (acceptedFiles: File[]) => {
     if (acceptedFiles.length === 0) return
@@ -73,7 +112,15 @@ export default function Home() {
         headers: { 'Content-Type': 'multipart/form-data' }
       })
       
-      alert(`${uploadType === 'contract' ? '合同' : '发票'}上传成功！`)
+      // 识别在后台任务中进行，轮询任务状态
+      if (res.data.job_id) {
+        const job = await waitForJob(res.data.job_id)
+        if (job.status === 'failed') {
+          throw new Error(job.error || '识别失败')
+        }
+      }
+      
+      alert(res.data.duplicate ? res.data.message : `${uploadType === 'contract' ? '合同' : '发票'}上传成功！`)
       loadContracts()
     } catch (error: any) {
       alert(`上传失败: ${error.response?.data?.detail || error.message}`)
@@ -93,14 +140,7 @@ export default function Home() {
 
   // 展开/折叠合同
   const toggleContract = (contractId: number) => {
-    if (expandedContract === contractId) {
-      setExpandedContract(null)
-    } else {
-      setExpandedContract(contractId)
-      if (!contractInvoices[contractId]) {
-        loadContractInvoices(contractId)
-      }
-    }
+    setExpandedContract(expandedContract === contractId ? null : contractId)
   }
 
   return (
@@ -240,6 +280,14 @@ export default function Home() {
                   )}
                 </div>
               ))}
+              {nextCursor && (
+                <button
+                  onClick={() => loadContracts(nextCursor)}
+                  className="w-full py-2 rounded-lg bg-gray-100 text-gray-700 hover:bg-gray-200 transition"
+                >
+                  加载更多
+                </button>
+              )}
             </div>
           )}
         </div>
@@ -27,7 +27,7 @@ fi
 
 source venv/bin/activate
 pip install -q -r requirements.txt
-uvicorn main:app --reload --host 0.0.0.0 --port 8000 &
+uvicorn main:app --reload --host 0.0.0.0 --port 8000 --timeout-graceful-shutdown 5 &
 BACKEND_PID=$!
 echo "✅ 后端运行在 http://localhost:8000"
 
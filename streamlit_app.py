@@ -4,10 +4,10 @@
 """
 
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import datetime
 import os
+import sys
 
 # 页面配置
 st.set_page_config(
@@ -70,155 +70,161 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 数据库初始化
-DB_PATH = "invoice_checker.db"
+# 数据访问：与后端共用 backend/repository.py（表结构由 backend/migrations.py 维护）；
+# 设置 INVOICE_API_URL 时经后端接口只读，否则直接读写 DB_PATH 指向的数据库
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
 
-def init_db():
-    """初始化数据库"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 合同表
-    c.execute('''CREATE TABLE IF NOT EXISTS contracts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        po_number TEXT UNIQUE NOT NULL,
-        order_date TEXT NOT NULL,
-        quantity INTEGER NOT NULL,
-        total_amount REAL NOT NULL,
-        file_name TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # 发票表
-    c.execute('''CREATE TABLE IF NOT EXISTS invoices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        contract_id INTEGER,
-        contract_number TEXT,
-        spec_model TEXT,
-        quantity INTEGER,
-        amount REAL,
-        file_name TEXT,
-        status TEXT DEFAULT 'verified',
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (contract_id) REFERENCES contracts (id)
-    )''')
-    
-    conn.commit()
-    conn.close()
-
-def get_all_contracts():
-    """获取所有合同及状态"""
-    conn = sqlite3.connect(DB_PATH)
-    query = '''
-        SELECT 
-            c.id, c.po_number, c.order_date, c.quantity, c.total_amount,
-            COALESCE(SUM(i.amount), 0) as invoiced_amount,
-            COALESCE(SUM(i.quantity), 0) as invoiced_quantity,
-            COUNT(i.id) as invoice_count
-        FROM contracts c
-        LEFT JOIN invoices i ON c.id = i.contract_id
-        GROUP BY c.id
-        ORDER BY c.order_date DESC
-    '''
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+from repository import DataError, open_repository
+
+@st.cache_resource
+def get_repository():
+    return open_repository()
+
+repo = get_repository()
+
+# 合同列表按页查询：筛选、排序、分页都在数据库中完成，每次只读取并渲染一页，与合同总数无关
+STATUS_FILTERS = {
+    "全部": None,
+    "已完成": "complete",
+    "未完成": "incomplete",
+}
+SORT_ORDERS = {
+    "日期(新→旧)": ("order_date", "desc"),
+    "日期(旧→新)": ("order_date", "asc"),
+    "金额(高→低)": ("total_amount", "desc"),
+    "金额(低→高)": ("total_amount", "asc"),
+}
+PAGE_SIZES = [50, 100, 200]
+CONTRACT_COLUMNS = ["id", "po_number", "order_date", "quantity", "total_amount", "invoiced_amount",
+                    "total_amount_fen", "invoiced_amount_fen", "invoiced_quantity", "invoice_count"]
+INVOICE_COLUMNS = ["id", "spec_model", "quantity", "amount", "status", "created_at", "file_name"]
+
+def get_contract_stats():
+    """合同总数与已完成数"""
+    stats = repo.contract_stats()
+    return stats["total"], stats["complete"]
+
+def count_contracts(status_filter):
+    """符合筛选条件的合同数"""
+    return repo.count_contracts(STATUS_FILTERS[status_filter])
+
+def get_contracts_page(status_filter, sort_by, page, page_size):
+    """获取一页合同及状态"""
+    sort, order = SORT_ORDERS[sort_by]
+    contracts, _ = repo.list_contracts(page_size, status=STATUS_FILTERS[status_filter], sort=sort, order=order,
+                                       offset=(page - 1) * page_size)
+    return pd.DataFrame(contracts, columns=CONTRACT_COLUMNS)
+
+def get_contract(contract_id):
+    """获取单个合同（详情面板）"""
+    return repo.get_contract(contract_id)
+
+def status_text(total_amount_fen, invoiced_amount_fen):
+    if total_amount_fen == invoiced_amount_fen:
+        return "🟢 金额一致"
+    return f"🟡 欠 ¥{(total_amount_fen - invoiced_amount_fen) / 100:,.2f}"
 
 def get_contract_invoices(contract_id):
-    """获取某个合同的所有发票"""
-    conn = sqlite3.connect(DB_PATH)
-    query = '''
-        SELECT id, spec_model, quantity, amount, status, created_at, file_name
-        FROM invoices 
-        WHERE contract_id = ?
-        ORDER BY created_at DESC
-    '''
-    df = pd.read_sql_query(query, conn, params=(contract_id,))
-    conn.close()
-    return df
+    """获取某个合同的所有发票（新的在前）"""
+    return pd.DataFrame(repo.contract_invoices(contract_id), columns=INVOICE_COLUMNS)
 
 def add_contract(po_number, order_date, quantity, total_amount, file_name):
     """添加合同"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
-        c.execute('''INSERT INTO contracts (po_number, order_date, quantity, total_amount, file_name)
-                     VALUES (?, ?, ?, ?, ?)''',
-                  (po_number, order_date, quantity, total_amount, file_name))
-        conn.commit()
-        return True, "合同添加成功！"
-    except sqlite3.IntegrityError:
-        return False, "采购单号已存在！"
-    finally:
-        conn.close()
+        repo.add_contract(po_number, order_date, quantity, total_amount, file_name=file_name)
+    except DataError as e:
+        return False, f"{e}！"
+    return True, "合同添加成功！"
 
 def delete_contract(contract_id):
     """删除合同及其关联发票"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
-        c.execute("DELETE FROM invoices WHERE contract_id = ?", (contract_id,))
-        c.execute("DELETE FROM contracts WHERE id = ?", (contract_id,))
-        conn.commit()
-        return True, "合同已删除！"
-    except Exception as e:
-        return False, f"删除失败: {str(e)}"
-    finally:
-        conn.close()
+        repo.delete_contract(contract_id)
+    except DataError as e:
+        return False, f"删除失败: {e}"
+    return True, "合同已删除！"
 
 def delete_invoice(invoice_id):
     """删除单张发票"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
-        c.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
-        conn.commit()
-        return True, "发票已删除！"
-    except Exception as e:
-        return False, f"删除失败: {str(e)}"
-    finally:
-        conn.close()
+        repo.delete_invoice(invoice_id)
+    except DataError as e:
+        return False, f"删除失败: {e}"
+    return True, "发票已删除！"
 
 def add_invoice(contract_number, spec_model, quantity, amount, file_name):
-    """添加发票"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 查找对应合同
-    c.execute("SELECT id FROM contracts WHERE po_number = ?", (contract_number,))
-    result = c.fetchone()
-    
-    if not result:
-        conn.close()
-        return False, f"未找到合同号: {contract_number}"
-    
-    contract_id = result[0]
-    
-    c.execute('''INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount, file_name)
-                 VALUES (?, ?, ?, ?, ?, ?)''',
-              (contract_id, contract_number, spec_model, quantity, amount, file_name))
-    conn.commit()
-    conn.close()
+    """添加发票：入库前按合同核对，有问题的发票照常入库（状态 mismatch）"""
+    try:
+        result = repo.add_invoice(contract_number, spec_model, quantity, amount, file_name=file_name)
+    except DataError as e:
+        return False, str(e)
+    if result["issues"]:
+        return True, "发票已添加，核对发现问题: " + "；".join(result["issues"])
     return True, "发票验证通过并添加！"
 
-# 初始化数据库
-init_db()
+# 数据快照：同一份数据在各片段之间只查询一次。片段单独重跑时沿用；
+# 写入后只丢弃受影响的部分（统计、列表页、该合同详情），再整页重跑刷新其它片段
+def snapshot_get(key, load):
+    snapshot = st.session_state.snapshot
+    if key not in snapshot:
+        snapshot[key] = load()
+    return snapshot[key]
+
+def invalidate(contract_id=None, po_number=None):
+    """写入后丢弃统计、列表页和受影响合同的详情，其余数据沿用"""
+    snapshot = st.session_state.snapshot
+    for key in list(snapshot):
+        if key[0] == "detail":
+            contract = snapshot[key][0]
+            if key[1] != contract_id and (contract is None or contract['po_number'] != po_number):
+                continue
+        del snapshot[key]
+
+def rerun_app():
+    """整页重跑以刷新其它片段，沿用已按需失效的快照"""
+    st.session_state.keep_snapshot = True
+    st.rerun()
+
+def load_stats():
+    return snapshot_get(("stats",), get_contract_stats)
+
+def load_page(status_filter, sort_by, page, page_size):
+    return snapshot_get(("page", status_filter, sort_by, page, page_size),
+                        lambda: get_contracts_page(status_filter, sort_by, page, page_size))
+
+def load_count(status_filter):
+    return snapshot_get(("count", status_filter), lambda: count_contracts(status_filter))
+
+def load_detail(contract_id):
+    def load():
+        contract = get_contract(contract_id)
+        return contract, get_contract_invoices(contract_id) if contract else None
+    return snapshot_get(("detail", contract_id), load)
 
 # 初始化session state
 if 'upload_type' not in st.session_state:
     st.session_state.upload_type = 'contract'
-if 'show_details' not in st.session_state:
-    st.session_state.show_details = {}
+if 'selected_contract' not in st.session_state:
+    st.session_state.selected_contract = None
 if 'confirm_delete' not in st.session_state:
-    st.session_state.confirm_delete = {}
+    st.session_state.confirm_delete = None
+# 每次整页运行换一份新快照；写入或切换选中合同引起的重跑除外
+if not st.session_state.pop('keep_snapshot', False):
+    st.session_state.snapshot = {}
 
 # 标题
 st.markdown("# 📋 发票检查器")
 st.markdown('<p class="subtitle">采购发票自动化验证系统</p>', unsafe_allow_html=True)
 
-# 侧边栏 - 上传区域
-with st.sidebar:
+# 侧边栏 - 上传区域（片段：切换类型、选文件、填表单只重跑这一块）
+@st.fragment
+def upload_panel():
     st.markdown("### 📤 文件上传")
+    if repo.read_only:
+        st.info("当前经后端接口只读，请通过后端上传合同和发票")
+        return
     
     upload_type = st.radio(
         "选择上传类型",
@@ -243,7 +249,7 @@ with st.sidebar:
             # 取消上传按钮
             if st.button("❌ 取消上传", key="cancel_contract_upload"):
                 st.session_state.pop("contract_uploader", None)
-                st.rerun()
+                st.rerun(scope="fragment")
             
             with st.form("contract_form"):
                 st.markdown("##### 请填写合同信息")
@@ -274,7 +280,8 @@ with st.sidebar:
                         )
                         if success:
                             st.success(message)
-                            st.rerun()
+                            invalidate()
+                            rerun_app()
                         else:
                             st.error(message)
     
@@ -292,18 +299,18 @@ with st.sidebar:
             # 取消上传按钮
             if st.button("❌ 取消上传", key="cancel_invoice_upload"):
                 st.session_state.pop("invoice_uploader", None)
-                st.rerun()
+                st.rerun(scope="fragment")
             
             with st.form("invoice_form"):
                 st.markdown("##### 请填写发票信息")
                 st.caption("⚠️ 请根据发票内容手动填写以下信息")
                 
-                contracts_df = get_all_contracts()
-                if len(contracts_df) == 0:
+                total_contracts, _ = load_stats()
+                if total_contracts == 0:
                     st.warning("⚠️ 请先添加合同")
                 else:
-                    contract_options = contracts_df['po_number'].tolist()
-                    contract_number = st.selectbox("关联合同号", contract_options)
+                    # 手填合同号（不把全部合同号下发到下拉框），由 add_invoice 校验
+                    contract_number = st.text_input("关联合同号 *", value="", placeholder="例: PO-20240001")
                     spec_model = st.text_input("规格型号", value="", placeholder="例: SKU-A001")
                     quantity = st.number_input("数量", min_value=0, value=0, step=1)
                     amount = st.number_input("发票金额(¥)", min_value=0.0, value=0.0, step=100.0)
@@ -311,13 +318,15 @@ with st.sidebar:
                     submitted = st.form_submit_button("✅ 确认添加发票", use_container_width=True)
                     
                     if submitted:
-                        if quantity <= 0:
+                        if not contract_number.strip():
+                            st.error("请填写关联合同号！")
+                        elif quantity <= 0:
                             st.error("数量必须大于0！")
                         elif amount <= 0:
                             st.error("金额必须大于0！")
                         else:
                             success, message = add_invoice(
-                                contract_number,
+                                contract_number.strip(),
                                 spec_model,
                                 quantity,
                                 amount,
@@ -325,131 +334,165 @@ with st.sidebar:
                             )
                             if success:
                                 st.success(message)
-                                st.rerun()
+                                invalidate(po_number=contract_number.strip())
+                                rerun_app()
                             else:
                                 st.error(message)
-    
+
+# 侧边栏 - 统计
+@st.fragment
+def stats_panel():
     st.markdown("---")
     st.markdown("### 📊 统计")
-    contracts_df = get_all_contracts()
+    total_contracts, completed = load_stats()
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("合同总数", len(contracts_df))
+        st.metric("合同总数", total_contracts)
     with col2:
-        completed = len(contracts_df[abs(contracts_df['total_amount'] - contracts_df['invoiced_amount']) < 0.01]) if len(contracts_df) > 0 else 0
         st.metric("已完成", completed)
 
-# 主区域 - 合同列表
-st.markdown("## 📑 合同列表")
-
-contracts_df = get_all_contracts()
-
-if len(contracts_df) == 0:
-    st.info("📭 暂无合同数据，请在左侧上传合同文件")
-else:
+# 合同列表（片段：筛选、排序、翻页只重跑这一块）
+@st.fragment
+def contract_list():
     # 添加筛选
-    col1, col2, col3 = st.columns([2, 2, 6])
+    col1, col2, col3, col4 = st.columns([2, 2, 1.5, 2.5])
     with col1:
-        status_filter = st.selectbox("状态筛选", ["全部", "已完成", "未完成"])
+        status_filter = st.selectbox("状态筛选", list(STATUS_FILTERS))
     with col2:
-        sort_by = st.selectbox("排序", ["日期(新→旧)", "日期(旧→新)", "金额(高→低)", "金额(低→高)"])
-    
-    # 应用筛选
-    filtered_df = contracts_df.copy()
-    if status_filter == "已完成":
-        filtered_df = filtered_df[abs(filtered_df['total_amount'] - filtered_df['invoiced_amount']) < 0.01]
-    elif status_filter == "未完成":
-        filtered_df = filtered_df[abs(filtered_df['total_amount'] - filtered_df['invoiced_amount']) >= 0.01]
-    
-    # 应用排序
-    if "旧→新" in sort_by:
-        filtered_df = filtered_df.sort_values('order_date', ascending=True)
-    elif "金额(高→低)" in sort_by:
-        filtered_df = filtered_df.sort_values('total_amount', ascending=False)
-    elif "金额(低→高)" in sort_by:
-        filtered_df = filtered_df.sort_values('total_amount', ascending=True)
-    
-    st.markdown("---")
-    
-    # 显示合同卡片
-    for _, row in filtered_df.iterrows():
-        is_complete = abs(row['total_amount'] - row['invoiced_amount']) < 0.01
-        status_emoji = "🟢" if is_complete else "🟡"
-        status_text = "✓ 金额一致" if is_complete else f"欠 ¥{row['total_amount'] - row['invoiced_amount']:,.2f}"
-        
-        with st.container():
-            col1, col2, col3, col4, col5, col6, col7 = st.columns([0.3, 1.5, 1, 1, 1.5, 1.2, 0.5])
-            
-            with col1:
-                st.markdown(f"<h2 style='margin:0;'>{status_emoji}</h2>", unsafe_allow_html=True)
-            with col2:
-                st.markdown(f"**{row['po_number']}**")
-            with col3:
-                st.text(row['order_date'])
-            with col4:
-                st.text(f"数量: {row['quantity']}")
-            with col5:
-                st.markdown(f"**¥{row['total_amount']:,.2f}**")
-            with col6:
-                if is_complete:
-                    st.success(status_text)
+        sort_by = st.selectbox("排序", list(SORT_ORDERS))
+    with col3:
+        page_size = st.selectbox("每页", PAGE_SIZES)
+    total = load_count(status_filter)
+    pages = max(1, -(-total // page_size))
+    with col4:
+        page = st.number_input(f"页码（共 {pages} 页，{total} 个合同）", min_value=1, max_value=pages, value=1, step=1)
+
+    page_df = load_page(status_filter, sort_by, int(page), page_size)
+    table = pd.DataFrame({
+        "状态": [status_text(total_fen, invoiced_fen) for total_fen, invoiced_fen
+                 in zip(page_df['total_amount_fen'], page_df['invoiced_amount_fen'])],
+        "采购单号": page_df['po_number'],
+        "订单日期": page_df['order_date'],
+        "数量": page_df['quantity'],
+        "合同金额": page_df['total_amount'],
+        "已开票": page_df['invoiced_amount'],
+        "发票数": page_df['invoice_count'],
+    })
+    event = st.dataframe(
+        table,
+        key="contracts_table",
+        hide_index=True,
+        use_container_width=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        column_config={
+            "合同金额": st.column_config.NumberColumn(format="¥%.2f"),
+            "已开票": st.column_config.NumberColumn(format="¥%.2f"),
+        },
+    )
+    # 表格数据变化（换页、开票、删除）时 Streamlit 会清空选中行，选中的合同另存一份；
+    # 选中另一个合同时整页重跑，让详情片段跟着刷新
+    if event.selection.rows:
+        contract_id = int(page_df['id'].iloc[event.selection.rows[0]])
+        if contract_id != st.session_state.selected_contract:
+            st.session_state.selected_contract = contract_id
+            st.session_state.confirm_delete = None
+            rerun_app()
+
+def set_confirm_delete(contract_id):
+    st.session_state.confirm_delete = contract_id
+
+def contract_delete_controls(contract):
+    """删除合同（二次确认）"""
+    if st.session_state.confirm_delete != contract['id']:
+        st.button("🗑️ 删除此合同", key=f"del_{contract['id']}", on_click=set_confirm_delete, args=(contract['id'],))
+    else:
+        st.warning(f"⚠️ 确定要删除合同 **{contract['po_number']}** 及其所有关联发票吗？")
+        confirm_col1, confirm_col2 = st.columns(2)
+        with confirm_col1:
+            if st.button("✅ 确认删除", key=f"confirm_del_{contract['id']}", type="primary"):
+                success, message = delete_contract(contract['id'])
+                if success:
+                    st.session_state.confirm_delete = None
+                    st.session_state.selected_contract = None
+                    invalidate(contract_id=contract['id'])
+                    rerun_app()
                 else:
-                    st.warning(status_text)
-            with col7:
-                # 删除按钮
-                delete_key = f"del_{row['id']}"
-                if st.button("🗑️", key=delete_key, help="删除此合同"):
-                    st.session_state.confirm_delete[row['id']] = True
-            
-            # 删除确认
-            if st.session_state.confirm_delete.get(row['id'], False):
-                confirm_col1, confirm_col2, confirm_col3 = st.columns([4, 1, 1])
-                with confirm_col1:
-                    st.warning(f"⚠️ 确定要删除合同 **{row['po_number']}** 及其所有关联发票吗？")
-                with confirm_col2:
-                    if st.button("✅ 确认删除", key=f"confirm_del_{row['id']}", type="primary"):
-                        success, message = delete_contract(row['id'])
-                        if success:
-                            st.session_state.confirm_delete.pop(row['id'], None)
-                            st.rerun()
-                        else:
-                            st.error(message)
-                with confirm_col3:
-                    if st.button("❌ 取消", key=f"cancel_del_{row['id']}"):
-                        st.session_state.confirm_delete.pop(row['id'], None)
-                        st.rerun()
-            
-            # 发票明细展开
-            if st.button(f"📋 查看发票明细 ({int(row['invoice_count'])}张)", key=f"btn_{row['id']}", use_container_width=True):
-                st.session_state.show_details[row['id']] = not st.session_state.show_details.get(row['id'], False)
-            
-            if st.session_state.show_details.get(row['id'], False):
-                invoices_df = get_contract_invoices(row['id'])
-                if len(invoices_df) > 0:
-                    st.markdown("##### 发票明细")
-                    for idx, inv in invoices_df.iterrows():
-                        inv_col1, inv_col2, inv_col3, inv_col4, inv_col5, inv_col6 = st.columns([2, 1, 1, 1, 1, 0.5])
-                        with inv_col1:
-                            st.text(f"规格: {inv['spec_model']}")
-                        with inv_col2:
-                            st.text(f"数量: {inv['quantity']}")
-                        with inv_col3:
-                            st.text(f"¥{inv['amount']:,.2f}")
-                        with inv_col4:
-                            st.text(inv['created_at'][:10])
-                        with inv_col5:
-                            st.success("✓ 已验证")
-                        with inv_col6:
-                            if st.button("🗑️", key=f"del_inv_{inv['id']}", help="删除此发票"):
-                                success, msg = delete_invoice(inv['id'])
-                                if success:
-                                    st.rerun()
-                                else:
-                                    st.error(msg)
+                    st.error(message)
+        with confirm_col2:
+            st.button("❌ 取消", key=f"cancel_del_{contract['id']}", on_click=set_confirm_delete, args=(None,))
+
+# 合同详情（片段：选发票、删除确认只重跑这一块）
+@st.fragment
+def contract_detail():
+    contract, invoices_df = None, None
+    if st.session_state.selected_contract is not None:
+        contract, invoices_df = load_detail(st.session_state.selected_contract)
+    if contract is None:
+        st.info("👈 选中左侧表格中的一行查看合同详情")
+        return
+
+    st.markdown(f"### {contract['po_number']}")
+    st.caption(f"订单日期: {contract['order_date']} | 数量: {contract['quantity']} | "
+               f"已开票数量: {contract['invoiced_quantity']}")
+    m1, m2 = st.columns(2)
+    with m1:
+        st.metric("合同金额", f"¥{contract['total_amount_fen'] / 100:,.2f}")
+    with m2:
+        st.metric("已开票", f"¥{contract['invoiced_amount_fen'] / 100:,.2f}")
+    if contract['total_amount_fen'] == contract['invoiced_amount_fen']:
+        st.success("✓ 金额一致")
+    else:
+        st.warning(f"欠 ¥{(contract['total_amount_fen'] - contract['invoiced_amount_fen']) / 100:,.2f}")
+
+    # 删除确认（只读时不提供删除）
+    if not repo.read_only:
+        contract_delete_controls(contract)
+
+    # 发票明细：同样是一个表格，选中一张可删除
+    st.markdown(f"##### 发票明细 ({contract['invoice_count']}张)")
+    if len(invoices_df) > 0:
+        invoice_event = st.dataframe(
+            invoices_df.rename(columns={
+                "spec_model": "规格型号", "quantity": "数量", "amount": "金额",
+                "status": "状态", "created_at": "上传时间", "file_name": "文件",
+            }),
+            key=f"invoices_table_{contract['id']}",
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            column_order=["规格型号", "数量", "金额", "状态", "上传时间", "文件"],
+            column_config={"金额": st.column_config.NumberColumn(format="¥%.2f")},
+        )
+        if invoice_event.selection.rows and not repo.read_only:
+            invoice_id = int(invoices_df['id'].iloc[invoice_event.selection.rows[0]])
+            if st.button("🗑️ 删除选中发票", key=f"del_inv_{invoice_id}"):
+                success, msg = delete_invoice(invoice_id)
+                if success:
+                    invalidate(contract_id=contract['id'])
+                    rerun_app()
                 else:
-                    st.info("暂无发票")
-            
-            st.markdown("---")
+                    st.error(msg)
+    else:
+        st.info("暂无发票")
+
+with st.sidebar:
+    upload_panel()
+    stats_panel()
+
+# 主区域 - 合同列表：当前页渲染为一个表格，选中一行在右侧显示该合同详情
+st.markdown("## 📑 合同列表")
+
+if load_stats()[0] == 0:
+    st.info("📭 暂无合同数据，请在左侧上传合同文件")
+else:
+    st.markdown("---")
+    list_col, detail_col = st.columns([3, 2])
+    with list_col:
+        contract_list()
+    with detail_col:
+        contract_detail()
 
 # 页脚
 st.markdown("---")
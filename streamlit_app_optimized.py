@@ -4,10 +4,10 @@
 """
 
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import datetime
 import os
+import sys
 from functools import lru_cache
 
 # 页面配置
@@ -18,18 +18,23 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 数据库路径
-DB_PATH = "invoice_checker.db"
-
 # ========================================
-# 🔧 性能优化1: 数据库连接池
+# 🔧 性能优化1: 共用数据访问层（连接池 + 预编译语句）
 # ========================================
+# 与后端共用 backend/repository.py（表结构由 backend/migrations.py 维护）；
+# 设置 INVOICE_API_URL 时经后端接口只读，否则直接读写 DB_PATH 指向的数据库
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from repository import DataError, open_repository
+
 @st.cache_resource
-def get_db_connection():
-    """缓存的数据库连接（单例模式）"""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row  # 允许按列名访问
-    return conn
+def get_repository():
+    """缓存的数据访问对象（单例模式）"""
+    return open_repository()
+
+repo = get_repository()
 
 # ========================================
 # 🔧 性能优化2: 将CSS移到外部，避免每次渲染
@@ -49,132 +54,158 @@ def load_css():
 
 st.markdown(load_css(), unsafe_allow_html=True)
 
-# ========================================
-# 数据库初始化
-# ========================================
-def init_db():
-    """初始化数据库"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS contracts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        po_number TEXT UNIQUE NOT NULL,
-        order_date TEXT NOT NULL,
-        quantity INTEGER NOT NULL,
-        total_amount REAL NOT NULL,
-        file_name TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS invoices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        contract_id INTEGER,
-        contract_number TEXT,
-        spec_model TEXT,
-        quantity INTEGER,
-        amount REAL,
-        file_name TEXT,
-        status TEXT DEFAULT 'verified',
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (contract_id) REFERENCES contracts (id)
-    )''')
-    
-    conn.commit()
-
 # ========================================
 # 🔧 性能优化3: 缓存数据库查询
 # ========================================
+# 合同列表按页查询：筛选、排序、分页都在数据库中完成，每次只读取并渲染一页，与合同总数无关
+STATUS_FILTERS = {
+    "全部": None,
+    "已完成": "complete",
+    "未完成": "incomplete",
+}
+SORT_ORDERS = {
+    "日期(新→旧)": ("order_date", "desc"),
+    "日期(旧→新)": ("order_date", "asc"),
+    "金额(高→低)": ("total_amount", "desc"),
+    "金额(低→高)": ("total_amount", "asc"),
+}
+PAGE_SIZES = [50, 100, 200]
+CONTRACT_COLUMNS = ["id", "po_number", "order_date", "quantity", "total_amount", "invoiced_amount",
+                    "total_amount_fen", "invoiced_amount_fen", "invoiced_quantity", "invoice_count"]
+INVOICE_COLUMNS = ["id", "spec_model", "quantity", "amount", "status", "created_at", "file_name"]
+
 @st.cache_data(ttl=10)  # 缓存10秒，避免频繁查询
-def get_all_contracts():
-    """获取所有合同及状态（带缓存）"""
-    conn = get_db_connection()
-    query = '''
-        SELECT 
-            c.id, c.po_number, c.order_date, c.quantity, c.total_amount,
-            COALESCE(SUM(i.amount), 0) as invoiced_amount,
-            COALESCE(SUM(i.quantity), 0) as invoiced_quantity,
-            COUNT(i.id) as invoice_count
-        FROM contracts c
-        LEFT JOIN invoices i ON c.id = i.contract_id
-        GROUP BY c.id
-        ORDER BY c.order_date DESC
-    '''
-    df = pd.read_sql_query(query, conn)
-    return df
+def get_contract_stats():
+    """合同总数与已完成数（带缓存）"""
+    stats = repo.contract_stats()
+    return stats["total"], stats["complete"]
+
+@st.cache_data(ttl=10)
+def count_contracts(status_filter):
+    """符合筛选条件的合同数（带缓存）"""
+    return repo.count_contracts(STATUS_FILTERS[status_filter])
+
+@st.cache_data(ttl=10)
+def get_contracts_page(status_filter, sort_by, page, page_size):
+    """获取一页合同及状态（带缓存）"""
+    sort, order = SORT_ORDERS[sort_by]
+    contracts, _ = repo.list_contracts(page_size, status=STATUS_FILTERS[status_filter], sort=sort, order=order,
+                                       offset=(page - 1) * page_size)
+    return pd.DataFrame(contracts, columns=CONTRACT_COLUMNS)
+
+@st.cache_data(ttl=10)
+def get_contract(contract_id):
+    """获取单个合同（详情面板，带缓存）"""
+    return repo.get_contract(contract_id)
+
+def clear_contract_caches():
+    """写入后清除合同相关缓存"""
+    get_contract_stats.clear()
+    count_contracts.clear()
+    get_contracts_page.clear()
+    get_contract.clear()
+
+def status_text(total_amount_fen, invoiced_amount_fen):
+    if total_amount_fen == invoiced_amount_fen:
+        return "🟢 金额一致"
+    return f"🟡 欠 ¥{(total_amount_fen - invoiced_amount_fen) / 100:,.2f}"
 
 @st.cache_data(ttl=10)
 def get_contract_invoices(contract_id):
-    """获取某个合同的所有发票（带缓存）"""
-    conn = get_db_connection()
-    query = '''
-        SELECT spec_model, quantity, amount, status, created_at, file_name
-        FROM invoices 
-        WHERE contract_id = ?
-        ORDER BY created_at DESC
-    '''
-    df = pd.read_sql_query(query, conn, params=(contract_id,))
-    return df
+    """获取某个合同的所有发票（新的在前，带缓存）"""
+    return pd.DataFrame(repo.contract_invoices(contract_id), columns=INVOICE_COLUMNS)
 
 def add_contract(po_number, order_date, quantity, total_amount, file_name):
     """添加合同"""
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute('''INSERT INTO contracts (po_number, order_date, quantity, total_amount, file_name)
-                     VALUES (?, ?, ?, ?, ?)''',
-                  (po_number, order_date, quantity, total_amount, file_name))
-        conn.commit()
-        # 🔧 清除缓存，强制重新查询
-        get_all_contracts.clear()
-        return True, "合同添加成功！"
-    except sqlite3.IntegrityError:
-        return False, "采购单号已存在！"
+        repo.add_contract(po_number, order_date, quantity, total_amount, file_name=file_name)
+    except DataError as e:
+        return False, f"{e}！"
+    # 🔧 清除缓存，强制重新查询
+    clear_contract_caches()
+    return True, "合同添加成功！"
 
 def add_invoice(contract_number, spec_model, quantity, amount, file_name):
-    """添加发票"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT id FROM contracts WHERE po_number = ?", (contract_number,))
-    result = c.fetchone()
-    
-    if not result:
-        return False, f"未找到合同号: {contract_number}"
-    
-    contract_id = result[0]
-    
-    c.execute('''INSERT INTO invoices (contract_id, contract_number, spec_model, quantity, amount, file_name)
-                 VALUES (?, ?, ?, ?, ?, ?)''',
-              (contract_id, contract_number, spec_model, quantity, amount, file_name))
-    conn.commit()
-    
+    """添加发票：入库前按合同核对，有问题的发票照常入库（状态 mismatch）"""
+    try:
+        result = repo.add_invoice(contract_number, spec_model, quantity, amount, file_name=file_name)
+    except DataError as e:
+        return False, str(e)
+
     # 🔧 清除缓存
-    get_all_contracts.clear()
+    clear_contract_caches()
     get_contract_invoices.clear()
-    
+
+    if result["issues"]:
+        return True, "发票已添加，核对发现问题: " + "；".join(result["issues"])
     return True, "发票验证通过并添加！"
 
-# 初始化数据库
-init_db()
+# ========================================
+# 🔧 性能优化6: 数据快照 + 片段局部重跑
+# ========================================
+# 同一份数据在各片段之间只取一次（st.cache_data 每次读取都要反序列化一份拷贝）；片段单独重跑时沿用，
+# 写入后只丢弃受影响的部分（统计、列表页、该合同详情），再整页重跑刷新其它片段
+def snapshot_get(key, load):
+    snapshot = st.session_state.snapshot
+    if key not in snapshot:
+        snapshot[key] = load()
+    return snapshot[key]
+
+def invalidate(contract_id=None, po_number=None):
+    """写入后丢弃统计、列表页和受影响合同的详情，其余数据沿用"""
+    snapshot = st.session_state.snapshot
+    for key in list(snapshot):
+        if key[0] == "detail":
+            contract = snapshot[key][0]
+            if key[1] != contract_id and (contract is None or contract['po_number'] != po_number):
+                continue
+        del snapshot[key]
+
+def rerun_app():
+    """整页重跑以刷新其它片段，沿用已按需失效的快照"""
+    st.session_state.keep_snapshot = True
+    st.rerun()
+
+def load_stats():
+    return snapshot_get(("stats",), get_contract_stats)
+
+def load_page(status_filter, sort_by, page, page_size):
+    return snapshot_get(("page", status_filter, sort_by, page, page_size),
+                        lambda: get_contracts_page(status_filter, sort_by, page, page_size))
+
+def load_count(status_filter):
+    return snapshot_get(("count", status_filter), lambda: count_contracts(status_filter))
+
+def load_detail(contract_id):
+    def load():
+        contract = get_contract(contract_id)
+        return contract, get_contract_invoices(contract_id) if contract else None
+    return snapshot_get(("detail", contract_id), load)
 
 # ========================================
 # 🔧 性能优化4: 优化 session state 管理
 # ========================================
 if 'upload_type' not in st.session_state:
     st.session_state.upload_type = 'contract'
-if 'expanded_contract' not in st.session_state:
-    st.session_state.expanded_contract = None  # 只存储当前展开的合同ID
+if 'selected_contract' not in st.session_state:
+    st.session_state.selected_contract = None  # 只存储当前选中的合同ID
+# 每次整页运行换一份新快照；写入或切换选中合同引起的重跑除外
+if not st.session_state.pop('keep_snapshot', False):
+    st.session_state.snapshot = {}
 
 # 标题
 st.markdown("# 📋 发票检查器")
 st.markdown('<p class="subtitle">采购发票自动化验证系统 ⚡️ 优化版</p>', unsafe_allow_html=True)
 
 # ========================================
-# 侧边栏 - 上传区域
+# 侧边栏 - 上传区域（片段：切换类型、选文件、填表单只重跑这一块）
 # ========================================
-with st.sidebar:
+@st.fragment
+def upload_panel():
     st.markdown("### 📤 文件上传")
+    if repo.read_only:
+        st.info("当前经后端接口只读，请通过后端上传合同和发票")
+        return
     
     upload_type = st.radio(
         "选择上传类型",
@@ -200,8 +231,8 @@ with st.sidebar:
                 st.markdown("##### OCR识别结果")
                 st.caption("(演示版 - 请手动输入)")
                 
-                contracts_df = get_all_contracts()
-                next_po = f"PO-2024{len(contracts_df) + 1:03d}"
+                total_contracts, _ = load_stats()
+                next_po = f"PO-2024{total_contracts + 1:03d}"
                 
                 po_number = st.text_input("采购单号", value=next_po)
                 order_date = st.date_input("订单日期", value=datetime.now())
@@ -220,7 +251,8 @@ with st.sidebar:
                     )
                     if success:
                         st.success(message)
-                        st.rerun()
+                        invalidate()
+                        rerun_app()
                     else:
                         st.error(message)
     
@@ -239,12 +271,12 @@ with st.sidebar:
                 st.markdown("##### OCR识别结果")
                 st.caption("(演示版 - 请手动输入)")
                 
-                contracts_df = get_all_contracts()
-                if len(contracts_df) == 0:
+                total_contracts, _ = load_stats()
+                if total_contracts == 0:
                     st.warning("⚠️ 请先添加合同")
                 else:
-                    contract_options = contracts_df['po_number'].tolist()
-                    contract_number = st.selectbox("关联合同号", contract_options)
+                    # 手填合同号（不把全部合同号下发到下拉框），由 add_invoice 校验
+                    contract_number = st.text_input("关联合同号", value="", placeholder="例: PO-2024001")
                     spec_model = st.text_input("规格型号", value="SKU-A001")
                     quantity = st.number_input("数量", min_value=1, value=50, step=1)
                     amount = st.number_input("发票金额(¥)", min_value=0.0, value=25000.0, step=1000.0)
@@ -253,7 +285,7 @@ with st.sidebar:
                     
                     if submitted:
                         success, message = add_invoice(
-                            contract_number,
+                            contract_number.strip(),
                             spec_model,
                             quantity,
                             amount,
@@ -261,100 +293,135 @@ with st.sidebar:
                         )
                         if success:
                             st.success(message)
-                            st.rerun()
+                            invalidate(po_number=contract_number.strip())
+                            rerun_app()
                         else:
                             st.error(message)
-    
+
+# ========================================
+# 侧边栏 - 统计
+# ========================================
+@st.fragment
+def stats_panel():
     st.markdown("---")
     st.markdown("### 📊 统计")
-    contracts_df = get_all_contracts()
+    total_contracts, completed = load_stats()
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("合同总数", len(contracts_df))
+        st.metric("合同总数", total_contracts)
     with col2:
-        completed = len(contracts_df[abs(contracts_df['total_amount'] - contracts_df['invoiced_amount']) < 0.01]) if len(contracts_df) > 0 else 0
         st.metric("已完成", completed)
 
+# ========================================
+# 合同列表（片段：筛选、排序、翻页只重跑这一块）
+# ========================================
+@st.fragment
+def contract_list():
+    # 添加筛选
+    col1, col2, col3, col4 = st.columns([2, 2, 1.5, 2.5])
+    with col1:
+        status_filter = st.selectbox("状态筛选", list(STATUS_FILTERS))
+    with col2:
+        sort_by = st.selectbox("排序", list(SORT_ORDERS))
+    with col3:
+        page_size = st.selectbox("每页", PAGE_SIZES)
+    total = load_count(status_filter)
+    pages = max(1, -(-total // page_size))
+    with col4:
+        page = st.number_input(f"页码（共 {pages} 页，{total} 个合同）", min_value=1, max_value=pages, value=1, step=1)
+
+    # 🔧 性能优化5: 一页合同只渲染一个表格（前端虚拟滚动），选中一行在右侧显示详情
+    page_df = load_page(status_filter, sort_by, int(page), page_size)
+    table = pd.DataFrame({
+        "状态": [status_text(total_fen, invoiced_fen) for total_fen, invoiced_fen
+                 in zip(page_df['total_amount_fen'], page_df['invoiced_amount_fen'])],
+        "采购单号": page_df['po_number'],
+        "订单日期": page_df['order_date'],
+        "数量": page_df['quantity'],
+        "合同金额": page_df['total_amount'],
+        "已开票": page_df['invoiced_amount'],
+        "发票数": page_df['invoice_count'],
+    })
+    event = st.dataframe(
+        table,
+        key="contracts_table",
+        hide_index=True,
+        use_container_width=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        column_config={
+            "合同金额": st.column_config.NumberColumn(format="¥%.2f"),
+            "已开票": st.column_config.NumberColumn(format="¥%.2f"),
+        },
+    )
+    # 表格数据变化（换页、开票）时 Streamlit 会清空选中行，选中的合同另存一份；
+    # 选中另一个合同时整页重跑，让详情片段跟着刷新
+    if event.selection.rows:
+        contract_id = int(page_df['id'].iloc[event.selection.rows[0]])
+        if contract_id != st.session_state.selected_contract:
+            st.session_state.selected_contract = contract_id
+            rerun_app()
+
+# ========================================
+# 合同详情
+# ========================================
+@st.fragment
+def contract_detail():
+    contract, invoices_df = None, None
+    if st.session_state.selected_contract is not None:
+        contract, invoices_df = load_detail(st.session_state.selected_contract)
+    if contract is None:
+        st.info("👈 选中左侧表格中的一行查看合同详情")
+        return
+
+    st.markdown(f"### {contract['po_number']}")
+    st.caption(f"订单日期: {contract['order_date']} | 数量: {contract['quantity']} | "
+               f"已开票数量: {contract['invoiced_quantity']}")
+    m1, m2 = st.columns(2)
+    with m1:
+        st.metric("合同金额", f"¥{contract['total_amount_fen'] / 100:,.2f}")
+    with m2:
+        st.metric("已开票", f"¥{contract['invoiced_amount_fen'] / 100:,.2f}")
+    if contract['total_amount_fen'] == contract['invoiced_amount_fen']:
+        st.success("✓ 金额一致")
+    else:
+        st.warning(f"欠 ¥{(contract['total_amount_fen'] - contract['invoiced_amount_fen']) / 100:,.2f}")
+
+    st.markdown(f"##### 发票明细 ({contract['invoice_count']}张)")
+    if len(invoices_df) > 0:
+        # 🔧 使用 DataFrame 显示，比循环快
+        display_df = invoices_df[['spec_model', 'quantity', 'amount', 'created_at']].copy()
+        display_df.columns = ['规格型号', '数量', '金额', '创建时间']
+        display_df['金额'] = display_df['金额'].apply(lambda x: f"¥{x:,.2f}")
+        display_df['创建时间'] = display_df['创建时间'].str[:10]
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
+    else:
+        st.info("暂无发票")
+
+with st.sidebar:
+    upload_panel()
+    stats_panel()
+
 # ========================================
 # 主区域 - 合同列表
 # ========================================
 st.markdown("## 📑 合同列表")
 
-contracts_df = get_all_contracts()
-
-if len(contracts_df) == 0:
+if load_stats()[0] == 0:
     st.info("📭 暂无合同数据，请在左侧上传合同文件")
 else:
-    # 添加筛选
-    col1, col2, col3 = st.columns([2, 2, 6])
-    with col1:
-        status_filter = st.selectbox("状态筛选", ["全部", "已完成", "未完成"])
-    with col2:
-        sort_by = st.selectbox("排序", ["日期(新→旧)", "日期(旧→新)", "金额(高→低)", "金额(低→高)"])
-    
-    # 应用筛选
-    filtered_df = contracts_df.copy()
-    if status_filter == "已完成":
-        filtered_df = filtered_df[abs(filtered_df['total_amount'] - filtered_df['invoiced_amount']) < 0.01]
-    elif status_filter == "未完成":
-        filtered_df = filtered_df[abs(filtered_df['total_amount'] - filtered_df['invoiced_amount']) >= 0.01]
-    
-    # 应用排序
-    if "旧→新" in sort_by:
-        filtered_df = filtered_df.sort_values('order_date', ascending=True)
-    elif "金额(高→低)" in sort_by:
-        filtered_df = filtered_df.sort_values('total_amount', ascending=False)
-    elif "金额(低→高)" in sort_by:
-        filtered_df = filtered_df.sort_values('total_amount', ascending=True)
-    
     st.markdown("---")
-    
-    # 🔧 性能优化5: 使用 container 和 expander 减少重渲染
-    for _, row in filtered_df.iterrows():
-        is_complete = abs(row['total_amount'] - row['invoiced_amount']) < 0.01
-        status_emoji = "🟢" if is_complete else "🟡"
-        status_text = "✓ 金额一致" if is_complete else f"欠 ¥{row['total_amount'] - row['invoiced_amount']:,.2f}"
-        
-        with st.container():
-            col1, col2, col3, col4, col5, col6 = st.columns([0.3, 1.5, 1, 1, 1.5, 1.2])
-            
-            with col1:
-                st.markdown(f"<h2 style='margin:0;'>{status_emoji}</h2>", unsafe_allow_html=True)
-            with col2:
-                st.markdown(f"**{row['po_number']}**")
-            with col3:
-                st.text(row['order_date'])
-            with col4:
-                st.text(f"数量: {row['quantity']}")
-            with col5:
-                st.markdown(f"**¥{row['total_amount']:,.2f}**")
-            with col6:
-                if is_complete:
-                    st.success(status_text)
-                else:
-                    st.warning(status_text)
-            
-            # 使用 expander 替代按钮控制，减少交互开销
-            with st.expander(f"📋 查看发票明细 ({int(row['invoice_count'])}张)"):
-                invoices_df = get_contract_invoices(row['id'])
-                if len(invoices_df) > 0:
-                    st.markdown("##### 发票明细")
-                    # 🔧 使用 DataFrame 显示，比循环快
-                    display_df = invoices_df[['spec_model', 'quantity', 'amount', 'created_at']].copy()
-                    display_df.columns = ['规格型号', '数量', '金额', '创建时间']
-                    display_df['金额'] = display_df['金额'].apply(lambda x: f"¥{x:,.2f}")
-                    display_df['创建时间'] = display_df['创建时间'].str[:10]
-                    st.dataframe(display_df, use_container_width=True, hide_index=True)
-                else:
-                    st.info("暂无发票")
-            
-            st.markdown("---")
+    list_col, detail_col = st.columns([3, 2])
+    with list_col:
+        contract_list()
+    with detail_col:
+        contract_detail()
 
 # 页脚
 st.markdown("---")
 st.markdown("""
 <div style='text-align: center; color: #6B7280; padding: 1rem;'>
     <p>💪 发票检查器 v0.2.0 | Streamlit 优化版 ⚡️</p>
-    <p><small>性能优化: 数据库连接池 | 查询缓存 | CSS缓存 | 减少重渲染</small></p>
+    <p><small>性能优化: 共用数据访问层 | 查询缓存 | CSS缓存 | 分页表格 | 片段局部重跑</small></p>
 </div>
 """, unsafe_allow_html=True)